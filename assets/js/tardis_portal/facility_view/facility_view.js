@@ -131,7 +131,17 @@ angular
         } else {
             vm.currentFetchLimit += increment;
         }
-        vm.fetchFacilityData(vm.datasets.length, vm.currentFetchLimit, true);
+        // Continue from the oldest dataset loaded so far, rather than
+        // from an offset, which gets slower with every page.  If no
+        // datasets were listed yet, there is nothing to continue from.
+        var oldestDatasetId;
+        if (vm.datasets && vm.datasets.length > 0) {
+            oldestDatasetId = Math.min.apply(null, vm.datasets.map(function(dataset) {
+                return dataset.id;
+            }));
+        }
+        vm.fetchFacilityData(vm.datasets ? vm.datasets.length : 0,
+                             vm.currentFetchLimit, true, oldestDatasetId);
     };
 
     // Fetch the list of facilities available to the user and facilities data
@@ -151,7 +161,7 @@ angular
     }
 
     // Fetch data for facility
-    vm.fetchFacilityData = function(startIndex, endIndex, append) {
+    vm.fetchFacilityData = function(startIndex, endIndex, append, before) {
 
         delete vm.visibleFileList;
         vm.loading = true;
@@ -167,11 +177,15 @@ angular
                 $log.error("Could not fetch total dataset count");
             });
 
-        facilityDataRes.get({
+        var params = {
             'facilityId': vm.selectedFacility,
             'startIndex': startIndex,
             'endIndex': endIndex
-        }).$promise.then(function(data) {
+        };
+        if (angular.isDefined(before)) {
+            params.before = before;
+        }
+        facilityDataRes.get(params).$promise.then(function(data) {
             $log.debug("Fetched datasets between indices " + startIndex + " and " + endIndex);
             if (append && vm.datasets) {
                 vm.datasets = vm.datasets.concat(data.slice(0, data.length));
@@ -0,0 +1,126 @@
+"""
+Background delivery of analytics hits
+
+Hits are queued in memory and sent in batches by a daemon thread, so
+tracking a download or an SFTP session never waits for the analytics
+service.  If the queue is full, because the service is slow or down,
+new hits are dropped.
+"""
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+
+class FileSink(object):
+    """
+    Writes each hit as a line of JSON to ANALYTICS_FILE, or to stdout if
+    it isn't set.  Useful for testing and for feeding other log pipelines.
+    """
+    def __init__(self):
+        self.path = getattr(settings, 'ANALYTICS_FILE', None)
+
+    def send(self, hits):
+        lines = ''.join(json.dumps(hit, sort_keys=True) + '\n'
+                        for hit in hits)
+        if self.path is None:
+            sys.stdout.write(lines)
+            sys.stdout.flush()
+        else:
+            with open(self.path, 'a') as log_file:
+                log_file.write(lines)
+
+
+class Dispatcher(object):
+    """
+    Queues hits for a sink, which is sent lists of up to
+    ANALYTICS_BATCH_SIZE hits from a background thread.  Each hit is a
+    dict, with the time at which it was queued in its '_queued' key.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self.dropped = 0
+
+    def put(self, hit):
+        """
+        Queues a hit without blocking, returning False if it was dropped
+        """
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(dict(hit, _queued=time.time()))
+        except queue.Full:
+            self.dropped += 1
+            logger.debug('Analytics queue is full, dropped hit: %s', hit)
+            return False
+        return True
+
+    def flush(self, timeout=None):
+        """
+        Waits until the hits queued so far have been sent
+        """
+        if self._queue is None or self._pid != os.getpid():
+            return
+        self._ensure_started()
+        done = threading.Event()
+        try:
+            self._queue.put(done, timeout=timeout)
+        except queue.Full:
+            return
+        done.wait(timeout)
+
+    def _ensure_started(self):
+        # A worker process forked from a process which had started the
+        # thread inherits the queue but not the thread, so each process
+        # starts its own:
+        if self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._queue = queue.Queue(
+                maxsize=getattr(settings, 'ANALYTICS_QUEUE_SIZE', 1000))
+            self._thread = threading.Thread(
+                target=self._run, args=(self._queue,),
+                name='analytics-dispatcher', daemon=True)
+            self._pid = os.getpid()
+            self._thread.start()
+
+    def _run(self, hits):
+        sink = import_string(getattr(
+            settings, 'ANALYTICS_SINK',
+            'tardis.analytics.ga.GoogleAnalyticsSink'))()
+        batch_size = getattr(settings, 'ANALYTICS_BATCH_SIZE', 20)
+        while True:
+            batch = [hits.get()]
+            # Send whatever else has been queued in the meantime with it:
+            while len(batch) < batch_size:
+                try:
+                    batch.append(hits.get_nowait())
+                except queue.Empty:
+                    break
+            waiting = [item for item in batch
+                       if isinstance(item, threading.Event)]
+            batch = [item for item in batch
+                     if not isinstance(item, threading.Event)]
+            if batch:
+                try:
+                    sink.send(batch)
+                except Exception:
+                    logger.exception('Failed to send %d analytics hits',
+                                     len(batch))
+            for done in waiting:
+                done.set()
+
+
+dispatcher = Dispatcher()
@@ -4,18 +4,67 @@ Google analyitics tracking
 
 import logging
 import random
+import time
+from urllib.parse import urlencode
+
 import requests
 
 from django.conf import settings
 
+from .dispatcher import dispatcher
+
 GA_ID = getattr(settings, 'GOOGLE_ANALYTICS_ID', None)
 GA_USER_TRACKING = getattr(settings, 'GOOGLE_ANALYTICS_USER_TRACKING', False)
+GA_BATCH_URL = 'https://www.google-analytics.com/batch'
+GA_BATCH_MAX_HITS = 20
+GA_BATCH_MAX_BYTES = 16 * 1024
 
 logger = logging.getLogger(__name__)
 
 
+class GoogleAnalyticsSink(object):
+    """
+    Sends hits to the Measurement Protocol's batch endpoint, with up to 20
+    hits and 16 KB per request.  Each hit's queue time is reported in its
+    'qt' parameter, so GA records it at the time it happened.
+    """
+    def __init__(self):
+        self.session = requests.Session()
+        self.timeout = getattr(settings, 'ANALYTICS_TIMEOUT', 5)
+
+    def send(self, hits):
+        lines = []
+        size = 0
+        for hit in hits:
+            hit = dict(hit)
+            queued = hit.pop('_queued', None)
+            if queued is not None:
+                hit['qt'] = max(0, int((time.time() - queued) * 1000))
+            line = urlencode(hit)
+            if lines and (len(lines) == GA_BATCH_MAX_HITS or
+                          size + len(line) + 1 > GA_BATCH_MAX_BYTES):
+                self._post(lines)
+                lines = []
+                size = 0
+            lines.append(line)
+            size += len(line) + 1
+        if lines:
+            self._post(lines)
+
+    def _post(self, lines):
+        try:
+            response = self.session.post(
+                GA_BATCH_URL, data='\n'.join(lines), timeout=self.timeout)
+            response.raise_for_status()
+        except requests.RequestException as e:
+            logger.debug('Google analytics error: %s, %d hits dropped',
+                         e, len(lines))
+
+
 def _track_event(payload, cid=None, uid=None):
     """
+    Queues a hit, which is sent in the background by the dispatcher
+
     example_payload = {
         't': 'event',
         'ec': 'category',
@@ -46,12 +95,7 @@ def _track_event(payload, cid=None, uid=None):
         })
     data.update(payload)
 
-    try:
-        response = requests.post(
-            'http://www.google-analytics.com/collect', data=data)
-        response.raise_for_status()
-    except (requests.ConnectionError, requests.HTTPError) as e:
-        logger.debug('Google analytics error: %s, payload: %s' % (e, data))
+    dispatcher.put(data)
 
 
 def track_login(label, session_id, ip, user):
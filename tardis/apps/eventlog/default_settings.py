@@ -1,2 +1,26 @@
 ENABLE_EVENTLOG = False
 EVENTLOG_ACTIONS = []
+'''
+The names of the actions to log, or an empty list to log all of them.
+Archive downloads and bulk registrations are logged as one
+"BULK_DOWNLOAD_DATAFILES" or "BULK_UPLOAD_DATAFILES" event per archive or
+dataset, which refers to the downloaded experiment or dataset (if any)
+and has the number of files in extra["count"].  Single files are logged as
+"DOWNLOAD_DATAFILE" and "UPLOAD_DATAFILE" events with the file's ID in
+extra["id"].
+'''
+
+EVENTLOG_BUFFER_SIZE = 100
+'''
+The number of events buffered in memory by each process before they are
+written with a single bulk insert.  Buffered events are also written when
+a request finishes, when EVENTLOG_FLUSH_INTERVAL has passed since the
+oldest buffered event was logged and when the process exits.  Set to 1 to
+write each event as it is logged.
+'''
+
+EVENTLOG_FLUSH_INTERVAL = 10
+'''
+The maximum number of seconds an event is buffered before the buffer is
+written, checked whenever another event is logged.
+'''
@@ -0,0 +1,53 @@
+'''
+Testing the eventlog app's buffered event writer
+'''
+from django.contrib.auth.models import User
+from django.core.signals import request_finished
+from django.test import TestCase, override_settings
+
+from ..models import Action, Log
+from ..utils import log, log_bulk, writer
+
+
+@override_settings(EVENTLOG_BUFFER_SIZE=3, EVENTLOG_FLUSH_INTERVAL=60)
+class EventLogWriterTestCase(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('testuser', '', 'secret')
+
+    def test_buffered_events(self):
+        Action.objects.create(name="LOGIN")
+        log("LOGIN", user=self.user)
+        log("LOGIN", user=self.user)
+        self.assertEqual(Log.objects.count(), 0)
+        # One query to look up the Action, and one to insert the events:
+        with self.assertNumQueries(2):
+            log("LOGIN", user=self.user)
+        self.assertEqual(
+            Log.objects.filter(action__name="LOGIN", user=self.user).count(),
+            3)
+
+    def test_flush_on_request_finished(self):
+        log("LOGIN", user=self.user)
+        self.assertEqual(Log.objects.count(), 0)
+        request_finished.send(sender=self.__class__)
+        self.assertEqual(Log.objects.count(), 1)
+
+    @override_settings(EVENTLOG_BUFFER_SIZE=1)
+    def test_unbuffered_events(self):
+        event = log("LOGIN", user=self.user)
+        self.assertIsNotNone(event.pk)
+        self.assertEqual(event.action.name, "LOGIN")
+
+    @override_settings(EVENTLOG_ACTIONS=["BULK_DOWNLOAD_DATAFILES"])
+    def test_log_bulk(self):
+        self.assertIsNone(log_bulk("LOGIN", 2, user=self.user))
+        self.assertIsNone(
+            log_bulk("BULK_DOWNLOAD_DATAFILES", 0, user=self.user))
+        log_bulk("BULK_DOWNLOAD_DATAFILES", 3, user=self.user, obj=self.user,
+                 extra={"type": "tar"})
+        writer.flush()
+        event = Log.objects.get()
+        self.assertEqual(event.action.name, "BULK_DOWNLOAD_DATAFILES")
+        self.assertEqual(event.object_id, self.user.id)
+        self.assertEqual(event.extra, {"type": "tar", "count": 3})
@@ -1,9 +1,83 @@
+import atexit
+import logging
+import threading
+import time
+
 from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
+from django.core.signals import request_finished, setting_changed
+from django.dispatch import receiver
 
 from .models import Action, Log
 from .signals import event_logged
 
+logger = logging.getLogger(__name__)
+
+
+class EventLogWriter:
+    '''
+    Buffers events in memory and writes them with bulk_create once
+    EVENTLOG_BUFFER_SIZE events have been logged or the oldest buffered
+    event is more than EVENTLOG_FLUSH_INTERVAL seconds old.  The buffer
+    is also flushed when each request finishes and when the process exits,
+    so events are written after the response rather than before it.
+
+    The ids of the buffered events' Actions are looked up with a single
+    query per flush rather than a get_or_create per event.  They aren't
+    cached between flushes, because cached ids would outlive Actions
+    which have been deleted or rolled back.
+    '''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._events = []
+        self._first_logged = None
+
+    def write(self, action, event):
+        buffer_size = getattr(settings, "EVENTLOG_BUFFER_SIZE", 0)
+        if buffer_size <= 1:
+            event.action_id = self._get_action_ids([action])[action]
+            event.save()
+            event_logged.send(sender=Log, event=event)
+            return
+        flush_interval = getattr(settings, "EVENTLOG_FLUSH_INTERVAL", 0)
+        with self._lock:
+            self._events.append((action, event))
+            if self._first_logged is None:
+                self._first_logged = time.monotonic()
+            full = len(self._events) >= buffer_size or \
+                time.monotonic() - self._first_logged >= flush_interval
+        if full:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            events = self._events
+            self._events = []
+            self._first_logged = None
+        if not events:
+            return
+        action_ids = self._get_action_ids({action for action, _ in events})
+        for action, event in events:
+            event.action_id = action_ids[action]
+        Log.objects.bulk_create(
+            [event for _, event in events],
+            batch_size=getattr(settings, "EVENTLOG_BUFFER_SIZE", 0))
+        for _, event in events:
+            event_logged.send(sender=Log, event=event)
+
+    @staticmethod
+    def _get_action_ids(names):
+        action_ids = dict(Action.objects.filter(name__in=names)
+                          .values_list("name", "id"))
+        for name in names:
+            if name not in action_ids:
+                action_ids[name] = \
+                    Action.objects.get_or_create(name=name)[0].id
+        return action_ids
+
+
+writer = EventLogWriter()
+
 
 def log(action, user=None, obj=None, extra=None, request=None):
 
@@ -29,19 +103,55 @@ def log(action, user=None, obj=None, extra=None, request=None):
     if request is not None:
         extra = {**extra, **get_request_data(request)}
 
-    event = Log.objects.create(
-        action=Action.objects.get_or_create(name=action)[0],
+    event = Log(
         user=user,
         content_type=content_type,
         object_id=object_id,
         extra=extra
     )
 
-    event_logged.send(sender=Log, event=event)
+    writer.write(action, event)
 
     return event
 
 
+def log_bulk(action, count, user=None, obj=None, extra=None, request=None):
+    '''
+    Logs a single event summarising an action on many objects, e.g. the
+    DataFiles in a downloaded archive, instead of one event per object.
+    The event refers to the object containing them (e.g. the downloaded
+    experiment or dataset), if any, and stores their number in
+    extra["count"], so its size doesn't depend on the number of objects.
+    Bulk actions have their own names, e.g. "BULK_DOWNLOAD_DATAFILES",
+    because their extra data differs from that of the single-object
+    actions.
+    '''
+    if not count:
+        return None
+    return log(action, user=user, obj=obj,
+               extra={**(extra or {}), "count": count},
+               request=request)
+
+
+@receiver(request_finished, dispatch_uid="eventlog_flush")
+def flush_on_request_finished(sender, **kwargs):
+    writer.flush()
+
+
+@receiver(setting_changed, dispatch_uid="eventlog_setting_changed")
+def flush_on_setting_changed(setting, **kwargs):
+    if setting.startswith("EVENTLOG_"):
+        writer.flush()
+
+
+@atexit.register
+def flush_on_exit():
+    try:
+        writer.flush()
+    except Exception:
+        logger.exception("Failed to write buffered events")
+
+
 def get_request_data(request):
     data = {}
 
@@ -0,0 +1,14 @@
+from django.contrib import admin
+
+from .models import RecallRequest
+
+
+class RecallRequestAdmin(admin.ModelAdmin):
+    raw_id_fields = ["user", "dataset", "experiment"]
+    list_filter = ["status", "created_time"]
+    list_display = ["created_time", "user", "dataset", "experiment",
+                    "status", "total_files", "recalled_files",
+                    "failed_files"]
+
+
+admin.site.register(RecallRequest, RecallRequestAdmin)
@@ -13,11 +13,14 @@ from tastypie.utils import trailing_slash
 
 import tardis.tardis_portal.api
 from tardis.tardis_portal.auth.decorators import has_datafile_download_access, has_dataset_download_access
+from tardis.tardis_portal.auth.decorators import has_experiment_download_access
 from tardis.tardis_portal.models.dataset import Dataset
 from tardis.tardis_portal.models.datafile import DataFileObject
+from tardis.tardis_portal.models.experiment import Experiment
 
 from .check import dfo_online
 from .email_text import email_dataset_recall_requested
+from .recall import request_recall
 from .tasks import dfo_recall
 
 logger = logging.getLogger(__name__)
@@ -178,7 +181,8 @@ class DatasetAppResource(tardis.tardis_portal.api.DatasetResource):
 
     def dataset_recall(self, request, **kwargs):
         """
-        Send and email to Site admin to recall Dataset from HSM system
+        Queue the recall of a Dataset's files from HSM system, and send an
+        email to Site admin
         """
         from .exceptions import HsmException
 
@@ -191,6 +195,8 @@ class DatasetAppResource(tardis.tardis_portal.api.DatasetResource):
                 request=request, dataset_id=ds.id):
             return HttpResponseForbidden()
 
+        recall_request = request_recall(request.user, dataset=ds)
+
         """
         send an email to MyTardis admin
         """
@@ -220,5 +226,59 @@ class DatasetAppResource(tardis.tardis_portal.api.DatasetResource):
             )
 
         return JsonResponse({
-            "message": "Recall requested for Dataset %s" % ds.id
+            "message": "Recall requested for Dataset %s" % ds.id,
+            "recall_request": recall_request.id
+        })
+
+
+class ExperimentAppResource(tardis.tardis_portal.api.ExperimentResource):
+    '''Extends MyTardis's API for Experiments, adding in a method to recall
+    all of an experiment's files from a Hierarchical Storage Management (HSM)
+    system
+    '''
+
+    class Meta(tardis.tardis_portal.api.ExperimentResource.Meta):
+        # This will be mapped to hsm_experiment by MyTardis's urls.py:
+        resource_name = 'experiment'
+        authorization = tardis.tardis_portal.api.ACLAuthorization()
+        queryset = Experiment.objects.all()
+
+    def prepend_urls(self):
+        return [
+            url(r"^(?P<resource_name>%s)/(?P<pk>\w[\w/-]*)/recall%s$" %
+                (self._meta.resource_name, trailing_slash()),
+                self.wrap_view('experiment_recall'),
+                name="hsm_api_experiment_recall"),
+        ]
+
+    def experiment_recall(self, request, **kwargs):
+        """
+        Queue the recall of an Experiment's files from HSM system
+        """
+        self.method_check(request, allowed=['get'])
+        self.is_authenticated(request)
+        self.throttle_check(request)
+
+        experiment = Experiment.objects.get(id=kwargs['pk'])
+        if not has_experiment_download_access(
+                request=request, experiment_id=experiment.id):
+            return HttpResponseForbidden()
+
+        recall_request = request_recall(request.user, experiment=experiment)
+
+        # Log recall event
+        if getattr(settings, "ENABLE_EVENTLOG", False):
+            from tardis.apps.eventlog.utils import log
+            log(
+                action="RECALL",
+                extra={
+                    "type": "experiment",
+                    "id": experiment.id
+                },
+                request=request
+            )
+
+        return JsonResponse({
+            "message": "Recall requested for Experiment %s" % experiment.id,
+            "recall_request": recall_request.id
         })
@@ -1,21 +1,30 @@
 # -*- coding: utf-8 -*-
 
-"""HSM check module.  Method for detecting whether a MyTardis
-DataFileObject in Hierarchical Storage Management is online or
+"""HSM check module.  Methods for detecting whether MyTardis
+DataFileObjects in Hierarchical Storage Management are online or
 offline (on tape).
+
+The online status of each file is stored in the HsmOnlineStatus table
+and reused for HSM_ONLINE_STATUS_TTL seconds.  Files whose status needs
+checking are checked with a pool of HSM_ONLINE_CHECK_WORKERS threads.
 """
 import logging
 import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
 
+from django.conf import settings
 from django.core.files.storage import get_storage_class
+from django.db.models.query import QuerySet
+from django.utils import timezone
 
-from tardis.tardis_portal.models import DataFile
 from tardis.tardis_portal.models import DataFileObject
 from tardis.tardis_portal.models import StorageBox
 from tardis.tardis_portal.models import StorageBoxOption
 
 from .exceptions import (DataFileObjectNotVerified,
                          StorageClassNotSupportedError)
+from .models import HsmOnlineStatus
 from .storage import HsmFileSystemStorage
 from .utils import file_is_online
 
@@ -49,8 +58,14 @@ def dfo_online(dfo):  # pylint: disable=R1710
         if issubclass(storage_class, HsmFileSystemStorage):
             try:
                 location = dfo.storage_box.options.get(key="location").value
+                cutoff = _get_status_cutoff()
+                if cutoff is not None:
+                    status = HsmOnlineStatus.objects.filter(
+                        dfo=dfo, checked__gte=cutoff).first()
+                    if status is not None:
+                        return status.online
                 filepath = os.path.join(location, dfo.uri)
-                return file_is_online(filepath)
+                return files_online({dfo.id: filepath})[dfo.id]
             except StorageBoxOption.DoesNotExist:
                 logger.debug("DataFileObject with id %s doesn't have a file"
                              "system path/location", dfo.id)
@@ -82,30 +97,150 @@ def dataset_online_count(dataset):
     int
         The number of online files in this dataset
     """
-    online_count =  DataFile.objects.filter(dataset=dataset).count()
+    return sum(1 for online in datafiles_online(
+        dataset.datafile_set.all()).values() if online)
+
 
-    files_to_scan = []
+def datafiles_online(datafiles):
+    """Checks which of a collection of DataFiles are online, with a few
+    queries regardless of the number of files
 
-    sb_ids = [box['storage_box'] for box in DataFileObject.objects.filter(
-              datafile__dataset=dataset,
-              verified=True).values('storage_box').distinct()]
-    for sb_id in sb_ids:
-        box = StorageBox.objects.get(id=sb_id)
-        storage_class = get_storage_class(box.django_storage_class)
-        if not issubclass(storage_class, HsmFileSystemStorage):
+    Like DataFile.is_online, a DataFile is online if any of its verified
+    DataFileObjects is online, or if it has no verified DataFileObjects.
+
+    Parameters
+    ----------
+    datafiles : QuerySet or iterable of int
+        The DataFiles, or their IDs, for which to check the status
+
+    Returns
+    -------
+    dict
+        The online status of each DataFile, keyed by DataFile ID
+    """
+    batch_size = getattr(settings, 'HSM_ONLINE_CHECK_BATCH_SIZE', 500)
+    if isinstance(datafiles, QuerySet):
+        datafile_ids = list(datafiles.values_list('id', flat=True))
+        batches = [datafiles.values('id')]
+    else:
+        datafile_ids = list(datafiles)
+        batches = [datafile_ids[i:i + batch_size]
+                   for i in range(0, len(datafile_ids), batch_size)]
+    online = dict.fromkeys(datafile_ids, False)
+
+    dfos = []
+    for batch in batches:
+        dfos.extend(DataFileObject.objects.filter(
+            datafile__in=batch, verified=True).values_list(
+                'id', 'datafile_id', 'storage_box_id', 'uri',
+                'hsm_online_status__online', 'hsm_online_status__checked'))
+    with_dfos = set()
+    box_ids = set()
+    for _, datafile_id, box_id, _, _, _ in dfos:
+        with_dfos.add(datafile_id)
+        box_ids.add(box_id)
+    for datafile_id in datafile_ids:
+        if datafile_id not in with_dfos:
+            online[datafile_id] = True
+
+    hsm_locations = {}
+    online_box_ids = set()
+    for box in StorageBox.objects.filter(id__in=box_ids).prefetch_related(
+            'attributes', 'options'):
+        if issubclass(get_storage_class(box.django_storage_class),
+                      HsmFileSystemStorage):
+            hsm_locations[box.id] = next(
+                (option.value for option in box.options.all()
+                 if option.key == 'location'), None)
+        elif box.storage_type not in StorageBox.offline_types:
+            online_box_ids.add(box.id)
+    for _, datafile_id, box_id, _, _, _ in dfos:
+        if box_id in online_box_ids:
+            online[datafile_id] = True
+
+    # Use the stored statuses of HSM files which have been checked
+    # recently, and only check the others if their DataFiles aren't known
+    # to be online already:
+    cutoff = _get_status_cutoff()
+    to_check = []
+    for dfo_id, datafile_id, box_id, uri, status, checked in dfos:
+        if hsm_locations.get(box_id) is None or not uri:
             continue
-        location = StorageBox.objects.get(
-            id=sb_id).options.get(key='location').value
-        datafiles_path = DataFileObject.objects.filter(
-            datafile__dataset=dataset, storage_box__id=sb_id, verified=True).values_list('uri', flat=True)
-        for uri_prefix in datafiles_path:
-            files_to_scan.append(os.path.join(location, uri_prefix))
-
-    # Absolute paths to executables are used for increased security.
-    # See Bandit's B607: start_process_with_partial_path
-    for file_path in files_to_scan:
-        is_online = file_is_online(file_path)
-        if not is_online:
-            online_count -= 1
-
-    return online_count
+        if cutoff is not None and checked is not None and checked >= cutoff:
+            if status:
+                online[datafile_id] = True
+        else:
+            to_check.append((dfo_id, datafile_id,
+                             os.path.join(hsm_locations[box_id], uri)))
+    to_check = [(dfo_id, datafile_id, path)
+                for dfo_id, datafile_id, path in to_check
+                if not online[datafile_id]]
+    statuses = files_online(
+        {dfo_id: path for dfo_id, _, path in to_check})
+    for dfo_id, datafile_id, _ in to_check:
+        if statuses[dfo_id]:
+            online[datafile_id] = True
+    return online
+
+
+def files_online(paths):
+    """Checks whether the files of DataFileObjects are online, and stores
+    their statuses for reuse if HSM_ONLINE_STATUS_TTL is set
+
+    Parameters
+    ----------
+    paths : dict
+        Paths to the files to check, keyed by DataFileObject ID
+
+    Returns
+    -------
+    dict
+        The online status of each file, as returned by file_is_online,
+        keyed by DataFileObject ID
+    """
+    if not paths:
+        return {}
+    dfo_ids = list(paths)
+    workers = min(getattr(settings, 'HSM_ONLINE_CHECK_WORKERS', 1),
+                  len(dfo_ids))
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            statuses = dict(zip(dfo_ids, executor.map(
+                file_is_online, (paths[dfo_id] for dfo_id in dfo_ids))))
+    else:
+        statuses = {dfo_id: file_is_online(paths[dfo_id])
+                    for dfo_id in dfo_ids}
+
+    if _get_status_cutoff() is not None:
+        checked = timezone.now()
+        batch_size = getattr(settings, 'HSM_ONLINE_CHECK_BATCH_SIZE', 500)
+        for i in range(0, len(dfo_ids), batch_size):
+            batch = dfo_ids[i:i + batch_size]
+            HsmOnlineStatus.objects.filter(dfo_id__in=batch).delete()
+            HsmOnlineStatus.objects.bulk_create(
+                [HsmOnlineStatus(dfo_id=dfo_id, online=statuses[dfo_id],
+                                 checked=checked)
+                 for dfo_id in batch],
+                ignore_conflicts=True)
+    return statuses
+
+
+def forget_dfo_online(dfo):
+    """Discards the stored online status of a DataFileObject's file, e.g.
+    after requesting a recall
+
+    Parameters
+    ----------
+    dfo : DataFileObject
+        The DataFileObject whose status may have changed
+    """
+    HsmOnlineStatus.objects.filter(dfo=dfo).delete()
+
+
+def _get_status_cutoff():
+    """Returns the time after which stored statuses are reused, or None if
+    HSM_ONLINE_STATUS_TTL is 0"""
+    ttl = getattr(settings, 'HSM_ONLINE_STATUS_TTL', 0)
+    if not ttl:
+        return None
+    return timezone.now() - timedelta(seconds=ttl)
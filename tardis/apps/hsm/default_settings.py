@@ -51,6 +51,21 @@ User {user} has requested to recall dataset {dataset} from HSM vault.
 The path to the dataset is {path}
 
 
+Regards,
+{site_title} Team.
+'''),
+    'recall_request_complete': ('[{site_title}] Recall of {name} complete',
+                                '''\
+Dear {first_name} {last_name},
+
+{recalled_files} of the {total_files} archived files in {name} have been \
+recalled from the archive, and {failed_files} could not be recalled.
+
+It can be viewed at: {url}
+
+Please contact {support_email} if any files are not available to \
+download, or if you did not request this recall.
+
 Regards,
 {site_title} Team.
 '''),
@@ -70,3 +85,30 @@ Regards,
                              '''
                              )
 }
+
+HSM_ONLINE_STATUS_TTL = 300
+'''
+The number of seconds for which the online status of a file in an HSM
+storage box is reused, so that listing or counting a dataset's files
+doesn't check the extended attributes of every file each time.  Set to 0
+to check the files every time.
+'''
+
+HSM_ONLINE_CHECK_WORKERS = 8
+'''
+The number of threads used to check the online status of files which
+aren't cached, so that network file system latencies overlap.
+'''
+
+HSM_ONLINE_CHECK_BATCH_SIZE = 500
+'''
+The number of DataFile IDs per query when checking the online status of
+a list of DataFiles.
+'''
+
+HSM_RECALL_MAX_WORKERS = 4
+'''
+The maximum number of files requested from tape at a time when recalling
+a dataset or an experiment.  The files are requested in tape order, so a
+few outstanding requests are enough to keep the tape drives streaming.
+'''
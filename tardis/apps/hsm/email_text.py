@@ -56,6 +56,26 @@ def email_dfo_recall_failed(dfo, user):
         support_email=settings.SUPPORT_EMAIL, site_title=settings.SITE_TITLE)
 
 
+def email_recall_request_complete(recall_request):
+    user = recall_request.user
+    target = recall_request.target
+    if recall_request.dataset_id is not None:
+        name = 'dataset "%s"' % target.description
+    else:
+        name = 'experiment "%s"' % target.title
+    protocol = 'https' if settings.SECURE_PROXY_SSL_HEADER else 'http'
+    site = Site.objects.get_current().domain
+    url = '%s://%s%s' % (protocol, site, target.get_absolute_url())
+    return interpolate_template(
+        'recall_request_complete',
+        first_name=user.first_name, last_name=user.last_name,
+        name=name, url=url,
+        total_files=recall_request.total_files,
+        recalled_files=recall_request.recalled_files,
+        failed_files=recall_request.failed_files,
+        support_email=settings.SUPPORT_EMAIL, site_title=settings.SITE_TITLE)
+
+
 def email_dataset_recall_requested(dataset, user):
     from os import path
     dataset_boxes = dataset.get_all_storage_boxes_used()
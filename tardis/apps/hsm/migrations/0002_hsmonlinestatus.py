@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 3.2.7 on 2026-10-18 19:25
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tardis_portal', '0020_storagebox_options_version'),
+        ('hsm', '0001_initial_data'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HsmOnlineStatus',
+            fields=[
+                ('dfo', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='hsm_online_status', serialize=False, to='tardis_portal.datafileobject')),
+                ('online', models.BooleanField(null=True)),
+                ('checked', models.DateTimeField(db_index=True)),
+            ],
+            options={
+                'verbose_name_plural': 'HSM online statuses',
+            },
+        ),
+    ]
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 3.2.7 on 2026-10-18 19:31
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tardis_portal', '0020_storagebox_options_version'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('hsm', '0002_hsmonlinestatus'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecallRequest',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.PositiveSmallIntegerField(choices=[(1, 'Queued'), (2, 'Running'), (3, 'Complete'), (4, 'Failed')], default=1)),
+                ('total_files', models.PositiveIntegerField(default=0)),
+                ('recalled_files', models.PositiveIntegerField(default=0)),
+                ('failed_files', models.PositiveIntegerField(default=0)),
+                ('created_time', models.DateTimeField(default=django.utils.timezone.now)),
+                ('finished_time', models.DateTimeField(blank=True, null=True)),
+                ('dataset', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='tardis_portal.dataset')),
+                ('experiment', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='tardis_portal.experiment')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
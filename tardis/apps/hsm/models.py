@@ -0,0 +1,78 @@
+"""
+Models for the online status of files in Hierarchical Storage Management
+(HSM) systems and for recalling them from tape
+"""
+from django.contrib.auth.models import User
+from django.db import models
+from django.utils import timezone
+
+from tardis.tardis_portal.models.datafile import DataFileObject
+from tardis.tardis_portal.models.dataset import Dataset
+from tardis.tardis_portal.models.experiment import Experiment
+
+
+class HsmOnlineStatus(models.Model):
+    """The result of the last check of whether a DataFileObject's file was
+    online, which is reused for HSM_ONLINE_STATUS_TTL seconds
+
+    online is None if the status couldn't be determined.
+    """
+    dfo = models.OneToOneField(DataFileObject, primary_key=True,
+                               on_delete=models.CASCADE,
+                               related_name='hsm_online_status')
+    online = models.BooleanField(null=True)
+    checked = models.DateTimeField(db_index=True)
+
+    class Meta:
+        verbose_name_plural = 'HSM online statuses'
+
+    def __str__(self):
+        return '%s: %s' % (self.dfo_id, self.online)
+
+
+class RecallRequest(models.Model):
+    """A request to recall all of the files of a dataset or an experiment
+    from tape, which records the progress of the recall
+    """
+    QUEUED = 1
+    RUNNING = 2
+    COMPLETE = 3
+    FAILED = 4
+    STATUS_CHOICES = ((QUEUED, 'Queued'),
+                      (RUNNING, 'Running'),
+                      (COMPLETE, 'Complete'),
+                      (FAILED, 'Failed'))
+
+    user = models.ForeignKey(User, null=True, blank=True,
+                             on_delete=models.SET_NULL)
+    dataset = models.ForeignKey(Dataset, null=True, blank=True,
+                                on_delete=models.CASCADE)
+    experiment = models.ForeignKey(Experiment, null=True, blank=True,
+                                   on_delete=models.CASCADE)
+    status = models.PositiveSmallIntegerField(choices=STATUS_CHOICES,
+                                              default=QUEUED)
+    total_files = models.PositiveIntegerField(default=0)
+    recalled_files = models.PositiveIntegerField(default=0)
+    failed_files = models.PositiveIntegerField(default=0)
+    created_time = models.DateTimeField(default=timezone.now)
+    finished_time = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return 'Recall of %s (%s)' % (self.target,
+                                      self.get_status_display())
+
+    @property
+    def target(self):
+        """The dataset or experiment being recalled"""
+        return self.dataset or self.experiment
+
+    def get_file_objects(self):
+        """Returns the verified DataFileObjects of the files being recalled
+        """
+        if self.dataset_id is not None:
+            dfos = DataFileObject.objects.filter(
+                datafile__dataset_id=self.dataset_id)
+        else:
+            dfos = DataFileObject.objects.filter(
+                datafile__dataset__experiments__id=self.experiment_id)
+        return dfos.filter(verified=True)
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+
+"""HSM recall module.  Recalls all of the files of a dataset or an
+experiment from tape for a RecallRequest.
+
+The files are grouped by storage box and requested in inode order, which
+on most HSM file systems follows the order in which they were archived,
+so that each tape is read from start to end rather than seeking back and
+forth.  Files which are already online are skipped, and at most
+HSM_RECALL_MAX_WORKERS files are requested at a time.
+"""
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.storage import get_storage_class
+from django.utils import timezone
+
+from tardis.tardis_portal.models import StorageBox
+
+from .check import files_online
+from .models import HsmOnlineStatus, RecallRequest
+from .storage import HsmFileSystemStorage
+
+logger = logging.getLogger(__name__)
+
+# The number of files between updates of a RecallRequest's progress
+PROGRESS_INTERVAL = 100
+
+
+def request_recall(user, dataset=None, experiment=None):
+    """Queues the recall of a dataset's or an experiment's files, unless
+    the user has already requested it and it hasn't finished
+
+    Parameters
+    ----------
+    user : User
+        The user requesting the recall, who will be notified when it's done
+    dataset : Dataset
+        The dataset to recall
+    experiment : Experiment
+        The experiment to recall, if dataset is None
+
+    Returns
+    -------
+    RecallRequest
+        The new or existing request
+    """
+    from .tasks import recall_request as recall_request_task
+
+    recall_request, created = RecallRequest.objects.get_or_create(
+        user=user if user.is_authenticated else None,
+        dataset=dataset, experiment=None if dataset else experiment,
+        status__in=(RecallRequest.QUEUED, RecallRequest.RUNNING),
+        defaults={'status': RecallRequest.QUEUED})
+    if created:
+        recall_request_task.apply_async(
+            args=[recall_request.id],
+            priority=settings.DEFAULT_TASK_PRIORITY)
+    return recall_request
+
+
+def get_recall_paths(recall_request):
+    """Returns the paths of the files to recall, in the order to recall them
+
+    Parameters
+    ----------
+    recall_request : RecallRequest
+        The request for which to find the files
+
+    Returns
+    -------
+    list
+        Tuples of (DataFileObject ID, path)
+    """
+    dfos = recall_request.get_file_objects().values_list(
+        'id', 'storage_box_id', 'uri')
+    box_ids = {box_id for _, box_id, _ in dfos}
+    locations = {}
+    for box in StorageBox.objects.filter(id__in=box_ids).prefetch_related(
+            'options'):
+        if not issubclass(get_storage_class(box.django_storage_class),
+                          HsmFileSystemStorage):
+            continue
+        for option in box.options.all():
+            if option.key == 'location':
+                locations[box.id] = option.value
+
+    paths = [(box_id, dfo_id, os.path.join(locations[box_id], uri))
+             for dfo_id, box_id, uri in dfos
+             if box_id in locations and uri]
+    return [(dfo_id, path) for _, _, dfo_id, path in sorted(
+        (box_id, _get_inode(path), dfo_id, path)
+        for box_id, dfo_id, path in paths)]
+
+
+def _get_inode(path):
+    try:
+        return os.stat(path).st_ino
+    except OSError:
+        # Sort files which can't be found after those which can
+        return float('inf')
+
+
+def recall_file(path):
+    """Triggers the recall of a file by reading its first KiB
+
+    Parameters
+    ----------
+    path : str
+        Path to the file to recall
+
+    Returns
+    -------
+    bool
+        Whether the file could be read
+    """
+    try:
+        with open(path, 'rb') as file_obj:
+            file_obj.read(1024)
+        return True
+    except IOError as err:
+        logger.error("Recall failed for %s: %s", path, err)
+        return False
+
+
+def run_recall(recall_request):
+    """Recalls the files of a RecallRequest, recording its progress
+
+    Parameters
+    ----------
+    recall_request : RecallRequest
+        The request to run
+    """
+    paths = get_recall_paths(recall_request)
+    recall_request.status = RecallRequest.RUNNING
+    recall_request.total_files = len(paths)
+    recall_request.recalled_files = 0
+    recall_request.failed_files = 0
+    recall_request.save()
+
+    online = files_online(dict(paths))
+    to_recall = [(dfo_id, path) for dfo_id, path in paths
+                 if not online[dfo_id]]
+    recall_request.recalled_files = len(paths) - len(to_recall)
+
+    workers = getattr(settings, 'HSM_RECALL_MAX_WORKERS', 4)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # map submits the files in order, so they're requested in order
+        # with at most `workers` requests outstanding:
+        results = executor.map(recall_file,
+                               (path for _, path in to_recall))
+        for count, recalled in enumerate(results, 1):
+            if recalled:
+                recall_request.recalled_files += 1
+            else:
+                recall_request.failed_files += 1
+            if count % PROGRESS_INTERVAL == 0:
+                _save_progress(recall_request)
+
+    # The recalled files' stored statuses are out of date:
+    dfo_ids = [dfo_id for dfo_id, _ in to_recall]
+    for i in range(0, len(dfo_ids), PROGRESS_INTERVAL):
+        HsmOnlineStatus.objects.filter(
+            dfo_id__in=dfo_ids[i:i + PROGRESS_INTERVAL]).delete()
+
+    if recall_request.failed_files:
+        recall_request.status = RecallRequest.FAILED
+    else:
+        recall_request.status = RecallRequest.COMPLETE
+    recall_request.finished_time = timezone.now()
+    recall_request.save()
+
+
+def _save_progress(recall_request):
+    RecallRequest.objects.filter(id=recall_request.id).update(
+        recalled_files=recall_request.recalled_files,
+        failed_files=recall_request.failed_files)
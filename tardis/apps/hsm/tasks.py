@@ -10,7 +10,7 @@ from django.utils import timezone
 
 from tardis.celery import tardis_app
 from .email_text import email_dfo_recall_complete, email_dfo_recall_requested
-from .email_text import email_dfo_recall_failed
+from .email_text import email_dfo_recall_failed, email_recall_request_complete
 from .exceptions import HsmException
 
 logger = logging.getLogger(__name__)
@@ -83,6 +83,10 @@ def dfo_recall(dfo_id, user_id):
     finally:
         dfo.file_object.close()
 
+    # The file may be online now, so don't report its cached status:
+    from .check import forget_dfo_online
+    forget_dfo_online(dfo)
+
     if user_id:
         user = User.objects.get(id=user_id)
         if recalled:
@@ -97,6 +101,34 @@ def dfo_recall(dfo_id, user_id):
                         fail_silently=True)
 
 
+@tardis_app.task(name='hsm.recall.request', ignore_result=True)
+def recall_request(recall_request_id):
+    '''
+    Recall all of the files of the dataset or experiment of a
+    RecallRequest from archive (tape), and notify the user who requested
+    the recall with a single email when it's finished
+    '''
+    from .models import RecallRequest
+    from .recall import run_recall
+
+    request = RecallRequest.objects.select_related('user').get(
+        id=recall_request_id)
+    try:
+        run_recall(request)
+    except Exception:
+        RecallRequest.objects.filter(id=request.id).update(
+            status=RecallRequest.FAILED, finished_time=timezone.now())
+        raise
+
+    if request.user and request.user.email:
+        logger.info("sending recall request complete email to %s",
+                    request.user.email)
+        subject, content = email_recall_request_complete(request)
+        request.user.email_user(subject, content,
+                                from_email=settings.DEFAULT_FROM_EMAIL,
+                                fail_silently=True)
+
+
 @tardis_app.task(name='hsm.ds.check', ignore_result=True)
 def ds_check(ds_id):
     '''
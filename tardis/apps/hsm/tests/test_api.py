@@ -4,6 +4,7 @@ Testing the hsm app's extensions to the tastypie-based mytardis api
 '''
 import json
 import os
+from unittest.mock import patch
 
 from django.conf import settings
 
@@ -225,6 +226,31 @@ class HsmAppApiTestCase(MyTardisResourceTestCase):
             '/api/v1/hsm_replica/%s/recall/' % self.dfo.id,
             authentication=bad_credentials))
 
+    def test_experiment_recall(self):
+        '''
+        Test the API endpoint for recalling all of an experiment's files
+        '''
+        from ..models import RecallRequest
+
+        with patch('tardis.apps.hsm.tasks.recall_request.apply_async') \
+                as apply_async:
+            response = self.api_client.get(
+                '/api/v1/hsm_experiment/%s/recall/' % self.testexp.id,
+                authentication=self.get_credentials())
+        self.assertHttpOK(response)
+        data = json.loads(response.content)
+        recall_request = RecallRequest.objects.get(id=data['recall_request'])
+        self.assertEqual(recall_request.experiment, self.testexp)
+        self.assertEqual(recall_request.status, RecallRequest.QUEUED)
+        self.assertEqual(apply_async.call_args[1]['args'],
+                         [recall_request.id])
+
+        bad_credentials = self.create_basic(  # nosec
+            username=self.username, password="wrong pw, dude!")
+        self.assertHttpUnauthorized(self.api_client.get(
+            '/api/v1/hsm_experiment/%s/recall/' % self.testexp.id,
+            authentication=bad_credentials))
+
     def test_ds_check(self):
         '''
         Test the task for updating a dataset's Online Status metadata
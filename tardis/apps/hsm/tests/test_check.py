@@ -0,0 +1,78 @@
+'''
+Testing the hsm app's bulk online status checks
+'''
+import os
+from unittest.mock import patch
+
+from django.test import TestCase, override_settings
+
+from tardis.tardis_portal.models.datafile import DataFile, DataFileObject
+from tardis.tardis_portal.models.dataset import Dataset
+from tardis.tardis_portal.models.storage import (
+    StorageBox, StorageBoxAttribute, StorageBoxOption)
+
+from ..check import dataset_online_count, datafiles_online
+
+
+@override_settings(HSM_ONLINE_STATUS_TTL=300, HSM_ONLINE_CHECK_WORKERS=4)
+class HsmCheckTestCase(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.dataset = Dataset.objects.create(description='Test Dataset')
+        self.hsm_box = StorageBox.objects.create(
+            name='HSM',
+            django_storage_class='tardis.apps.hsm.storage.HsmFileSystemStorage')
+        StorageBoxOption.objects.create(
+            storage_box=self.hsm_box, key='location', value='/hsm')
+        self.tape_box = StorageBox.objects.create(name='Tape')
+        StorageBoxAttribute.objects.create(
+            storage_box=self.tape_box, key='type', value='tape')
+
+    def add_datafile(self, filename, storage_box=None):
+        datafile = DataFile.objects.create(
+            dataset=self.dataset, filename=filename, size=8,
+            md5sum='930e419034038dfad994f0d2e602146c')
+        if storage_box is not None:
+            dfo = DataFileObject.objects.create(
+                datafile=datafile, storage_box=storage_box, uri=filename)
+            DataFileObject.objects.filter(id=dfo.id).update(verified=True)
+        return datafile
+
+    def test_datafiles_online(self):
+        online = [self.add_datafile('online%d' % i, self.hsm_box)
+                  for i in range(3)]
+        offline = [self.add_datafile('offline%d' % i, self.hsm_box)
+                   for i in range(3)]
+        on_tape = self.add_datafile('tape', self.tape_box)
+        no_dfos = self.add_datafile('no_dfos')
+
+        with patch('tardis.apps.hsm.check.file_is_online',
+                   side_effect=lambda path: 'online' in path) as check:
+            # The DataFiles, their DataFileObjects, the storage boxes with
+            # their attributes and options, and storing the statuses:
+            with self.assertNumQueries(7):
+                statuses = datafiles_online(self.dataset.datafile_set.all())
+            self.assertEqual(check.call_count, 6)
+            self.assertIn(os.path.join('/hsm', 'online0'),
+                          [args[0] for args, _ in check.call_args_list])
+
+            expected = {df.id: True for df in online + [no_dfos]}
+            expected.update({df.id: False for df in offline + [on_tape]})
+            self.assertEqual(statuses, expected)
+
+            # The stored statuses are reused:
+            with self.assertNumQueries(4):
+                self.assertEqual(
+                    datafiles_online([df.id for df in online + offline]),
+                    {df.id: expected[df.id] for df in online + offline})
+            self.assertEqual(check.call_count, 6)
+            self.assertEqual(dataset_online_count(self.dataset), 4)
+
+    @override_settings(HSM_ONLINE_STATUS_TTL=0)
+    def test_uncached(self):
+        self.add_datafile('online', self.hsm_box)
+        with patch('tardis.apps.hsm.check.file_is_online',
+                   return_value=True) as check:
+            self.assertTrue(self.dataset.is_online)
+            self.assertTrue(self.dataset.is_online)
+        self.assertEqual(check.call_count, 2)
@@ -0,0 +1,102 @@
+'''
+Testing the hsm app's recall of datasets and experiments
+'''
+import os
+import shutil
+import tempfile
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+from django.core import mail
+from django.test import TestCase
+
+from tardis.tardis_portal.models.datafile import DataFile, DataFileObject
+from tardis.tardis_portal.models.dataset import Dataset
+from tardis.tardis_portal.models.experiment import Experiment
+from tardis.tardis_portal.models.storage import StorageBox, StorageBoxOption
+
+from ..models import RecallRequest
+from ..recall import get_recall_paths, request_recall
+
+
+class HsmRecallTestCase(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.location = tempfile.mkdtemp()
+        self.user = User.objects.create_user(
+            'testuser', 'testuser@example.com', 'secret')
+        self.experiment = Experiment.objects.create(
+            title='Test Experiment', created_by=self.user)
+        self.dataset = Dataset.objects.create(description='Test Dataset')
+        self.dataset.experiments.add(self.experiment)
+        self.hsm_box = StorageBox.objects.create(
+            name='HSM',
+            django_storage_class='tardis.apps.hsm.storage.HsmFileSystemStorage')
+        StorageBoxOption.objects.create(
+            storage_box=self.hsm_box, key='location', value=self.location)
+
+    def tearDown(self):
+        shutil.rmtree(self.location)
+        super().tearDown()
+
+    def add_file(self, filename, exists=True):
+        datafile = DataFile.objects.create(
+            dataset=self.dataset, filename=filename, size=4,
+            md5sum='098f6bcd4621d373cade4e832627b4f6')
+        dfo = DataFileObject.objects.create(
+            datafile=datafile, storage_box=self.hsm_box, uri=filename)
+        DataFileObject.objects.filter(id=dfo.id).update(verified=True)
+        if exists:
+            with open(os.path.join(self.location, filename), 'w') as f:
+                f.write('test')
+        return dfo
+
+    def test_recall_order(self):
+        dfos = [self.add_file('file%d' % i) for i in range(5)]
+        missing = self.add_file('missing', exists=False)
+        recall_request = RecallRequest.objects.create(
+            user=self.user, experiment=self.experiment)
+        paths = get_recall_paths(recall_request)
+        by_inode = sorted(
+            dfos, key=lambda dfo: os.stat(
+                os.path.join(self.location, dfo.uri)).st_ino)
+        self.assertEqual(
+            [dfo_id for dfo_id, _ in paths],
+            [dfo.id for dfo in by_inode] + [missing.id])
+
+    def test_request_recall(self):
+        for i in range(3):
+            self.add_file('file%d' % i)
+        self.add_file('missing', exists=False)
+
+        with patch('tardis.apps.hsm.recall.files_online',
+                   side_effect=lambda paths: {
+                       dfo_id: path.endswith('file0')
+                       for dfo_id, path in paths.items()}), \
+                patch('tardis.apps.hsm.recall.recall_file',
+                      side_effect=os.path.exists) as recall_file:
+            recall_request = request_recall(self.user, dataset=self.dataset)
+
+        recall_request.refresh_from_db()
+        self.assertEqual(recall_request.status, RecallRequest.FAILED)
+        self.assertEqual(recall_request.total_files, 4)
+        self.assertEqual(recall_request.recalled_files, 3)
+        self.assertEqual(recall_request.failed_files, 1)
+        self.assertIsNotNone(recall_request.finished_time)
+        # The online file isn't recalled:
+        self.assertEqual(recall_file.call_count, 3)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn('3 of the 4 archived files', mail.outbox[0].body)
+
+    def test_request_recall_in_progress(self):
+        queued = RecallRequest.objects.create(
+            user=self.user, dataset=self.dataset)
+        with patch('tardis.apps.hsm.tasks.recall_request.apply_async') \
+                as apply_async:
+            self.assertEqual(
+                request_recall(self.user, dataset=self.dataset), queued)
+            apply_async.assert_not_called()
+            self.assertNotEqual(
+                request_recall(self.user, experiment=self.experiment),
+                queued)
+            self.assertEqual(apply_async.call_count, 1)
@@ -112,6 +112,22 @@ class BaseProvider(oaipmh.interfaces.IOAI, object):
         """
         raise oaipmh.error.CannotDisseminateFormatError
 
+    def getResumptionKey(self, header):
+        """
+        Get the position of a listed record, to resume a list after it.
+
+        Providers which return a key must accept it as an ``after`` keyword
+        argument to :py:meth:`listIdentifiers` and :py:meth:`listRecords`,
+        and list only the records after that position, in the same order.
+        Otherwise lists are resumed by skipping the records already returned.
+
+        :param header: a header returned by this provider
+        :type header: oaipmh.common.Header
+
+        :returns: a string key, or None if lists can't be resumed by key.
+        """
+        return None
+
     def listSets(self):
         """
         Get a list of sets in the repository.
@@ -1,8 +1,13 @@
 from abc import abstractmethod
 import datetime
+from itertools import chain
 
 from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import IntegerField, Prefetch, Q
+from django.db.models.functions import Cast
 from django.urls import reverse
+from django.utils.timezone import is_aware, make_aware
 from lxml.etree import SubElement
 
 from oaipmh.common import Header, Metadata
@@ -11,9 +16,9 @@ from oaipmh.server import oai_dc_writer, NS_XSI
 
 import pytz
 
-from tardis.tardis_portal.ParameterSetManager import ParameterSetManager
-from tardis.tardis_portal.models import Experiment, \
-    ExperimentParameterSet, ExperimentParameter, License, User
+from tardis.tardis_portal.ParameterSetManager import LOCAL_TZ
+from tardis.tardis_portal.models import Experiment, ExperimentAuthor, \
+    ExperimentParameterSet, ExperimentParameter, License, ObjectACL, User
 from tardis.tardis_portal.util import get_local_time, get_utc_time
 
 from .base import BaseProvider
@@ -23,6 +28,9 @@ class AbstractExperimentProvider(BaseProvider):
 
     NS_CC = 'http://www.tardis.edu.au/schemas/creative_commons/2011/05/17'
 
+    # Whether the owners of public experiments are listed as records too
+    lists_users = True
+
     def getRecord(self, metadataPrefix, identifier):
         """
         Return record if we handle it.
@@ -41,7 +49,8 @@ class AbstractExperimentProvider(BaseProvider):
         about = None
         return (header, metadata, about)
 
-    def listIdentifiers(self, metadataPrefix, set=None, from_=None, until=None):
+    def listIdentifiers(self, metadataPrefix, set=None, from_=None, until=None,
+                        after=None):
         """
         Return identifiers in range, provided we handle this metadata prefix.
         """
@@ -51,10 +60,11 @@ class AbstractExperimentProvider(BaseProvider):
         # Don't process requests unless we handle this prefix
         if not self._handles_metadata_prefix(metadataPrefix):
             raise oaipmh.error.CannotDisseminateFormatError
-        objects = self._get_in_range(from_, until)
-        return map(self._get_header, objects)
+        pages = self._get_pages_in_range(from_, until, after)
+        return map(self._get_header, chain.from_iterable(pages))
 
-    def listRecords(self, metadataPrefix, set=None, from_=None, until=None):
+    def listRecords(self, metadataPrefix, set=None, from_=None, until=None,
+                    after=None):
         """
         Return records in range, provided we handle this metadata prefix.
         """
@@ -64,13 +74,25 @@ class AbstractExperimentProvider(BaseProvider):
         # Don't process requests unless we handle this prefix
         if not self._handles_metadata_prefix(metadataPrefix):
             raise oaipmh.error.CannotDisseminateFormatError
-        objects = self._get_in_range(from_, until)
 
-        def get_tuple(obj):
-            header = self._get_header(obj)
-            metadata = self._get_metadata(obj, metadataPrefix)
-            return (header, metadata, None)
-        return map(get_tuple, objects)
+        def get_records():
+            for page in self._get_pages_in_range(from_, until, after):
+                self._prefetch_related(page)
+                for obj in page:
+                    header = self._get_header(obj)
+                    metadata = self._get_metadata(obj, metadataPrefix)
+                    yield (header, metadata, None)
+        return get_records()
+
+    def getResumptionKey(self, header):
+        """
+        Return the position of the record after the experiments and users
+        listed before it, so a list can be resumed with ``after``.
+        """
+        obj = header.element()
+        if isinstance(obj, User):
+            return 'user/%d' % obj.id
+        return 'experiment/%s/%d' % (obj.update_time.isoformat(), obj.id)
 
     def listSets(self):
         """
@@ -121,10 +143,9 @@ class AbstractExperimentProvider(BaseProvider):
     def _get_user_metadata(self, user, metadataPrefix):
         raise NotImplementedError
 
-    def _get_in_range(self, from_, until):
-        from itertools import chain
+    def _get_experiments_in_range(self, from_, until):
         experiments = Experiment.objects\
-            .select_related('created_by')\
+            .select_related('created_by', 'license')\
             .exclude(public_access=Experiment.PUBLIC_ACCESS_NONE)\
             .exclude(description='')
         # Filter based on boundaries provided
@@ -134,12 +155,91 @@ class AbstractExperimentProvider(BaseProvider):
         if until:
             until = get_local_time(until.replace(tzinfo=pytz.utc))  # UTC->local
             experiments = experiments.filter(update_time__lte=until)
+        return experiments
+
+    def _get_users_in_range(self, from_, until):
+        """
+        Owners of the experiments in range who can be listed as public
+        contacts (see :py:meth:`UserProfile.isValidPublicContact`).
+        """
+        experiment_ids = self._get_experiments_in_range(from_, until)\
+                             .values('id')
+        owner_ids = ObjectACL.objects\
+            .filter(pluginId='django_user',
+                    content_type=ContentType.objects.get_for_model(Experiment),
+                    object_id__in=experiment_ids,
+                    isOwner=True)\
+            .annotate(user_id=Cast('entityId', IntegerField()))\
+            .values('user_id')
+        return User.objects.select_related('userprofile')\
+                           .filter(id__in=owner_ids)\
+                           .exclude(email='')\
+                           .exclude(first_name='')
+
+    def _get_pages_in_range(self, from_, until, after=None):
+        """
+        Yield lists of up to OAIPMH_PAGE_SIZE experiments in range, ordered
+        by update time, followed by their owners (if this provider lists
+        users), ordered by ID.  Each page is fetched with a keyset query, so
+        a list can be resumed ``after`` a key from
+        :py:meth:`getResumptionKey` without counting the records before it.
+        """
+        page_size = getattr(settings, 'OAIPMH_PAGE_SIZE', 100)
+        type_, _, position = (after or '').partition('/')
+        if type_ != 'user':
+            experiments = self._get_experiments_in_range(from_, until)\
+                              .order_by('update_time', 'id')
+            if type_ == 'experiment':
+                update_time, id_ = self._parse_experiment_key(position)
+                experiments = experiments.filter(
+                    self._get_experiment_keyset(update_time, id_))
+            yield from self._get_pages(
+                experiments, page_size,
+                lambda e: self._get_experiment_keyset(e.update_time, e.id))
+            position = None
+        if not self.lists_users:
+            return
+        users = self._get_users_in_range(from_, until).order_by('id')
+        if position:
+            users = users.filter(id__gt=self._parse_id(position))
+        yield from self._get_pages(users, page_size,
+                                   lambda u: Q(id__gt=u.id))
 
-        def get_users_from_experiment(experiment):
-            return filter(lambda u: u.userprofile.isValidPublicContact(),
-                          experiment.get_owners())
-        users = chain(map(get_users_from_experiment, experiments))
-        return frozenset(chain(experiments, *users))
+    @staticmethod
+    def _get_pages(queryset, page_size, get_keyset):
+        while True:
+            page = list(queryset[:page_size])
+            if page:
+                yield page
+            if len(page) < page_size:
+                return
+            queryset = queryset.filter(get_keyset(page[-1]))
+
+    @staticmethod
+    def _get_experiment_keyset(update_time, id_):
+        return Q(update_time__gt=update_time) | \
+            Q(update_time=update_time, id__gt=id_)
+
+    def _parse_experiment_key(self, position):
+        try:
+            update_time, id_ = position.rsplit('/', 1)
+            return (datetime.datetime.fromisoformat(update_time),
+                    self._parse_id(id_))
+        except ValueError:
+            raise oaipmh.error.BadResumptionTokenError
+
+    @staticmethod
+    def _parse_id(id_):
+        try:
+            return int(id_)
+        except ValueError:
+            raise oaipmh.error.BadResumptionTokenError
+
+    def _prefetch_related(self, objects):
+        """
+        Fetch the related objects needed for the metadata of a page of
+        records in a few queries, rather than a few per record.
+        """
 
     @abstractmethod
     def _handles_metadata_prefix(self, metadataPrefix):
@@ -148,6 +248,8 @@ class AbstractExperimentProvider(BaseProvider):
 
 class DcExperimentProvider(AbstractExperimentProvider):
 
+    lists_users = False
+
     def listMetadataFormats(self, identifier=None):
         """
         Return metadata format if no identifier, or identifier
@@ -164,10 +266,6 @@ class DcExperimentProvider(AbstractExperimentProvider):
         except oaipmh.error.IdDoesNotExistError:
             return []
 
-    def _get_in_range(self, from_, until):
-        return filter(lambda obj: isinstance(obj, Experiment),
-                      super()._get_in_range(from_, until))
-
     def _get_id_from_identifier(self, identifier):
         return self._split_type_and_id(identifier, ["experiment"])
 
@@ -189,6 +287,10 @@ class DcExperimentProvider(AbstractExperimentProvider):
 
 class RifCsExperimentProvider(AbstractExperimentProvider):
 
+    RELATED_INFO_NS = \
+        'http://ands.org.au/standards/rif-cs/registryObjects#relatedInfo'
+    SUBJECT_NS = 'http://purl.org/asc/1297.0/2008/for/'
+
     def listMetadataFormats(self, identifier=None):
         """
         Return metadata format if no identifier, or identifier
@@ -215,34 +317,32 @@ class RifCsExperimentProvider(AbstractExperimentProvider):
             access = "All data is publicly available online."
             access_type = "open"
 
+        related = getattr(experiment, 'oai_related', None) or \
+            self._get_related([experiment])[experiment.id]
+
         def get_related_info(ps):
-            psm = ParameterSetManager(ps)
             parameter_names = ['type', 'identifier', 'title', 'notes']
             try:
                 parameters = {
-                    key: psm.get_param(key, True)
+                    key: self._get_param_value(ps, key)
                     for key in parameter_names}
                 parameters['id'] = ps.id
                 return parameters
             except ExperimentParameter.DoesNotExist:
                 return dict()  # drop Related_Info record with missing fields
 
-        ns = 'http://ands.org.au/standards/rif-cs/registryObjects#relatedInfo'
-        related_info = map(
-            get_related_info,
-            ExperimentParameterSet.objects.filter(experiment=experiment,
-                                                  schema__namespace=ns))
+        related_info = [get_related_info(ps)
+                        for ps in related['parameter_sets']
+                        if ps.schema.namespace == self.RELATED_INFO_NS]
 
         def get_subject(ps, type_):
-            psm = ParameterSetManager(ps)
-            return {'text': psm.get_param('code', True),
+            return {'text': self._get_param_value(ps, 'code'),
                     'type': type_}
 
-        ns = 'http://purl.org/asc/1297.0/2008/for/'
         subjects = [get_subject(ps, 'anzsrc-for')
-                    for ps in ExperimentParameterSet.objects.filter(
-                        experiment=experiment, schema__namespace=ns)]
-        collectors = experiment.experimentauthor_set.exclude(url='')
+                    for ps in related['parameter_sets']
+                    if ps.schema.namespace == self.SUBJECT_NS]
+        collectors = related['collectors']
         return Metadata(
             experiment,
             {
@@ -256,11 +356,66 @@ class RifCsExperimentProvider(AbstractExperimentProvider):
                 'access': access,
                 'access_type': access_type,
                 'collectors': collectors,
-                'managers': experiment.get_owners(),
+                'managers': related['owners'],
                 'related_info': related_info,
                 'subjects': subjects
             })
 
+    def _prefetch_related(self, objects):
+        experiments = [obj for obj in objects if isinstance(obj, Experiment)]
+        if not experiments:
+            return
+        related = self._get_related(experiments)
+        for experiment in experiments:
+            experiment.oai_related = related[experiment.id]
+
+    def _get_related(self, experiments):
+        """
+        Fetch the owners, collectors and related info and subject parameter
+        sets of experiments, keyed by experiment ID.
+        """
+        ids = [experiment.id for experiment in experiments]
+        related = {id_: {'owners': [], 'collectors': [], 'parameter_sets': []}
+                   for id_ in ids}
+        owners, _ = Experiment.safe.owners_and_groups(ids)
+        for id_, users in owners.items():
+            related[id_]['owners'] = users
+        for author in ExperimentAuthor.objects.filter(experiment_id__in=ids)\
+                                              .exclude(url=''):
+            related[author.experiment_id]['collectors'].append(author)
+        parameter_sets = ExperimentParameterSet.objects\
+            .filter(experiment_id__in=ids,
+                    schema__namespace__in=[self.RELATED_INFO_NS,
+                                           self.SUBJECT_NS])\
+            .select_related('schema')\
+            .prefetch_related(Prefetch(
+                'experimentparameter_set',
+                queryset=ExperimentParameter.objects.select_related('name')))\
+            .order_by('id')
+        for ps in parameter_sets:
+            related[ps.experiment_id]['parameter_sets'].append(ps)
+        return related
+
+    @staticmethod
+    def _get_param_value(parameterset, name):
+        """
+        The value of a parameter, as returned by
+        :py:meth:`ParameterSetManager.get_param`, from a parameter set's
+        prefetched parameters.
+        """
+        matches = [par for par in parameterset.experimentparameter_set.all()
+                   if par.name.name == name]
+        if not matches:
+            raise ExperimentParameter.DoesNotExist
+        par = matches[0]
+        if par.name.isNumeric():
+            return par.numerical_value
+        if par.name.isDateTime():
+            if is_aware(par.datetime_value):
+                return par.datetime_value
+            return make_aware(par.datetime_value, LOCAL_TZ, settings.IS_DST)
+        return par.string_value
+
     def _get_user_metadata(self, user, metadataPrefix):
         owns_experiments = Experiment.safe.owned_by_user_id(user.id)\
                                           .exclude(public_access=Experiment.PUBLIC_ACCESS_NONE)
@@ -1,19 +1,26 @@
-from datetime import datetime
+from datetime import datetime, timedelta
+from io import BytesIO
 import itertools
 from functools import reduce
 from importlib import import_module
 
 from django.conf import settings
+from django.core import signing
 from django.core.exceptions import ImproperlyConfigured
 from django.contrib.auth.models import User
 from django.contrib.sites.models import Site
 from django.urls import reverse
 
+from lxml import etree
+
 from oaipmh.common import Identify
+from oaipmh.datestamp import datetime_to_datestamp
 import oaipmh.error
 from oaipmh.interfaces import IOAI
 from oaipmh.metadata import MetadataRegistry
-from oaipmh.server import Server
+from oaipmh.server import Resumption, ServerBase, nsoai
+
+RESUMPTION_TOKEN_SALT = 'tardis.apps.oaipmh.resumption'
 
 
 def _safe_import_class(path):
@@ -129,7 +136,7 @@ class ProxyingServer(IOAI):
 
     def listIdentifiers(self, metadataPrefix, **kwargs):
         """
-        Lists identifiers from all providers as a single set.
+        Lists identifiers from all providers, in provider order.
 
         :raises error.CannotDisseminateFormatError: if ``metadataPrefix``
             is not supported by the repository.
@@ -137,20 +144,11 @@ class ProxyingServer(IOAI):
         :raises error.NoSetHierarchyError: if a set is provided, as the
             repository does not support sets.
 
-        :returns: a :py:class:`set.Set` of headers.
-        :rtype: set
+        :returns: an iterator of headers.
+        :rtype: iterator
         """
-        if 'set' in kwargs and kwargs['set']:
-            raise oaipmh.error.NoSetHierarchyError
-        if metadataPrefix not in [f[0] for f in self.listMetadataFormats()]:
-            raise oaipmh.error.CannotDisseminateFormatError
-
-        def appendIdents(list_, p):
-            try:
-                return list_ + list(p.listIdentifiers(metadataPrefix, **kwargs))
-            except oaipmh.error.CannotDisseminateFormatError:
-                return list_
-        return frozenset(reduce(appendIdents, self.providers, []))
+        return (item for _, item in
+                self.iterList('ListIdentifiers', metadataPrefix, **kwargs))
 
     # pylint: disable=W0222
     def listMetadataFormats(self, **kwargs):
@@ -182,7 +180,7 @@ class ProxyingServer(IOAI):
 
     def listRecords(self, metadataPrefix, **kwargs):
         """
-        Lists records from all providers as a single set.
+        Lists records from all providers, in provider order.
 
         :raises error.CannotDisseminateFormatError: if ``metadataPrefix``
             is not supported by the repository.
@@ -190,21 +188,68 @@ class ProxyingServer(IOAI):
         :raises error.NoSetHierarchyError: if a set is provided, as the
             repository does not support sets.
 
-        :returns: a :py:class:`set.Set` of ``header``, ``metadata``, ``about``
-            tuples.
-        :rtype: set
+        :returns: an iterator of ``header``, ``metadata``, ``about`` tuples.
+        :rtype: iterator
         """
-        if 'set' in kwargs and kwargs['set']:
+        return (item for _, item in
+                self.iterList('ListRecords', metadataPrefix, **kwargs))
+
+    def iterList(self, verb, metadataPrefix, set=None, from_=None,
+                 until=None, position=None):
+        """
+        Lists headers (for ListIdentifiers) or records (for ListRecords) from
+        all providers, lazily and in provider order, starting after a
+        position previously returned with a header or record.
+
+        A position is a dict of the index of the provider which returned the
+        item, the provider's resumption key for it (see
+        :py:meth:`BaseProvider.getResumptionKey`) and the number of items
+        the provider has returned so far, for providers without keys.
+
+        :raises error.CannotDisseminateFormatError: if ``metadataPrefix``
+            is not supported by the repository.
+
+        :raises error.NoSetHierarchyError: if a set is provided, as the
+            repository does not support sets.
+
+        :returns: an iterator of ``position``, ``item`` tuples.
+        :rtype: iterator
+        """
+        if set:
             raise oaipmh.error.NoSetHierarchyError
         if metadataPrefix not in [f[0] for f in self.listMetadataFormats()]:
             raise oaipmh.error.CannotDisseminateFormatError
-
-        def appendRecords(list_, p):
-            try:
-                return list_ + list(p.listRecords(metadataPrefix, **kwargs))
-            except oaipmh.error.CannotDisseminateFormatError:
-                return list_
-        return frozenset(reduce(appendRecords, self.providers, []))
+        position = position or {'provider': 0, 'after': None, 'skip': 0}
+
+        def get_items(index, provider):
+            kwargs = {'set': set, 'from_': from_, 'until': until}
+            skip = 0
+            if index == position['provider']:
+                if position['after'] is not None:
+                    kwargs['after'] = position['after']
+                else:
+                    skip = position['skip']
+            if verb == 'ListIdentifiers':
+                items = provider.listIdentifiers(metadataPrefix, **kwargs)
+            else:
+                items = provider.listRecords(metadataPrefix, **kwargs)
+            return skip, itertools.islice(items, skip, None)
+
+        def iter_items():
+            for index in range(position['provider'], len(self.providers)):
+                provider = self.providers[index]
+                try:
+                    count, items = get_items(index, provider)
+                except oaipmh.error.CannotDisseminateFormatError:
+                    continue
+                for item in items:
+                    count += 1
+                    header = item if verb == 'ListIdentifiers' else item[0]
+                    yield ({'provider': index,
+                            'after': provider.getResumptionKey(header),
+                            'skip': count},
+                           item)
+        return iter_items()
 
     def listSets(self):
         """
@@ -235,6 +280,147 @@ class ProxyingServer(IOAI):
         # We might as well advertise our ignorance
         return ['noreply@'+current_site]
 
+
+class PagingServer(ServerBase):
+    """
+    An OAI-PMH server which streams ListIdentifiers and ListRecords responses
+    in pages of OAIPMH_PAGE_SIZE items.
+
+    Each page ends with a signed resumption token holding the request
+    arguments and the position of the last item, so the next page is
+    fetched from the providers with a keyset query rather than by listing
+    and slicing the whole repository again, and no state is kept on the
+    server between requests.
+
+    Other verbs are handled by pyoai's :py:class:`oaipmh.server.Server`.
+    """
+    def __init__(self, server, metadata_registry=None, nsmap=None):
+        super().__init__(Resumption(server), metadata_registry, nsmap)
+        self._server = server
+
+    def handleVerb(self, verb, kw):
+        if verb not in ('ListIdentifiers', 'ListRecords'):
+            return super().handleVerb(verb, kw)
+        if 'resumptionToken' in kw:
+            state = self.decodeResumptionToken(kw['resumptionToken'], verb)
+        else:
+            state = {
+                'verb': verb,
+                'metadataPrefix': kw['metadataPrefix'],
+                'set': kw.get('set'),
+                'from': kw['from_'].isoformat() if 'from_' in kw else None,
+                'until': kw['until'].isoformat() if 'until' in kw else None,
+                'position': None,
+                'cursor': 0,
+            }
+        items = self._server.iterList(
+            verb, state['metadataPrefix'], set=state['set'],
+            from_=_parse_datetime(state['from']),
+            until=_parse_datetime(state['until']),
+            position=state['position'])
+        # Fetch the first item before responding, so an empty list is
+        # reported as an error rather than as an empty page
+        first = next(items, None)
+        if first is None:
+            raise oaipmh.error.NoRecordsMatchError(
+                "No records match for request.")
+        return self._writeList(verb, kw, state,
+                               itertools.chain([first], items))
+
+    @staticmethod
+    def encodeResumptionToken(state):
+        return signing.dumps(state, salt=RESUMPTION_TOKEN_SALT, compress=True)
+
+    @staticmethod
+    def decodeResumptionToken(token, verb):
+        """
+        Unpack and verify a token from :py:meth:`encodeResumptionToken`.
+
+        :raises error.BadResumptionTokenError: if the token has been
+            modified, has expired or is for another verb.
+        """
+        try:
+            state = signing.loads(
+                token, salt=RESUMPTION_TOKEN_SALT,
+                max_age=getattr(settings, 'OAIPMH_RESUMPTION_TOKEN_MAX_AGE',
+                                86400))
+        except signing.BadSignature:
+            raise oaipmh.error.BadResumptionTokenError(
+                "The resumption token is invalid or has expired.")
+        if state.get('verb') != verb:
+            raise oaipmh.error.BadResumptionTokenError(
+                "The resumption token is for another verb.")
+        return state
+
+    def _writeList(self, verb, kw, state, items):
+        """
+        Generate the response XML for a page of items, one record at a time.
+        """
+        page_size = getattr(settings, 'OAIPMH_PAGE_SIZE', 100)
+        tree_server = self._tree_server
+        _, e_envelope = tree_server._outputBasicEnvelope(verb=verb, **kw)
+        output = BytesIO()
+
+        def drain():
+            data = output.getvalue()
+            output.seek(0)
+            output.truncate()
+            return data
+
+        with etree.xmlfile(output, encoding='UTF-8') as xf:
+            xf.write_declaration()
+            with xf.element(e_envelope.tag, attrib=dict(e_envelope.attrib),
+                            nsmap=e_envelope.nsmap):
+                for e_child in e_envelope:
+                    xf.write(e_child, pretty_print=True)
+                with xf.element(nsoai(verb)):
+                    count = 0
+                    position = None
+                    token = None
+                    for next_position, item in items:
+                        if count == page_size:
+                            token = self.encodeResumptionToken(
+                                dict(state, position=position,
+                                     cursor=state['cursor'] + count))
+                            break
+                        e_list = etree.Element(nsoai(verb),
+                                               nsmap=e_envelope.nsmap)
+                        if verb == 'ListIdentifiers':
+                            tree_server._outputHeader(e_list, item)
+                        else:
+                            header, metadata, _ = item
+                            e_record = etree.SubElement(e_list,
+                                                        nsoai('record'))
+                            tree_server._outputHeader(e_record, header)
+                            if not header.isDeleted():
+                                tree_server._outputMetadata(
+                                    e_record, state['metadataPrefix'],
+                                    metadata)
+                        xf.write(e_list[0], pretty_print=True)
+                        count += 1
+                        position = next_position
+                        yield drain()
+                    if token is not None or 'resumptionToken' in kw:
+                        # An empty token marks the last page of a resumed list
+                        e_token = etree.Element(nsoai('resumptionToken'),
+                                                nsmap=e_envelope.nsmap)
+                        e_token.set('cursor', str(state['cursor']))
+                        if token is not None:
+                            e_token.set('expirationDate', datetime_to_datestamp(
+                                datetime.utcnow().replace(microsecond=0) +
+                                timedelta(seconds=getattr(
+                                    settings,
+                                    'OAIPMH_RESUMPTION_TOKEN_MAX_AGE',
+                                    86400))))
+                            e_token.text = token
+                        xf.write(e_token, pretty_print=True)
+        yield drain()
+
+
+def _parse_datetime(value):
+    return datetime.fromisoformat(value) if value else None
+
+
 _servers = {}
 
 
@@ -248,8 +434,8 @@ def get_server(current_site):
         return class_(current_site)
     # Create new objects with site argument
     providers = [create_provider(p) for p in settings.OAIPMH_PROVIDERS]
-    server = Server(ProxyingServer(providers),
-                    metadata_registry=ProxyingMetadataRegistry(providers))
+    server = PagingServer(ProxyingServer(providers),
+                          metadata_registry=ProxyingMetadataRegistry(providers))
     # Memoize
     _servers[current_site.domain] = server
     return server
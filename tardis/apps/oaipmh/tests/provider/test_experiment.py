@@ -1,7 +1,7 @@
 from abc import ABCMeta, abstractmethod
 
 from django.contrib.sites.requests import RequestSite
-from django.test import TestCase
+from django.test import TestCase, override_settings
 
 import oaipmh.error
 import oaipmh.interfaces
@@ -118,6 +118,31 @@ class AbstractExperimentProviderTC():
             with self.assertRaises(oaipmh.error.NoSetHierarchyError):
                 call_with_set()
 
+    @override_settings(OAIPMH_PAGE_SIZE=1)
+    def testListIdentifiersAfter(self):
+        provider = self._getProvider()
+        headers = list(
+            provider.listIdentifiers(self._getProviderMetadataPrefix()))
+        # Experiments are listed in pages, in order of update
+        self.assertEqual(
+            [header.identifier() for header in headers],
+            ['experiment/%d' % self._experiment.id,
+             'experiment/%d' % self._experiment2.id])
+        # Lists resume after the position of a header
+        key = provider.getResumptionKey(headers[0])
+        self.assertEqual(
+            [header.identifier() for header in provider.listIdentifiers(
+                self._getProviderMetadataPrefix(), after=key)],
+            ['experiment/%d' % self._experiment2.id])
+        key = provider.getResumptionKey(headers[1])
+        self.assertEqual(
+            list(provider.listIdentifiers(self._getProviderMetadataPrefix(),
+                                          after=key)),
+            [])
+        with self.assertRaises(oaipmh.error.BadResumptionTokenError):
+            list(provider.listIdentifiers(self._getProviderMetadataPrefix(),
+                                          after='experiment/bogus'))
+
     def testListMetadataFormats(self):
         self.assertEqual(
             list(map(lambda t: t[0], self._getProvider().listMetadataFormats())),
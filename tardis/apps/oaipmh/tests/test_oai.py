@@ -1,5 +1,5 @@
 from django.contrib.auth.models import User
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.test.client import Client
 
 from lxml import etree
@@ -214,7 +214,7 @@ class EndpointTestCase(TestCase):
                                                  for k,v in args.items()))
         self.assertEqual(response.status_code, 200)
         # Check the response content is good
-        xml = etree.fromstring(response.content)
+        xml = etree.fromstring(response.getvalue())
         ns = {'r': 'http://ands.org.au/standards/rif-cs/registryObjects',
               'o': 'http://www.openarchives.org/OAI/2.0/'}
         assert xml.xpath('/o:OAI-PMH', namespaces=ns)
@@ -279,7 +279,7 @@ class EndpointTestCase(TestCase):
                                                  for k,v in args.items()))
         self.assertEqual(response.status_code, 200)
         # Check the response content is good
-        xml = etree.fromstring(response.content)
+        xml = etree.fromstring(response.getvalue())
         assert xml.xpath('/o:OAI-PMH', namespaces=ns)
         assert not xml.xpath('o:error', namespaces=ns)
         idents = xml.xpath('/o:OAI-PMH/o:ListRecords'+
@@ -304,6 +304,54 @@ class EndpointTestCase(TestCase):
         assert len(partyObject) == 1
         self._check_user_regobj(user, partyObject[0])
 
+    @override_settings(OAIPMH_PAGE_SIZE=2)
+    def testListRecordsResumption(self):
+        ns = self.ns
+        user, experiment = _create_test_data()
+        experiments = [experiment]
+        for i in range(3):
+            experiments.append(Experiment.objects.create(
+                title='Experiment %d' % i, description='Parrot + %dkV' % i,
+                created_by=user,
+                public_access=Experiment.PUBLIC_ACCESS_FULL))
+        idents = []
+        cursors = []
+        tokens = []
+        url = '/apps/oaipmh/?verb=ListRecords&metadataPrefix=rif'
+        while True:
+            response = self._client_get(url)
+            self.assertEqual(response.status_code, 200)
+            xml = etree.fromstring(response.getvalue())
+            assert not xml.xpath('o:error', namespaces=ns)
+            records = xml.xpath('/o:OAI-PMH/o:ListRecords/o:record',
+                                namespaces=ns)
+            self.assertLessEqual(len(records), 2)
+            idents += xml.xpath('/o:OAI-PMH/o:ListRecords/o:record'
+                                '/o:header/o:identifier/text()',
+                                namespaces=ns)
+            token, = xml.xpath('/o:OAI-PMH/o:ListRecords/o:resumptionToken',
+                               namespaces=ns)
+            cursors.append(token.get('cursor'))
+            if not token.text:
+                break
+            tokens.append(token.text)
+            url = '/apps/oaipmh/?verb=ListRecords&resumptionToken=%s' % \
+                token.text
+        # Experiments in order of update, then their owner
+        self.assertEqual(
+            idents,
+            ['experiment/%d' % e.id for e in experiments] +
+            ['user/%d' % user.id])
+        self.assertEqual(cursors, ['0', '2', '4'])
+        # Tokens can't be modified, or used with another verb
+        for verb, token in [('ListRecords', tokens[0] + 'x'),
+                            ('ListIdentifiers', tokens[0])]:
+            response = self._client_get(
+                '/apps/oaipmh/?verb=%s&resumptionToken=%s' % (verb, token))
+            xml = etree.fromstring(response.content)
+            self.assertEqual(xml.xpath('o:error/@code', namespaces=ns),
+                             ['badResumptionToken'])
+
     def _client_get(self, url):
         return self._client.get(url)
 
@@ -1,9 +1,13 @@
 from django.contrib.sites.shortcuts import get_current_site
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
 from .server import get_server
 
 
 def endpoint(request):
-    return HttpResponse(get_server(get_current_site(request))
-                        .handleRequest(request.GET),
-                        content_type='application/xml', status=200)
+    response = get_server(get_current_site(request)).handleRequest(request.GET)
+    if isinstance(response, bytes):
+        return HttpResponse(response, content_type='application/xml',
+                            status=200)
+    # List responses are generated a page of records at a time
+    return StreamingHttpResponse(response, content_type='application/xml',
+                                 status=200)
@@ -1,4 +1,8 @@
+import logging
 import os
+import queue
+import shutil
+import threading
 from datetime import datetime, timedelta
 import pytz
 
@@ -13,6 +17,11 @@ from tardis.tardis_portal.util import get_filesystem_safe_dataset_name
 
 from .models import Credential, RemoteHost, Request, Progress
 
+logger = logging.getLogger(__name__)
+
+# The size of the reads from source files when uploading them
+UPLOAD_BUFFER_SIZE = 1024 * 1024
+
 
 @tardis_app.task
 def requests_maintenance(**kwargs):
@@ -96,17 +105,13 @@ def push_datafile_to_host(user_id, credential_id, remote_host_id,
 @tardis_app.task(ignore_result=True)
 def process_request(request_id, idle=0):
     req = Request.objects.get(pk=request_id)
-    files = Progress.objects.filter(request=req, status=0, retry__lt=10)
-    no_errors = True
+    files = Progress.objects.filter(request=req, status=0, retry__lt=10)\
+                            .select_related('datafile__dataset')\
+                            .prefetch_related('datafile__file_objects')\
+                            .order_by('id')
 
     try:
-        ssh = req.credential.get_client_for_host(req.host)
-        # https://github.com/paramiko/paramiko/issues/175#issuecomment-24125451
-        transport = ssh.get_transport()
-        transport.default_window_size = 2147483647
-        transport.packetizer.REKEY_BYTES = pow(2, 40)
-        transport.packetizer.REKEY_PACKETS = pow(2, 40)
-        sftp = ssh.open_sftp()
+        connections = [open_sftp(req)]
     except Exception as err:
         # Authentication failed (expired?)
         req.message = "Can't connect: %s" % str(err)
@@ -123,37 +128,58 @@ def process_request(request_id, idle=0):
         experiment = Experiment.objects.get(pk=req.object_id)
         remote_base_dir.append(get_filesystem_safe_experiment_name(experiment))
 
-    make_dirs(sftp, remote_base_dir)
+    make_dirs(connections[0][1], remote_base_dir)
 
+    no_errors = True
+    started = timezone.now()
+    transfers = []
+    failed = []
+    remote_dirs = set()
     for file in files:
-        file.timestamp = timezone.now()
-        src_file = file.datafile.get_absolute_filepath()
+        # Files which have been attempted before may have been partially
+        # transferred, so their uploads are resumed
+        resume = file.timestamp is not None
+        file.timestamp = started
+        src_file = get_source_path(file.datafile)
         if src_file is not None and os.path.exists(src_file):
-            try:
-                path = [get_filesystem_safe_dataset_name(file.datafile.dataset)]
-                if file.datafile.directory is not None:
-                    path += file.datafile.directory.split('/')
-                path = remote_base_dir + path
-                make_dirs(sftp, path)
-                path_str = "/".join(path + [file.datafile.filename])
-                sftp.putfo(file.datafile.get_file(), path_str, file.datafile.size)
-                file.status = 1
-            except Exception as e:
-                no_errors = False
-                file.retry += 1
-                file.message = str(e)
+            path = [get_filesystem_safe_dataset_name(file.datafile.dataset)]
+            if file.datafile.directory is not None:
+                path += file.datafile.directory.split('/')
+            path = remote_base_dir + path
+            for depth in range(len(remote_base_dir) + 1, len(path) + 1):
+                remote_dirs.add(tuple(path[:depth]))
+            path_str = "/".join(path + [file.datafile.filename])
+            transfers.append(Transfer(file, src_file, path_str, resume))
         else:
             no_errors = False
             file.retry += 1
             file.message = "Can't find source file."
-        file.save()
-        if not no_errors and file.message is not None and (
-                "Socket is closed" in file.message or
-                "Server connection dropped" in file.message):
-            break
+            failed.append(file)
+    save_progress(failed)
+    # Mark the files as attempted, so they're resumed if this task dies
+    Progress.objects.filter(request=req, status=0, retry__lt=10,
+                            timestamp__isnull=True).update(timestamp=started)
 
-    sftp.close()
-    ssh.close()
+    try:
+        # Create the whole remote directory tree once, parents first
+        for directory in sorted(remote_dirs, key=len):
+            make_dir(connections[0][1], "/".join(directory))
+        for _ in range(1, min(len(transfers), get_max_connections())):
+            try:
+                connections.append(open_sftp(req))
+            except Exception as err:
+                logger.warning("Can't open another connection for push-to "
+                               "request %s: %s", req.id, str(err))
+                break
+        if not run_transfers([sftp for _, sftp in connections], transfers):
+            no_errors = False
+    except Exception:
+        logger.exception("Push-to request %s failed", req.id)
+        no_errors = False
+    finally:
+        for ssh, sftp in connections:
+            sftp.close()
+            ssh.close()
 
     if no_errors:
         complete_request(req.id)
@@ -161,6 +187,172 @@ def process_request(request_id, idle=0):
         process_request.apply_async(args=[req.id, idle+1], countdown=(idle+1)*60)
 
 
+def open_sftp(req):
+    """
+    Open an SSH connection to a request's remote host and start an SFTP
+    session over it
+
+    :param Request req: the push-to request
+    :returns: the SSH client and the SFTP client
+    :rtype: tuple
+    """
+    ssh = req.credential.get_client_for_host(req.host)
+    # https://github.com/paramiko/paramiko/issues/175#issuecomment-24125451
+    transport = ssh.get_transport()
+    transport.default_window_size = 2147483647
+    transport.packetizer.REKEY_BYTES = pow(2, 40)
+    transport.packetizer.REKEY_PACKETS = pow(2, 40)
+    return ssh, ssh.open_sftp()
+
+
+def get_max_connections():
+    return getattr(settings, 'PUSH_TO_MAX_CONNECTIONS', 4)
+
+
+def get_source_path(datafile):
+    """
+    :return: the local path of a DataFile's verified copy, or None if it
+        doesn't have one in file system storage
+    :rtype: str
+    """
+    for dfo in datafile.file_objects.all():
+        if not dfo.verified:
+            continue
+        try:
+            return dfo.get_full_path()
+        except NotImplementedError:
+            # Not in file system storage
+            continue
+    return None
+
+
+class Transfer:
+    """
+    A file to upload, and the Progress record to update with the outcome
+    """
+    def __init__(self, progress, src_file, remote_path, resume=False):
+        self.progress = progress
+        self.src_file = src_file
+        self.remote_path = remote_path
+        self.resume = resume
+
+
+def run_transfers(sftp_clients, transfers):
+    """
+    Upload files concurrently, over one thread per SFTP client
+
+    Each thread takes the next transfer from a shared queue until they have
+    all been attempted, or until its connection is dropped.  The outcomes
+    are saved in batches of PUSH_TO_PROGRESS_BATCH_SIZE Progress records.
+
+    :param list sftp_clients: the SFTP clients, one per connection
+    :param list transfers: the :py:class:`Transfer` objects
+    :returns: True if all of the files were uploaded
+    :rtype: bool
+    """
+    batch_size = getattr(settings, 'PUSH_TO_PROGRESS_BATCH_SIZE', 500)
+    pending = queue.Queue()
+    for transfer in transfers:
+        pending.put(transfer)
+    results = queue.Queue()
+    workers = [threading.Thread(target=transfer_worker,
+                                args=(sftp, pending, results), daemon=True)
+               for sftp in sftp_clients]
+    for worker in workers:
+        worker.start()
+
+    no_errors = True
+    attempted = 0
+    batch = []
+    running = len(workers)
+    while running:
+        progress = results.get()
+        if progress is None:
+            # A worker has finished
+            running -= 1
+            continue
+        attempted += 1
+        if progress.status != 1:
+            no_errors = False
+        batch.append(progress)
+        if len(batch) >= batch_size:
+            save_progress(batch)
+            batch = []
+    save_progress(batch)
+    return no_errors and attempted == len(transfers)
+
+
+def transfer_worker(sftp, pending, results):
+    try:
+        while True:
+            try:
+                transfer = pending.get_nowait()
+            except queue.Empty:
+                return
+            progress = transfer.progress
+            try:
+                upload_file(sftp, transfer.src_file, transfer.remote_path,
+                            progress.datafile.size, transfer.resume)
+                progress.status = 1
+            except Exception as e:
+                progress.retry += 1
+                progress.message = str(e)
+            results.put(progress)
+            if progress.status != 1 and progress.message is not None and (
+                    "Socket is closed" in progress.message or
+                    "Server connection dropped" in progress.message):
+                # Leave the remaining files to the other connections
+                return
+    finally:
+        results.put(None)
+
+
+def upload_file(sftp, src_file, remote_path, size=None, resume=False):
+    """
+    Upload a file with pipelined writes, so they aren't each waiting for
+    the server's acknowledgement
+
+    :param paramiko.SFTPClient sftp: the SFTP client
+    :param str src_file: the local path of the file
+    :param str remote_path: the remote path of the file
+    :param int size: the expected size of the file
+    :param bool resume: whether to append to an existing, smaller remote
+        file, rather than replacing it
+    :raises IOError: if the remote file's size doesn't match after
+        uploading
+    """
+    offset = 0
+    if resume:
+        try:
+            offset = sftp.stat(remote_path).st_size
+        except IOError:  # Raised when the file doesn't exist
+            offset = 0
+        if size is None or offset > size:
+            offset = 0
+    if not offset or offset < size:
+        with open(src_file, 'rb') as src:
+            src.seek(offset)
+            with sftp.open(remote_path, 'r+b' if offset else 'wb') as dst:
+                dst.seek(offset)
+                dst.set_pipelined(True)
+                shutil.copyfileobj(src, dst, UPLOAD_BUFFER_SIZE)
+    remote_size = sftp.stat(remote_path).st_size
+    if size is not None and remote_size != size:
+        raise IOError("Size mismatch: %d != %d" % (remote_size, size))
+
+
+def save_progress(progress_list):
+    """
+    Save the outcomes of transfers with one query per batch of Progress
+    records
+    """
+    for progress in progress_list:
+        if progress.message is not None:
+            progress.message = progress.message[:100]
+    Progress.objects.bulk_update(
+        progress_list, ['status', 'retry', 'message', 'timestamp'])
+
+
 def complete_request(request_id):
     req = Request.objects.get(pk=request_id)
     total_files = Progress.objects.filter(request=req).count()
@@ -210,3 +402,14 @@ def make_dirs(sftp_client, dir_list):
             sftp_client.stat(full_path)
         except IOError:  # Raised when the directory doesn't exist
             sftp_client.mkdir(full_path)
+
+
+def make_dir(sftp_client, path):
+    """
+    Create a remote directory whose parent exists, unless it already exists
+    """
+    try:
+        sftp_client.mkdir(path)
+    except IOError:
+        # Raised when the directory already exists, or can't be created
+        sftp_client.stat(path)
@@ -0,0 +1,159 @@
+import os
+import shutil
+import tempfile
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+
+from tardis.tardis_portal.models import (
+    DataFile, DataFileObject, Dataset, StorageBox)
+
+from ..models import Credential, Progress, RemoteHost
+from ..tasks import process_request, push_dataset_to_host
+
+
+class LocalSFTPClient():
+    '''
+    Stands in for a paramiko SFTPClient, with a local directory as the
+    remote file system
+    '''
+    def __init__(self, root, calls):
+        self.root = root
+        self.calls = calls
+
+    def _path(self, path):
+        return os.path.join(self.root, path.lstrip('/'))
+
+    def stat(self, path):
+        return os.stat(self._path(path))
+
+    def mkdir(self, path):
+        self.calls.append(('mkdir', path))
+        os.mkdir(self._path(path))
+
+    def open(self, path, mode='r'):
+        self.calls.append(('open', path, mode))
+        sftp_file = open(self._path(path), mode)
+        sftp_file.set_pipelined = lambda pipelined=True: None
+        return sftp_file
+
+    def close(self):
+        pass
+
+
+class LocalSSHClient():
+    def __init__(self, root, calls):
+        self.root = root
+        self.calls = calls
+
+    def get_transport(self):
+        return SimpleNamespace(packetizer=SimpleNamespace())
+
+    def open_sftp(self):
+        return LocalSFTPClient(self.root, self.calls)
+
+    def close(self):
+        pass
+
+
+class PushToTasksTestCase(TestCase):
+    def setUp(self):
+        self.store = tempfile.mkdtemp()
+        self.remote = tempfile.mkdtemp()
+        self.calls = []
+        self.user = User.objects.create_user('aperson',
+                                             email='abc@example.com',
+                                             password='abc')
+        self.remote_host = RemoteHost.objects.create(
+            nickname='dummy host', host_name='localhost',
+            administrator=self.user)
+        self.credential = Credential.objects.create(
+            user=self.user, remote_user='remote_user')
+        self.dataset = Dataset.objects.create(description='dataset')
+        box = StorageBox.create_local_box(self.store)
+        self.contents = {}
+        for directory, filename in [(None, 'a.txt'), ('sub', 'b.txt'),
+                                    ('sub/dir', 'c.txt'),
+                                    ('sub/dir', 'd.txt')]:
+            data = ('contents of %s' % filename).encode()
+            datafile = DataFile.objects.create(
+                dataset=self.dataset, directory=directory, filename=filename,
+                size=len(data), md5sum='bogus')
+            with open(os.path.join(self.store, filename), 'wb') as f:
+                f.write(data)
+            DataFileObject.objects.filter(
+                id=DataFileObject.objects.create(
+                    datafile=datafile, storage_box=box, uri=filename).id
+            ).update(verified=True)
+            self.contents[os.path.join(directory or '', filename)] = data
+
+    def tearDown(self):
+        shutil.rmtree(self.store)
+        shutil.rmtree(self.remote)
+
+    def _patch_client(self):
+        return patch.object(
+            Credential, 'get_client_for_host',
+            lambda credential, remote_host: LocalSSHClient(self.remote,
+                                                           self.calls))
+
+    def _push(self):
+        with self._patch_client():
+            push_dataset_to_host(self.user.id, self.credential.id,
+                                 self.remote_host.id, self.dataset.id,
+                                 base_dir='')
+
+    def _process(self, request_id):
+        with self._patch_client():
+            process_request(request_id)
+
+    def _remote_contents(self):
+        contents = {}
+        for dirpath, _, filenames in os.walk(self.remote):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                with open(path, 'rb') as f:
+                    contents[os.path.relpath(
+                        path, os.path.join(self.remote, 'mytardis-%d' %
+                                           Progress.objects.first()
+                                           .request_id, 'dataset'))] = \
+                        f.read()
+        return contents
+
+    @override_settings(PUSH_TO_MAX_CONNECTIONS=2,
+                       PUSH_TO_PROGRESS_BATCH_SIZE=3)
+    def test_push_dataset(self):
+        self._push()
+        self.assertEqual(self._remote_contents(), self.contents)
+        self.assertEqual(Progress.objects.filter(status=1).count(), 4)
+        # Each remote directory is created once
+        mkdirs = [call[1] for call in self.calls if call[0] == 'mkdir']
+        self.assertEqual(len(mkdirs), len(set(mkdirs)))
+        self.assertEqual(len(mkdirs), 4)
+
+    @override_settings(PUSH_TO_MAX_CONNECTIONS=2)
+    def test_resume_push(self):
+        # Each connection stops when it's dropped, leaving the remaining
+        # files for the next attempt
+        with patch.object(process_request, 'apply_async'):
+            self._push()
+            request_id = Progress.objects.first().request_id
+            with patch('tardis.apps.push_to.tasks.upload_file',
+                       side_effect=IOError('Server connection dropped')):
+                self._process(request_id)
+        self.assertEqual(Progress.objects.filter(status=1).count(), 0)
+        self.assertEqual(Progress.objects.filter(retry=1).count(), 2)
+        # A partial copy of a file is resumed
+        remote_dir = os.path.join(
+            self.remote, 'mytardis-%d' % request_id, 'dataset')
+        with open(os.path.join(remote_dir, 'sub', 'dir', 'c.txt'), 'wb') as f:
+            f.write(self.contents['sub/dir/c.txt'][:5])
+
+        self.calls.clear()
+        self._process(request_id)
+        self.assertEqual(self._remote_contents(), self.contents)
+        self.assertEqual(Progress.objects.filter(status=1).count(), 4)
+        self.assertIn(('open', '/mytardis-%d/dataset/sub/dir/c.txt' %
+                       request_id, 'r+b'), self.calls)
@@ -8,3 +8,27 @@ A short expiry (30 seconds) is used, because it is only
 intended to provide access long enough for an authenticated
 MyTardis user to be redirected to the signed URL.
 '''
+
+S3_CHECKSUM_CHUNK_SIZE = 8 * 1024 * 1024
+'''
+The size in bytes of the ranged GET requests used to download S3 objects
+when calculating their checksums.
+'''
+
+S3_CHECKSUM_MAX_WORKERS = 4
+'''
+The number of ranged GET requests in flight at once when calculating the
+checksums of an S3 object.  Chunks are hashed in order as they arrive, so
+up to this many chunks are held in memory.
+'''
+
+S3_CHECKSUM_USE_ETAG = True
+'''
+Whether to compare an S3 object's ETag with the MD5 sum recorded for its
+DataFile before downloading it to calculate its checksums.  If they
+differ, the ETag's MD5 sum is returned without downloading the object,
+so verification fails fast; if they match, the object is still
+downloaded and hashed.  This is only done for objects uploaded in a
+single part which aren't encrypted with a KMS or customer-provided key,
+whose ETag is their MD5 sum.
+'''
@@ -3,20 +3,20 @@ Testing the s3util app's ability to calculate checksums for S3 objects
 
 .. moduleauthor:: James Wettenhall <james.wettenhall@monash.edu>
 '''
-import unittest
-import sys
+from io import BytesIO
 
-from unittest.mock import patch
+from botocore.response import StreamingBody
+from botocore.stub import Stubber
 
-from django.test import TestCase
+from django.test import TestCase, override_settings
 
 from tardis.tardis_portal.models.dataset import Dataset
 from tardis.tardis_portal.models.datafile import DataFile, DataFileObject
 from tardis.tardis_portal.models.storage import StorageBox, StorageBoxOption
 
+from ..utils import get_s3_client
+
 
-@unittest.skipIf(sys.platform == 'win32',
-                 "Windows doesn't have md5sum and sha512sum binaries")
 class S3UtilsAppChecksumsTestCase(TestCase):
     def setUp(self):
         super().setUp()
@@ -45,28 +45,85 @@ class S3UtilsAppChecksumsTestCase(TestCase):
         StorageBoxOption.objects.create(
             storage_box=self.s3_storage_box, key='signature_version',
             value='s3')
+        StorageBoxOption.objects.create(
+            storage_box=self.s3_storage_box, key='region_name',
+            value='us-east-1')
+        self.dfo = DataFileObject(
+            storage_box=self.s3_storage_box, datafile=self.datafile,
+            uri='test.txt')
+
+    def _stub_head_object(self, stubber, etag):
+        stubber.add_response(
+            'head_object', {'ContentLength': 4, 'ETag': etag},
+            {'Bucket': 'test-bucket', 'Key': 'test.txt'})
 
+    def _stub_get_object(self, stubber, etag, start, data):
+        stubber.add_response(
+            'get_object',
+            {'Body': StreamingBody(BytesIO(data), len(data))},
+            {'Bucket': 'test-bucket', 'Key': 'test.txt', 'IfMatch': etag,
+             'Range': 'bytes=%d-%d' % (start, start + len(data) - 1)})
+
+    # One worker, so the ranged requests are made in order
+    @override_settings(S3_CHECKSUM_CHUNK_SIZE=3, S3_CHECKSUM_MAX_WORKERS=1)
     def test_checksums(self):
         '''
         Ensure that we can calculate an MD5 sum and a SHA512 sum for
-        a file in S3 object storage
+        a file in S3 object storage, downloading it once
         '''
-        dfo = DataFileObject(
-            storage_box=self.s3_storage_box, datafile=self.datafile)
-
-        def mock_download_fileobj(*args, **kwargs):
+        client, _ = get_s3_client(self.s3_storage_box)
+        # A multipart upload's ETag isn't an MD5 sum
+        etag = '"9b2cf535f27731c974343645a3985328-2"'
+        with Stubber(client) as stubber:
+            self._stub_head_object(stubber, etag)
+            self._stub_get_object(stubber, etag, 0, b'tes')
+            self._stub_get_object(stubber, etag, 3, b't')
+            checksums = self.dfo.calculate_checksums(
+                compute_md5=True, compute_sha512=True)
+            stubber.assert_no_pending_responses()
+        self.assertEqual(checksums['md5sum'], self.datafile.md5sum)
+        self.assertEqual(checksums['sha512sum'], self.datafile.sha512sum)
 
-            def download(self, uri, pipe):
-                pipe.write(b'test')
+    def test_checksums_etag_mismatch(self):
+        '''
+        Ensure that an object uploaded in a single part whose ETag doesn't
+        match the DataFile's MD5 sum isn't downloaded, and that one whose
+        ETag matches is still downloaded and hashed
+        '''
+        client, _ = get_s3_client(self.s3_storage_box)
+        other_md5sum = 'd8e8fca2dc0f896fd7cb4cb0031ba249'
+        with Stubber(client) as stubber:
+            self._stub_head_object(stubber, '"%s"' % other_md5sum)
+            checksums = self.dfo.calculate_checksums(
+                compute_md5=True, compute_sha512=False)
+            stubber.assert_no_pending_responses()
+        self.assertEqual(checksums, {'md5sum': other_md5sum})
 
-            return download
+        with Stubber(client) as stubber:
+            etag = '"%s"' % self.datafile.md5sum
+            self._stub_head_object(stubber, etag)
+            self._stub_get_object(stubber, etag, 0, b'test')
+            checksums = self.dfo.calculate_checksums(
+                compute_md5=True, compute_sha512=False)
+            stubber.assert_no_pending_responses()
+        self.assertEqual(checksums, {'md5sum': self.datafile.md5sum})
 
-        with patch('boto3.s3.inject.bucket_download_fileobj',
-                   new_callable=mock_download_fileobj):
-            checksums = dfo.calculate_checksums(
-                compute_md5=True, compute_sha512=True)
-            self.assertEqual(checksums['md5sum'], self.datafile.md5sum)
-            self.assertEqual(checksums['sha512sum'], self.datafile.sha512sum)
+    def test_s3_client_reused(self):
+        '''
+        Ensure that a storage box's S3 client is reused until its options
+        change
+        '''
+        client, bucket_name = get_s3_client(self.s3_storage_box)
+        self.assertEqual(bucket_name, 'test-bucket')
+        self.assertIs(get_s3_client(self.s3_storage_box)[0], client)
+        option = StorageBoxOption.objects.get(
+            storage_box=self.s3_storage_box, key='bucket_name')
+        option.value = 'other-bucket'
+        option.save()
+        other_client, bucket_name = get_s3_client(
+            StorageBox.objects.get(id=self.s3_storage_box.id))
+        self.assertEqual(bucket_name, 'other-bucket')
+        self.assertIsNot(other_client, client)
 
     def tearDown(self):
         super().tearDown()
@@ -1,17 +1,39 @@
 """
 Utilities for S3 objects
 """
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+from itertools import islice
 import re
-import subprocess
-import sys
+import threading
 
 from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 
 import boto3
 from botocore.client import Config
 
+from tardis.tardis_portal.models.storage import StorageBox, StorageBoxOption
+
 from . import default_settings
 
+BOTO3_CLIENT_KWARGS = [
+    'region_name', 'api_version', 'use_ssl', 'verify', 'endpoint_url',
+    'aws_access_key_id', 'aws_secret_access_key', 'aws_session_token']
+
+ETAG_MD5_PATTERN = re.compile(r'^"?([0-9a-f]{32})"?$')
+
+# boto3 clients and bucket names, keyed by storage box ID, options version
+# and signature version
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def _get_setting(name):
+    return getattr(settings, name, getattr(default_settings, name))
+
 
 def generate_presigned_url(dfo, expiry=None):
     """
@@ -33,21 +55,12 @@ def generate_presigned_url(dfo, expiry=None):
     string
         The pre-signed URL
     """
-    box = dfo.storage_box
-    endpoint_url = box.options.get(key='endpoint_url').value
-    access_key = box.options.get(key='access_key').value
-    secret_key = box.options.get(key='secret_key').value
-    bucket_name = box.options.get(key='bucket_name').value
     if not expiry:
         expiry = getattr(
             settings, 'S3_SIGNED_URL_EXPIRY',
             default_settings.S3_SIGNED_URL_EXPIRY)
-    s3client = boto3.client(
-        's3',
-        aws_access_key_id=access_key,
-        aws_secret_access_key=secret_key,
-        endpoint_url=endpoint_url,
-        config=Config(signature_version='s3'))
+    s3client, bucket_name = get_s3_client(
+        dfo.storage_box, signature_version='s3')
     return s3client.generate_presigned_url(
         'get_object',
         Params={
@@ -57,13 +70,179 @@ def generate_presigned_url(dfo, expiry=None):
         ExpiresIn=expiry)
 
 
+def get_s3_client(storage_box, signature_version=None):
+    """
+    Get a boto3 S3 client and bucket name for a storage box
+
+    boto3 clients are thread-safe and keep a pool of HTTP connections, so
+    each process creates one client per storage box and reuses it until the
+    box's options change (see StorageBox.options_version).
+
+    Parameters
+    ----------
+    storage_box : StorageBox
+        The storage box, whose options include the bucket_name and the
+        boto3 client's keyword arguments
+    signature_version : string
+        Overrides the signature_version option of the storage box
+
+    Returns
+    -------
+    tuple
+        The boto3 S3 client and the bucket name
+    """
+    cache_key = (storage_box.id, storage_box.options_version,
+                 signature_version)
+    client_and_bucket = _clients.get(cache_key)
+    if client_and_bucket is None:
+        options = dict(storage_box.options.values_list('key', 'value'))
+        if signature_version:
+            options['signature_version'] = signature_version
+        client_and_bucket = (_create_s3_client(options),
+                             options['bucket_name'])
+        with _clients_lock:
+            for other_key in list(_clients):
+                if other_key[0] == storage_box.id and \
+                        other_key[1] != storage_box.options_version:
+                    del _clients[other_key]
+            client_and_bucket = _clients.setdefault(
+                cache_key, client_and_bucket)
+    return client_and_bucket
+
+
+def forget_s3_clients(storage_box_id):
+    """
+    Remove a storage box's boto3 clients from this process's cache
+    """
+    with _clients_lock:
+        for cache_key in list(_clients):
+            if cache_key[0] == storage_box_id:
+                del _clients[cache_key]
+
+
+@receiver(post_save, sender=StorageBox, dispatch_uid='s3utils_box_changed')
+@receiver(post_delete, sender=StorageBox,
+          dispatch_uid='s3utils_box_changed')
+def storage_box_changed(sender, instance, **kwargs):
+    forget_s3_clients(instance.id)
+
+
+@receiver(post_save, sender=StorageBoxOption,
+          dispatch_uid='s3utils_box_option_changed')
+@receiver(post_delete, sender=StorageBoxOption,
+          dispatch_uid='s3utils_box_option_changed')
+def storage_box_option_changed(sender, instance, **kwargs):
+    forget_s3_clients(instance.storage_box_id)
+
+
+def _create_s3_client(options):
+    config_kwargs = {'max_pool_connections': max(
+        10, _get_setting('S3_CHECKSUM_MAX_WORKERS'))}
+    boto3_kwargs = {}
+    for key, value in options.items():
+        if key == 'signature_version':
+            config_kwargs['signature_version'] = value
+            continue
+        key = key.replace('access_key', 'aws_access_key_id')
+        key = key.replace('secret_key', 'aws_secret_access_key')
+        if key not in BOTO3_CLIENT_KWARGS:
+            continue
+        boto3_kwargs[key] = value
+    # The default session isn't thread-safe, so each client gets its own
+    return boto3.session.Session().client(
+        's3', config=Config(**config_kwargs), **boto3_kwargs)
+
+
+def get_etag_md5sum(head):
+    """
+    Get the MD5 sum of an S3 object from its ETag, if possible
+
+    The ETag of an object uploaded in a single part is its MD5 sum, unless
+    it is encrypted with a KMS or customer-provided key.  The ETag of a
+    multipart upload is a digest of the parts' MD5 sums, followed by a dash
+    and the number of parts, so it can't be used.
+
+    Parameters
+    ----------
+    head : dict
+        The boto3 head_object response for the object
+
+    Returns
+    -------
+    string
+        The MD5 sum, or None if it can't be determined from the ETag
+    """
+    if head.get('ServerSideEncryption') == 'aws:kms' or \
+            head.get('SSECustomerAlgorithm'):
+        return None
+    match = ETAG_MD5_PATTERN.match(head.get('ETag', ''))
+    return match.group(1) if match else None
+
+
+def iter_object_chunks(client, bucket_name, key, size, etag=None):
+    """
+    Yield the contents of an S3 object in order, S3_CHECKSUM_CHUNK_SIZE
+    bytes at a time
+
+    Up to S3_CHECKSUM_MAX_WORKERS ranged GET requests are in flight at once,
+    so the next chunks are downloading while the current one is processed.
+
+    Parameters
+    ----------
+    client : botocore.client.S3
+        The boto3 S3 client
+    bucket_name : string
+        The object's bucket
+    key : string
+        The object's key
+    size : int
+        The object's size in bytes, from its head_object response
+    etag : string
+        The object's ETag.  If given, the download fails rather than mixing
+        the contents of two versions if the object is replaced.
+
+    Raises
+    ------
+    IOError
+        If a range is shorter than expected
+    """
+    chunk_size = int(_get_setting('S3_CHECKSUM_CHUNK_SIZE'))
+    max_workers = int(_get_setting('S3_CHECKSUM_MAX_WORKERS'))
+
+    def get_range(start):
+        end = min(start + chunk_size, size)
+        kwargs = dict(Bucket=bucket_name, Key=key,
+                      Range='bytes=%d-%d' % (start, end - 1))
+        if etag:
+            kwargs['IfMatch'] = etag
+        data = client.get_object(**kwargs)['Body'].read()
+        if len(data) != end - start:
+            raise IOError('Read %d bytes of %s at offset %d, expected %d'
+                          % (len(data), key, start, end - start))
+        return data
+
+    offsets = iter(range(0, size, chunk_size))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque(executor.submit(get_range, offset)
+                        for offset in islice(offsets, max_workers))
+        while pending:
+            data = pending.popleft().result()
+            for offset in islice(offsets, 1):
+                pending.append(executor.submit(get_range, offset))
+            yield data
+
+
 def calculate_checksums(dfo, compute_md5=True, compute_sha512=False):
     """Calculates checksums for an S3 DataFileObject instance.
     For files in S3, using the django-storages abstraction is
     inefficient - we end up with a clash of chunking algorithms
     between the download from S3 and MyTardis's Python-based checksum
-    calculation.  So for S3 files, we calculate checksums using external
-    binaries (md5sum and shasum) instead.
+    calculation.  So for S3 files, the object is downloaded once with
+    concurrent ranged GET requests, and each chunk is passed to all of
+    the requested hashers.  If S3_CHECKSUM_USE_ETAG is enabled and the
+    object's ETag shows that its MD5 sum differs from the DataFile's, that
+    MD5 sum is returned without downloading the object, so verification
+    fails fast.
 
     :param dfo : The DataFileObject instance
     :type dfo: DataFileObject
@@ -75,47 +254,25 @@ def calculate_checksums(dfo, compute_md5=True, compute_sha512=False):
     :return: the checksums as {'md5sum': result, 'sha512sum': result}
     :rtype: dict
     """
-    from botocore.client import Config
-    options = dfo.storage_box.options.all()
-    boto3_kwargs = dict(config=Config())
-    for option in options:
-        key = option.key
-        if key == 'signature_version':
-            boto3_kwargs['config'] = Config(signature_version=option.value)
-            continue
-        key = key.replace('access_key', 'aws_access_key_id')
-        key = key.replace('secret_key', 'aws_secret_access_key')
-        if key not in [
-                'region_name', 'api_version', 'use_ssl', 'verify',
-                'endpoint_url', 'aws_access_key_id', 'aws_secret_access_key',
-                'aws_session_token']:
-            continue
-        boto3_kwargs[key] = option.value
-    s3resource = boto3.resource('s3', **boto3_kwargs)
-    bucket = s3resource.Bucket(options.get(key='bucket_name').value)
+    client, bucket_name = get_s3_client(dfo.storage_box)
+    head = client.head_object(Bucket=bucket_name, Key=dfo.uri)
 
-    checksums = {}
+    if compute_md5 and _get_setting('S3_CHECKSUM_USE_ETAG'):
+        md5sum = get_etag_md5sum(head)
+        expected = dfo.datafile.md5sum
+        if md5sum and expected and md5sum != expected.lower():
+            # The object can't match, so there's no need to download it
+            return {'md5sum': md5sum}
 
+    hashers = {}
     if compute_md5:
-        md5sum_binary = 'md5sum'
-        if sys.platform == 'darwin':
-            md5sum_binary = 'md5'
-        with subprocess.Popen(
-            [md5sum_binary],
-            stdin=subprocess.PIPE, stdout=subprocess.PIPE) as proc:
-            bucket.download_fileobj(dfo.uri, proc.stdin)
-            stdout, _ = proc.communicate()
-        checksums['md5sum'] = \
-            re.match(b'\w+', stdout).group(0).decode('utf8')
-
+        hashers['md5sum'] = hashlib.md5()
     if compute_sha512:
-        shasum_binary = 'shasum'
-        with subprocess.Popen(
-            [shasum_binary, '-a', '512'],
-            stdin=subprocess.PIPE, stdout=subprocess.PIPE) as proc:
-            bucket.download_fileobj(dfo.uri, proc.stdin)
-            stdout, _ = proc.communicate()
-        checksums['sha512sum'] = \
-            re.match(b'\w+', stdout).group(0).decode('utf8')
-
-    return checksums
+        hashers['sha512sum'] = hashlib.sha512()
+    if hashers:
+        for chunk in iter_object_chunks(client, bucket_name, dfo.uri,
+                                        head['ContentLength'],
+                                        head.get('ETag')):
+            for hasher in hashers.values():
+                hasher.update(chunk)
+    return {key: hasher.hexdigest() for key, hasher in hashers.items()}
@@ -7,6 +7,47 @@ SFTP_PORT = 2200
 #     "-----END RSA PRIVATE KEY-----\n")
 SFTP_HOST_KEY = ""
 
+SFTP_MAX_WORKERS = 16
+'''
+The number of threads negotiating new SSH connections.  Established
+connections run in their own threads.
+'''
+
+SFTP_MAX_CONNECTIONS = 200
+'''
+The maximum number of concurrent SFTP connections.  Further connections
+are closed immediately.  None means no limit.
+'''
+
+SFTP_MAX_CONNECTIONS_PER_USER = 10
+'''
+The maximum number of concurrent authenticated SFTP connections per user.
+None means no limit.
+'''
+
+SFTP_READ_AHEAD_SIZE = 1024 * 1024
+'''
+The number of bytes read from the underlying file at once, to serve the
+small sequential read requests of SFTP clients.  0 disables read-ahead.
+'''
+
+SFTP_CACHE_TTL = 60
+'''
+The number of seconds for which an SFTP session caches the user's
+experiments, the experiments' datasets and resolved paths.
+'''
+
+SFTP_CACHE_SIZE = 10000
+'''
+The maximum number of entries in the cache of each SFTP session.
+'''
+
+SFTP_LISTING_PAGE_SIZE = 500
+'''
+The number of files and directories fetched from the database at once when
+an SFTP client lists a directory.
+'''
+
 SFTP_USERNAME_ATTRIBUTE = 'email'
 '''
 The attribute from the User model ('email' or 'username') used to generate
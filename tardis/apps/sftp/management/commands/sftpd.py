@@ -27,12 +27,22 @@ class Command(BaseCommand):
             type=int,
             help='Port to listen on, default: 2200'
         )
+        parser.add_argument(
+            '--stats-interval',
+            dest='stats_interval',
+            default=0,
+            type=float,
+            help='Report active sessions and throughput every '
+                 'STATS_INTERVAL seconds, default: 0 (never)'
+        )
 
     def handle(self, *args, **options):
         try:
             sftp.start_server(
                 host=options.get("host", None),
-                port=options.get("port", 2200)
+                port=options.get("port", 2200),
+                stats_interval=options.get("stats_interval"),
+                stats_stream=self.stdout
             )
         except Exception as err:
             logger.error("Can't start SFTP server: %s" % err)
@@ -9,13 +9,19 @@ import base64
 import collections
 import logging
 import os
+import re
 import stat
+import threading
 import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote
 
 from paramiko.py3compat import StringIO
 
 from django.conf import settings
+from django.db import connections
+from django.db.models import Q
 from paramiko import InteractiveQuery,  RSAKey, ServerInterface,\
     SFTPAttributes, SFTPHandle,\
     SFTPServer, SFTPServerInterface, Transport,\
@@ -29,10 +35,11 @@ from tardis.analytics import tracker
 from tardis.tardis_portal.download import make_mapper
 from tardis.tardis_portal.models import (
     DataFile,
+    Dataset,
+    DatasetDirectory,
     Experiment,
     User
 )
-from tardis.tardis_portal.util import split_path
 
 from .models import SFTPPublicKey
 
@@ -48,132 +55,133 @@ from django.contrib.sites.models import Site  # noqa
 from django.contrib.auth.models import AnonymousUser  # noqa
 
 
-class DynamicTree(object):
-
-    def __init__(self, host_obj=None):
-        self.name = None
-        self.obj = None  # an object if applicable
-        self.update = self.update_nothing
-        self.last_updated = None  # a time.time() number
-        self.host_obj = host_obj
-        self.children = None
-        self.clear_children()
-
-    def update_nothing(self):
-        pass
-
-    def clear_children(self):
-        self.children = collections.defaultdict(
-            lambda: DynamicTree(self.host_obj))
-
-    def add_path(self, path):
-        path = path.strip('/')
-        elems = split_path(path)
-        return self.add_path_elems(elems)
-
-    def add_path_elems(self, elems):
-        first = elems[0]
-        leaf = self.children[first]
-        leaf.name = first
-        if len(elems) > 1:
-            return leaf.add_path_elems(elems[1:])
-        return leaf
-
-    def add_child(self, name, obj=None):
-        new_child = self.children[name]
-        new_child.name = name
-        new_child.obj = obj
-
-    def get_leaf(self, path, update=False):
-        path = path.strip('/')
-        elems = collections.deque(split_path(path))
-        leaf = self.children.get(elems.popleft())
-        if leaf and update:
-            leaf.update()
-        while elems:
-            leaf = leaf.children.get(elems.popleft())
-            if leaf and update:
-                leaf.update()
-        return leaf
-
-    def update_experiments(self):
-        exps = [(path_mapper(exp), exp)
-                for exp in self.host_obj.experiments]
-        self.clear_children()
-        for exp_name, exp in exps:
-            child = self.children[exp_name]
-            child.name = exp_name
-            child.obj = exp
-            child.update = child.update_datasets
-
-    def update_datasets(self):
-        all_files_name = '00_all_files'
-        datasets = [(path_mapper(ds), ds)
-                    for ds in self.obj.datasets.all()]
-        self.clear_children()
-        for ds_name, ds in datasets:
-            if ds_name == all_files_name:
-                ds_name = '%s_dataset' % all_files_name
-            child = self.children[ds_name]
-            child.name = ds_name
-            child.obj = ds
-            child.update = child.update_dataset_files
-        child = self.children[all_files_name]
-        child.name = all_files_name
-        child.obj = self.obj
-        child.update = child.update_all_files
-
-    def update_all_files(self):
-        self.clear_children()
-        for df in DataFile.objects.filter(
-                dataset__experiments=self.obj).iterator():
-            self._add_file_entry(df)
-
-    def update_dataset_files(self):
-        self.clear_children()
-        for df in self.obj.datafile_set.all().iterator():
-            self._add_file_entry(df)
-
-    def _add_file_entry(self, datafile):
-        df_name = path_mapper(datafile)
-        # try:
-        #     file_obj = df.file_object
-        #     file_name = df_name
-        # except IOError:
-        #     file_name = df_name + "_offline"
-        #     if getattr(settings, 'DEBUG', False):
-        #         placeholder = df.file_objects.all()[0].uri
-        #     else:
-        #         placeholder = 'offline file, contact administrator'
-        #     file_obj = StringIO(placeholder)
-        # child = self.children[file_name]
-        # child.name = file_name
-        # child.obj = file_obj
-
-        def add_unique_name(children, orig_name):
-            counter = 1
-            name = orig_name
-            while name in children:
-                counter += 1
-                name = '%s_%i' % (orig_name, counter)
-            return name, children[name]
-
-        if datafile.directory:
-            path = self.add_path(datafile.directory)
-            df_name, child = add_unique_name(path.children, df_name)
-        else:
-            df_name, child = add_unique_name(self.children, df_name)
-        child.name = df_name
-        child.obj = datafile
+ALL_FILES_NAME = '00_all_files'
+'''
+The name of the directory listing all of an experiment's files
+'''
+
+
+class TTLCache(object):
+    """
+    A bounded LRU cache whose entries expire C{ttl} seconds after they were
+    added.  Each SFTP session has its own cache, so it isn't thread-safe.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = collections.OrderedDict()
+
+    def get(self, key, default=None):
+        entry = self._entries.get(key)
+        if entry is None:
+            return default
+        if entry[0] < time.time():
+            del self._entries[key]
+            return default
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def set(self, key, value):
+        self._entries[key] = (time.time() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+
+class SFTPNode(object):
+    """
+    A file or directory in the SFTP namespace:
+
+    - a fixed directory ('/', '/home', ...), with C{children} names
+    - the 'experiments' directory listing the user's experiments
+    - an experiment directory listing its datasets and L{ALL_FILES_NAME}
+    - a directory of DataFiles, either within a C{dataset} or within all of
+      an C{experiment}'s datasets, with the C{directory} path relative to
+      the dataset
+    - a DataFile
+    """
+    FIXED, EXPERIMENTS, EXPERIMENT, FILES, FILE = range(5)
+
+    def __init__(self, kind, name, obj=None, experiment=None, dataset=None,
+                 directory='', children=()):
+        self.kind = kind
+        self.name = name
+        self.obj = obj
+        self.experiment = experiment
+        self.dataset = dataset
+        self.directory = directory
+        self.children = children
+
+    @property
+    def is_dir(self):
+        return self.kind != SFTPNode.FILE
+
+
+class PagedListing(list):
+    """
+    A directory listing which is fetched page by page while the client
+    reads it, rather than all at once.  paramiko only accepts lists as
+    directory listings, but it only slices them, C{[:16]} and C{[16:]}.
+    """
+
+    def __init__(self, entries):
+        super().__init__()
+        self._entries = iter(entries)
+
+    def _fill(self, count=None):
+        while count is None or list.__len__(self) < count:
+            try:
+                self.append(next(self._entries))
+            except StopIteration:
+                break
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            self._fill(index + 1 if index >= 0 else None)
+            return list.__getitem__(self, index)
+        if index.stop is None and index.step is None and \
+                (index.start or 0) >= 0:
+            # The rest of the listing, which continues to fetch entries
+            # from this listing's pages, i.e. this listing can't be read
+            # further afterwards
+            self._fill(index.start)
+            rest = PagedListing(self._entries)
+            rest.extend(list.__getitem__(self, index))
+            return rest
+        stop = index.stop
+        self._fill(stop if stop is not None and stop >= 0 and
+                   (index.start or 0) >= 0 else None)
+        return list.__getitem__(self, index)
+
+    def __iter__(self):
+        yield from list.__iter__(self)
+        for entry in self._entries:
+            self.append(entry)
+            yield entry
+
+    def __len__(self):
+        self._fill()
+        return list.__len__(self)
+
+    def __bool__(self):
+        self._fill(1)
+        return list.__len__(self) > 0
 
 
 class MyTSFTPServerInterface(SFTPServerInterface):
     """
     MyTardis data via SFTP
-    """
 
-    _cache_time = 60  # in seconds
-    _exps_cache = {}
+    The namespace is resolved lazily from the database: listing a directory
+    only queries its subdirectories (from the datasets' directory indexes)
+    and its files, page by page.  Resolved paths, the user's experiments
+    and the experiments' datasets are cached for SFTP_CACHE_TTL seconds,
+    in a cache of up to SFTP_CACHE_SIZE entries per session.
+    """
 
     def __init__(self, server, *args, **kwargs):
         """
@@ -184,19 +192,39 @@ class MyTSFTPServerInterface(SFTPServerInterface):
         """
         self.server = server
         self.client_ip = kwargs.get('client_ip', '')
+        self.cache = TTLCache(
+            maxsize=getattr(settings, 'SFTP_CACHE_SIZE', 10000),
+            ttl=getattr(settings, 'SFTP_CACHE_TTL', 60))
+        self.page_size = getattr(settings, 'SFTP_LISTING_PAGE_SIZE', 500)
 
     @property
     def experiments(self):
-        u = self.user.username
-        if u not in self._exps_cache:
-            self._exps_cache[u] = {'all': None, 'last_update': None}
-        if self._exps_cache[u]['all'] is None:
-            self._exps_cache[u]['all'] = Experiment.safe.all(self.user)
-            self._exps_cache[u]['last_update'] = time.time()
-        elif self._exps_cache[u]['last_update'] - time.time() > \
-                self._cache_time:
-            self._exps_cache[u]['all']._result_cache = None
-        return self._exps_cache[u]['all']
+        '''
+        the user's experiments by name
+        '''
+        experiments = self.cache.get('experiments')
+        if experiments is None:
+            experiments = {path_mapper(exp): exp
+                           for exp in Experiment.safe.all(self.user)}
+            self.cache.set('experiments', experiments)
+        return experiments
+
+    def get_datasets(self, experiment):
+        '''
+        :returns: the experiment's datasets by name
+        :rtype: dict
+        '''
+        key = ('datasets', experiment.id)
+        datasets = self.cache.get(key)
+        if datasets is None:
+            datasets = {}
+            for dataset in experiment.datasets.all():
+                name = path_mapper(dataset)
+                if name == ALL_FILES_NAME:
+                    name = '%s_dataset' % ALL_FILES_NAME
+                datasets[name] = dataset
+            self.cache.set(key, datasets)
+        return datasets
 
     def session_started(self):
         """
@@ -208,20 +236,200 @@ class MyTSFTPServerInterface(SFTPServerInterface):
                             user=self.user)
         self.username = self.server.user.username
         self.cwd = "/home/%s" % self.username
-        self.tree = DynamicTree(self)
-        self.tree.name = '/'
-        self.tree.add_path(self.cwd)
-        exp_leaf = self.tree.add_path(os.path.join(self.cwd, 'experiments'))
-        exp_leaf.update = exp_leaf.update_experiments
+        self.started = time.time()
+        self.cache.clear()
 
     def session_ended(self):
         """
         run cleanup on exceptions or disconnection.
         idea: collect stats and store them in this function
         """
+        self.cache.clear()
         tracker.track_logout('sftp', session_id=self.uuid, ip=self.client_ip,
                              user=self.user)
 
+    def resolve(self, path):
+        """
+        :param basestring path: an absolute path, or a path relative to the
+            home directory
+        :returns: the file or directory at the path, or None if it doesn't
+            exist
+        :rtype: SFTPNode
+        """
+        path = '/' + os.path.normpath(
+            os.path.join(self.cwd, path)).lstrip('/')
+        if path == '/':
+            return SFTPNode(SFTPNode.FIXED, '/', children=('home', ))
+        key = ('path', path)
+        node = self.cache.get(key)
+        if node is None:
+            parent_path, name = os.path.split(path)
+            parent = self.resolve(parent_path)
+            if parent is None or not parent.is_dir:
+                return None
+            node = self._get_child(parent, parent_path, name)
+            if node is not None:
+                self.cache.set(key, node)
+        return node
+
+    def _get_child(self, parent, parent_path, name):
+        if parent.kind == SFTPNode.FIXED:
+            if name not in parent.children:
+                return None
+            if parent_path == '/':
+                return SFTPNode(SFTPNode.FIXED, name,
+                                children=(self.username, ))
+            if parent_path == '/home':
+                return SFTPNode(SFTPNode.FIXED, name,
+                                children=('experiments', ))
+            return SFTPNode(SFTPNode.EXPERIMENTS, name)
+        if parent.kind == SFTPNode.EXPERIMENTS:
+            experiment = self.experiments.get(name)
+            if experiment is None:
+                return None
+            return SFTPNode(SFTPNode.EXPERIMENT, name, obj=experiment,
+                            experiment=experiment)
+        if parent.kind == SFTPNode.EXPERIMENT:
+            if name == ALL_FILES_NAME:
+                return SFTPNode(SFTPNode.FILES, name,
+                                experiment=parent.experiment)
+            dataset = self.get_datasets(parent.experiment).get(name)
+            if dataset is None:
+                return None
+            return SFTPNode(SFTPNode.FILES, name, obj=dataset,
+                            experiment=parent.experiment, dataset=dataset)
+        directory = '/'.join(filter(None, (parent.directory, name)))
+        if self._get_directories(parent).filter(name=name).exists():
+            return SFTPNode(SFTPNode.FILES, name,
+                            experiment=parent.experiment,
+                            dataset=parent.dataset, directory=directory)
+        datafile = self._get_datafile(parent, name)
+        if datafile is None:
+            return None
+        return SFTPNode(SFTPNode.FILE, name, obj=datafile,
+                        experiment=parent.experiment, dataset=parent.dataset,
+                        directory=parent.directory)
+
+    def _get_directories(self, node):
+        directories = DatasetDirectory.objects.filter(
+            parent_path=node.directory)
+        if node.dataset is not None:
+            return directories.filter(dataset=node.dataset)
+        return directories.filter(dataset__experiments=node.experiment)
+
+    def _get_datafiles(self, node):
+        if node.dataset is not None:
+            datafiles = DataFile.objects.filter(dataset=node.dataset)
+        else:
+            datafiles = DataFile.objects.filter(
+                dataset__experiments=node.experiment)
+        # node.directory is built from the directory index's paths, which
+        # match the normalized directories stored by DataFile.save
+        if node.directory:
+            datafiles = datafiles.filter(directory=node.directory)
+        else:
+            datafiles = datafiles.filter(
+                Q(directory__isnull=True) | Q(directory=''))
+        return datafiles.order_by('filename', 'id')
+
+    def _get_datafile(self, node, name):
+        '''
+        Looks up a DataFile by the name it is listed with.  Files with the
+        same name are listed as "name", "name_2", "name_3" etc.  This
+        assumes that the path mapper URL-quotes file names.
+        '''
+        candidates = [(name, 1)]
+        match = re.match(r'^(.+)_(\d+)$', name)
+        if match and int(match.group(2)) > 1:
+            candidates.append((match.group(1), int(match.group(2))))
+        datafiles = self._get_datafiles(node)
+        for base_name, number in candidates:
+            matches = list(datafiles.filter(
+                filename=unquote(base_name))[:number])
+            if len(matches) == number and \
+                    path_mapper(matches[-1]) == base_name:
+                return matches[-1]
+        return None
+
+    def _iter_pages(self, queryset, fields):
+        '''
+        Iterates over a query set in pages, using keyset pagination on the
+        query set's ordering fields
+        '''
+        page = list(queryset[:self.page_size])
+        while page:
+            yield from page
+            if len(page) < self.page_size:
+                return
+            last = page[-1]
+            after = Q()
+            for i, field in enumerate(fields):
+                condition = Q(**{field + '__gt': getattr(last, field)})
+                for previous in fields[:i]:
+                    condition &= Q(**{previous: getattr(last, previous)})
+                after |= condition
+            page = list(queryset.filter(after)[:self.page_size])
+
+    def _iter_folder(self, node):
+        if node.kind == SFTPNode.FIXED:
+            for name in node.children:
+                yield self._attributes(name)
+        elif node.kind == SFTPNode.EXPERIMENTS:
+            for name, experiment in self.experiments.items():
+                yield self._attributes(name, experiment)
+        elif node.kind == SFTPNode.EXPERIMENT:
+            yield self._attributes(ALL_FILES_NAME, node.experiment)
+            for name, dataset in self.get_datasets(node.experiment).items():
+                yield self._attributes(name, dataset)
+        elif node.kind == SFTPNode.FILES:
+            directories = self._get_directories(node)
+            if node.dataset is None:
+                # The same directory can be in several datasets
+                directories = self._iter_pages(
+                    directories.order_by('name', 'dataset_id'),
+                    ('name', 'dataset_id'))
+                last_name = None
+                for directory in directories:
+                    if directory.name != last_name:
+                        yield self._attributes(directory.name)
+                    last_name = directory.name
+            else:
+                for directory in self._iter_pages(
+                        directories.order_by('name'), ('name', )):
+                    yield self._attributes(directory.name)
+            last_name, number = None, 1
+            for datafile in self._iter_pages(self._get_datafiles(node),
+                                             ('filename', 'id')):
+                name = path_mapper(datafile)
+                number = number + 1 if name == last_name else 1
+                last_name = name
+                if number > 1:
+                    name = '%s_%i' % (name, number)
+                yield self._attributes(name, datafile, is_dir=False)
+
+    def _attributes(self, name, obj=None, is_dir=True):
+        sftp_stat = SFTPAttributes()
+        sftp_stat.filename = name
+        if is_dir:
+            sftp_stat.st_size = 1
+            sftp_stat.st_mode = 0o777 | stat.S_IFDIR
+        else:
+            sftp_stat.st_size = int(obj.size or 0)
+            sftp_stat.st_mode = 0o777 | stat.S_IFREG
+        sftp_stat.st_uid = self.user.id
+        sftp_stat.st_gid = 20
+        mtime = None
+        if isinstance(obj, DataFile):
+            mtime = obj.modification_time or obj.created_time
+        elif isinstance(obj, Experiment):
+            mtime = obj.update_time
+        elif isinstance(obj, Dataset):
+            mtime = obj.modified_time or obj.created_time
+        mtime = mtime.timestamp() if mtime else self.started
+        sftp_stat.st_atime = mtime
+        sftp_stat.st_mtime = mtime
+        return sftp_stat
+
     def open(self, path, flags, attr):
         """
         Open a file on the server and create a handle for future operations
@@ -259,11 +467,16 @@ class MyTSFTPServerInterface(SFTPServerInterface):
         :returns: a new L{SFTPHandle} I{or error code}.
         :rtype: SFTPHandle
         """
-        leaf = self.tree.get_leaf(path)
+        node = self.resolve(path)
+        if node is None or node.is_dir:
+            return SFTP_NO_SUCH_FILE
         tracker.track_download(
             'sftp', session_id=self.uuid, ip=self.client_ip, user=self.user,
-            total_size=leaf.obj.size, num_files=1)
-        return MyTSFTPHandle(leaf.obj, flags, attr)
+            total_size=node.obj.size, num_files=1)
+        sessions = getattr(self.server, 'sessions', None)
+        if sessions is not None:
+            sessions.record_open()
+        return MyTSFTPHandle(node.obj, flags, attr, sessions=sessions)
 
     def list_folder(self, path):
         """
@@ -286,11 +499,10 @@ class MyTSFTPServerInterface(SFTPServerInterface):
             L{SFTPAttributes} objects.
         @rtype: list of L{SFTPAttributes} I{or error code}
         """
-        path = os.path.normpath(path)
-        leaf = self.tree.get_leaf(path, update=True)
-        stats = [self.stat(os.path.join(path, child))
-                 for child in leaf.children.keys()]
-        return stats
+        node = self.resolve(path)
+        if node is None or not node.is_dir:
+            return SFTP_NO_SUCH_FILE
+        return PagedListing(self._iter_folder(node))
 
     def stat(self, path):
         """
@@ -307,23 +519,10 @@ class MyTSFTPServerInterface(SFTPServerInterface):
             code (like L{SFTP_PERMISSION_DENIED}).
         @rtype: L{SFTPAttributes} I{or error code}
         """
-        leaf = self.tree.get_leaf(path, update=False)
-        if leaf is None:
-            leaf = self.tree.get_leaf(path, update=True)
-            if leaf is None:
-                return SFTP_NO_SUCH_FILE
-        sftp_stat = SFTPAttributes()
-        sftp_stat.filename = leaf.name
-        sftp_stat.st_size = int(getattr(leaf.obj, 'size', 1))
-        if not isinstance(leaf.obj, DataFile):
-            sftp_stat.st_mode = 0o777 | stat.S_IFDIR
-        else:
-            sftp_stat.st_mode = 0o777 | stat.S_IFREG
-        sftp_stat.st_uid = self.user.id
-        sftp_stat.st_gid = 20
-        sftp_stat.st_atime = time.time()
-        sftp_stat.st_mtime = time.time()
-        return sftp_stat
+        node = self.resolve(path)
+        if node is None:
+            return SFTP_NO_SUCH_FILE
+        return self._attributes(node.name, node.obj, is_dir=node.is_dir)
 
     def lstat(self, path):
         '''
@@ -343,9 +542,13 @@ class MyTSFTPServerInterface(SFTPServerInterface):
 class MyTSFTPHandle(SFTPHandle):
     '''
     SFTP File Handle
+
+    Clients read files in many small, mostly sequential requests, so reads
+    are served from a buffer of SFTP_READ_AHEAD_SIZE bytes, which is
+    refilled with one read from the underlying file.
     '''
 
-    def __init__(self, df, flags=0, optional_args=None):
+    def __init__(self, df, flags=0, optional_args=None, sessions=None):
         """
         Create a new file handle
 
@@ -353,8 +556,16 @@ class MyTSFTPHandle(SFTPHandle):
         :param int flags: optional flags as passed \
             to L{SFTPServerInterface.open}
         :param None optional_args: unused
+        :param SFTPSessions sessions: the gateway's sessions, to record the \
+            number of bytes sent
         """
         super().__init__(flags=flags)
+        self.sessions = sessions
+        self.read_ahead_size = getattr(settings, 'SFTP_READ_AHEAD_SIZE', 0)
+        self.buffer = b''
+        self.buffer_offset = 0
+        self.buffer_eof = False
+        self.file_offset = None
         try:
             self.readfile = df.file_object
         except IOError:
@@ -376,13 +587,64 @@ class MyTSFTPHandle(SFTPHandle):
         """
         return SFTP_OP_UNSUPPORTED
 
+    def read(self, offset, length):
+        """
+        Read up to C{length} bytes from this file, starting at position
+        C{offset}, from the read-ahead buffer if possible.
+
+        :param int offset: position in the file to start reading from
+        :param int length: number of bytes to attempt to read
+        :returns: data read from the file, or an SFTP error code
+        :rtype: bytes
+        """
+        if getattr(self, 'readfile', None) is None:
+            return SFTP_OP_UNSUPPORTED
+        start = offset - self.buffer_offset
+        if start < 0 or start > len(self.buffer) or \
+                start + length > len(self.buffer) and not self.buffer_eof:
+            size = max(length, self.read_ahead_size)
+            try:
+                if self.file_offset is None:
+                    self.file_offset = self.readfile.tell()
+                if offset != self.file_offset:
+                    self.readfile.seek(offset)
+                self.buffer = self.readfile.read(size)
+            except IOError as e:
+                self.file_offset = None
+                self.buffer = b''
+                return SFTPServer.convert_errno(e.errno)
+            self.buffer_offset = offset
+            self.buffer_eof = len(self.buffer) < size
+            self.file_offset = offset + len(self.buffer)
+            start = 0
+        data = self.buffer[start:start + length]
+        if self.sessions is not None:
+            self.sessions.record_read(len(data))
+        return data
+
 
 class MyTServerInterface(ServerInterface):
 
-    def __init__(self):
+    def __init__(self, sessions=None, connection=None):
+        """
+        :param SFTPSessions sessions: the gateway's sessions, to limit the
+            number of sessions per user
+        :param SFTPConnection connection: this transport's connection
+        """
         super().__init__()
         self.username = None
         self.user = None
+        self.sessions = sessions
+        self.connection = connection
+
+    def _login(self, username, user):
+        if self.sessions is not None and \
+                not self.sessions.login(self.connection, username):
+            logger.warning("Too many SFTP sessions for user %s", username)
+            return AUTH_FAILED
+        self.username = username
+        self.user = user
+        return AUTH_SUCCESSFUL
 
     def get_allowed_auths(self, username):
         auth_methods = ['password', 'keyboard-interactive', 'publickey']
@@ -408,9 +670,7 @@ class MyTServerInterface(ServerInterface):
             # the following line is Australian Synchrotron specific and will
             # disappear when we start using their newer auth system
             user.epn_list = fake_request.session.get('_epn_list', [])
-            self.username = username
-            self.user = user
-            return AUTH_SUCCESSFUL
+            return self._login(username, user)
         return AUTH_FAILED
 
     def check_auth_password(self, username, password):
@@ -431,9 +691,7 @@ class MyTServerInterface(ServerInterface):
                     logger.error("User with username %s does not exist.",
                                  username)
                 if user.is_active:
-                    self.username = username
-                    self.user = user
-                    return AUTH_SUCCESSFUL
+                    return self._login(username, user)
 
         return AUTH_FAILED
 
@@ -461,13 +719,142 @@ class MyTSFTPServer(SFTPServer):
         kwargs['client_ip'] = args[0].transport.getpeername()[0]
         super().__init__(*args, **kwargs)
 
+    def finish_subsystem(self):
+        # Each SFTP session runs in its own thread, with its own database
+        # connection
+        try:
+            super().finish_subsystem()
+        finally:
+            connections.close_all()
+
+
+class MyTTransport(Transport):
+    """
+    closes the transport thread's database connections, which are opened
+    for authentication, when the connection ends
+    """
+
+    def run(self):
+        try:
+            super().run()
+        finally:
+            connections.close_all()
+
+
+class SFTPConnection(object):
+    """
+    A connection to the SFTP gateway
+    """
+
+    def __init__(self, client_address):
+        self.client_address = client_address
+        self.transport = None
+        self.username = None
+        self.started = time.time()
+
+    @property
+    def active(self):
+        # The transport is set once the SSH negotiation has succeeded
+        return self.transport is None or self.transport.is_active()
+
+
+class SFTPSessions(object):
+    """
+    Thread-safe registry of the SFTP gateway's connections, which enforces
+    the global and per-user connection limits and collects statistics
+    """
+
+    def __init__(self, max_connections=None, max_connections_per_user=None):
+        self.max_connections = max_connections
+        self.max_connections_per_user = max_connections_per_user
+        self.started = time.time()
+        self.total_connections = 0
+        self.rejected_connections = 0
+        self.files_opened = 0
+        self.bytes_sent = 0
+        self._connections = set()
+        self._lock = threading.Lock()
+
+    def _prune(self):
+        self._connections = set(
+            conn for conn in self._connections if conn.active)
+
+    def connect(self, client_address):
+        """
+        :returns: a new connection, or None if there are too many connections
+        :rtype: SFTPConnection
+        """
+        with self._lock:
+            self._prune()
+            if self.max_connections and \
+                    len(self._connections) >= self.max_connections:
+                self.rejected_connections += 1
+                return None
+            conn = SFTPConnection(client_address)
+            self._connections.add(conn)
+            self.total_connections += 1
+            return conn
+
+    def disconnect(self, conn):
+        with self._lock:
+            self._connections.discard(conn)
+
+    def login(self, conn, username):
+        """
+        Records the user of an authenticated connection
+
+        :returns: False if the user has too many connections
+        :rtype: bool
+        """
+        with self._lock:
+            self._prune()
+            if self.max_connections_per_user and sum(
+                    1 for other in self._connections
+                    if other.username == username) >= \
+                    self.max_connections_per_user:
+                self.rejected_connections += 1
+                return False
+            if conn is not None:
+                conn.username = username
+            return True
+
+    def record_open(self):
+        with self._lock:
+            self.files_opened += 1
+
+    def record_read(self, num_bytes):
+        with self._lock:
+            self.bytes_sent += num_bytes
+
+    def get_stats(self):
+        """
+        :returns: the number of active connections and sessions (i.e.
+            authenticated connections) per user, and the totals since the
+            gateway started
+        :rtype: dict
+        """
+        with self._lock:
+            self._prune()
+            users = collections.Counter(
+                conn.username for conn in self._connections if conn.username)
+            return {
+                'uptime': time.time() - self.started,
+                'active_connections': len(self._connections),
+                'active_sessions': sum(users.values()),
+                'sessions_per_user': dict(users),
+                'total_connections': self.total_connections,
+                'rejected_connections': self.rejected_connections,
+                'files_opened': self.files_opened,
+                'bytes_sent': self.bytes_sent,
+            }
+
 
 class MyTSFTPRequestHandler(socketserver.BaseRequestHandler):
     timeout = 60
     auth_timeout = 60
 
     def setup(self):
-        self.transport = Transport(self.request)
+        self.transport = MyTTransport(self.request)
         self.transport.load_server_moduli()
         so = self.transport.get_security_options()
         so.digests = ('hmac-sha1', )
@@ -477,8 +864,15 @@ class MyTSFTPRequestHandler(socketserver.BaseRequestHandler):
             'sftp', MyTSFTPServer, MyTSFTPServerInterface)
 
     def handle(self):
+        connection = getattr(self.server, 'pending_connections', {}).pop(
+            self.request, None)
         try:
-            self.transport.start_server(server=MyTServerInterface())
+            self.transport.start_server(server=MyTServerInterface(
+                sessions=getattr(self.server, 'sessions', None),
+                connection=connection))
+            if connection is not None:
+                connection.transport = self.transport
+            return
         except SSHException as e:
             logger.error("SSH error: %s" % str(e))
             self.transport.close()
@@ -487,6 +881,8 @@ class MyTSFTPRequestHandler(socketserver.BaseRequestHandler):
             logger.warning("Socket error: %s" % str(e))
         except Exception as e:
             logger.error("Error: %s" % str(e))
+        if connection is not None:
+            self.server.sessions.disconnect(connection)
 
 
     def handle_timeout(self):
@@ -494,16 +890,61 @@ class MyTSFTPRequestHandler(socketserver.BaseRequestHandler):
 
 
 class MyTSFTPTCPServer(socketserver.TCPServer):
+    """
+    Accepts connections in the main thread and negotiates SSH in a pool of
+    SFTP_MAX_WORKERS threads.  Each connection then runs in its own
+    transport thread, up to SFTP_MAX_CONNECTIONS connections in total and
+    SFTP_MAX_CONNECTIONS_PER_USER authenticated connections per user.
+    """
     # If the server stops/starts quickly, don't fail because of
     # "port in use" error.
     allow_reuse_address = True
+    request_queue_size = 64
 
     def __init__(self, address, host_key, RequestHandlerClass=None):
         self.host_key = host_key
         if RequestHandlerClass is None:
             RequestHandlerClass = MyTSFTPRequestHandler
+        self.sessions = SFTPSessions(
+            max_connections=getattr(settings, 'SFTP_MAX_CONNECTIONS', None),
+            max_connections_per_user=getattr(
+                settings, 'SFTP_MAX_CONNECTIONS_PER_USER', None))
+        self.pending_connections = {}
+        self.executor = ThreadPoolExecutor(
+            max_workers=getattr(settings, 'SFTP_MAX_WORKERS', 16),
+            thread_name_prefix='sftp-handshake')
         socketserver.TCPServer.__init__(self, address, RequestHandlerClass)
 
+    def verify_request(self, request, client_address):
+        connection = self.sessions.connect(client_address)
+        if connection is None:
+            logger.warning("Too many SFTP connections, rejecting %s",
+                           client_address[0])
+            socketserver.TCPServer.shutdown_request(self, request)
+            return False
+        self.pending_connections[request] = connection
+        return True
+
+    def process_request(self, request, client_address):
+        self.executor.submit(
+            self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+            connection = self.pending_connections.pop(request, None)
+            if connection is not None:
+                self.sessions.disconnect(connection)
+            socketserver.TCPServer.shutdown_request(self, request)
+        finally:
+            connections.close_all()
+
+    def server_close(self):
+        socketserver.TCPServer.server_close(self)
+        self.executor.shutdown(wait=False)
+
     def shutdown_request(self, request):
         # Prevent TCPServer from closing the connection prematurely
         return
@@ -513,12 +954,46 @@ class MyTSFTPTCPServer(socketserver.TCPServer):
         return
 
 
-def start_server(host=None, port=None, keyfile=None):
+def log_stats(sessions, interval, stream=None):
+    """
+    Logs the gateway's session statistics and throughput every
+    C{interval} seconds, until the process exits
+
+    :param SFTPSessions sessions: the gateway's sessions
+    :param float interval: the number of seconds between reports
+    :param file stream: an optional stream to also write the reports to
+    """
+    last_time = time.time()
+    last_bytes = 0
+    while True:
+        time.sleep(interval)
+        stats = sessions.get_stats()
+        now = time.time()
+        report = (
+            "SFTP: %(active_sessions)d active sessions, "
+            "%(active_connections)d connections, %(files_opened)d files "
+            "opened, %(bytes_sent)d bytes sent, %(rejected_connections)d "
+            "connections rejected" % stats)
+        report += ", %.1f MB/s" % (
+            (stats['bytes_sent'] - last_bytes) / (now - last_time) / 1e6)
+        logger.info(report)
+        if stream is not None:
+            stream.write(report + "\n")
+            stream.flush()
+        last_time = now
+        last_bytes = stats['bytes_sent']
+
+
+def start_server(host=None, port=None, keyfile=None, stats_interval=None,
+                 stats_stream=None):
     '''
     The SFTP_HOST_KEY setting is required for configuring SFTP access.
     The SFTP_PORT setting defaults to 2200.
 
     See: tardis/default_settings/sftp.py
+
+    If C{stats_interval} is given, the session statistics are logged every
+    C{stats_interval} seconds, see L{log_stats}.
     '''
     if host is None:
         current_site = Site.objects.get_current()
@@ -530,6 +1005,11 @@ def start_server(host=None, port=None, keyfile=None):
     except:
         raise SSHException("failed loading SFTP host key")
     server = MyTSFTPTCPServer((host, port), host_key=host_key)
+    if stats_interval:
+        threading.Thread(
+            target=log_stats, args=(server.sessions, stats_interval),
+            kwargs={'stream': stats_stream}, name='sftp-stats',
+            daemon=True).start()
     try:
         server.serve_forever()
     except (SystemExit, KeyboardInterrupt):
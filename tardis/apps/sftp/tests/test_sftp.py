@@ -2,6 +2,8 @@
 
 .. moduleauthor:: James Wettenhall <james.wettenhall@monash.edu>
 """
+import time
+from datetime import datetime, timezone
 from io import BytesIO
 
 from unittest.mock import patch
@@ -13,6 +15,7 @@ from django.core.management import call_command
 from django.test import RequestFactory
 from django.test import TestCase
 
+from paramiko import SFTP_NO_SUCH_FILE
 from paramiko.common import AUTH_SUCCESSFUL, AUTH_FAILED
 from paramiko.rsakey import RSAKey
 from paramiko.py3compat import StringIO
@@ -26,8 +29,10 @@ from tardis.tardis_portal.models import Experiment
 from tardis.tardis_portal.models import ObjectACL
 
 from tardis.apps.sftp.models import SFTPPublicKey
+from tardis.apps.sftp.sftp import MyTSFTPHandle
 from tardis.apps.sftp.sftp import MyTSFTPServerInterface
 from tardis.apps.sftp.sftp import MyTServerInterface
+from tardis.apps.sftp.sftp import SFTPSessions
 from tardis.apps.sftp.views import sftp_access
 from tardis.apps.sftp.views import cybderduck_connection_window
 
@@ -185,6 +190,151 @@ QKHf8Ha+rOx3B7Dbljc+Xdpcn9VyRmDlSqzX9aCkr18mNg==
         self.user.is_active = True
         self.user.save()
 
+    def test_sftp_paged_listing(self):
+        path_mapper = make_mapper(settings.DEFAULT_PATH_MAPPER, rootdir=None)
+        modified = datetime(2020, 1, 2, 3, 4, 5, tzinfo=timezone.utc)
+        for i in range(5):
+            DataFile.objects.create(
+                dataset=self.dataset, directory='subdir',
+                filename='sub%d.txt' % i, size=i, md5sum='bogus',
+                modification_time=modified)
+        for version in (1, 2):
+            DataFile.objects.create(
+                dataset=self.dataset, directory='subdir/deeper',
+                filename='dup.txt', size=version, md5sum='bogus',
+                version=version)
+
+        server = flexmock(user=self.user)
+        with self.settings(SFTP_LISTING_PAGE_SIZE=2, SFTP_CACHE_TTL=60):
+            sftp_interface = MyTSFTPServerInterface(server=server)
+        sftp_interface.session_started()
+        exp_path = '/home/%s/experiments/%s' % (
+            self.username, path_mapper(self.exp))
+        ds_path = '%s/%s' % (exp_path, path_mapper(self.dataset))
+
+        self.assertEqual(
+            [attr.filename for attr in sftp_interface.list_folder(ds_path)],
+            ['subdir', 'file.txt'])
+        listing = sftp_interface.list_folder(ds_path + '/subdir')
+        self.assertEqual([attr.filename for attr in listing[:3]],
+                         ['deeper', 'sub0.txt', 'sub1.txt'])
+        listing = listing[3:]
+        self.assertEqual([attr.filename for attr in listing],
+                         ['sub2.txt', 'sub3.txt', 'sub4.txt'])
+        self.assertEqual(listing[1].st_mtime, modified.timestamp())
+        self.assertEqual(
+            [(attr.filename, attr.st_size) for attr in
+             sftp_interface.list_folder(ds_path + '/subdir/deeper')],
+            [('dup.txt', 1), ('dup.txt_2', 2)])
+        self.assertEqual(
+            [attr.filename for attr in sftp_interface.list_folder(
+                exp_path + '/00_all_files/subdir/deeper')],
+            ['dup.txt', 'dup.txt_2'])
+
+        attr = sftp_interface.stat(ds_path + '/subdir/deeper/dup.txt_2')
+        self.assertEqual(attr.st_size, 2)
+        self.assertEqual(sftp_interface.stat(ds_path + '/subdir/sub3.txt')
+                         .st_mtime, modified.timestamp())
+        self.assertEqual(sftp_interface.stat(ds_path + '/subdir/missing'),
+                         SFTP_NO_SUCH_FILE)
+        self.assertEqual(sftp_interface.stat(ds_path + '/file.txt/x'),
+                         SFTP_NO_SUCH_FILE)
+
+        new_exp = Experiment.objects.create(
+            title='test exp2', created_by=self.user)
+        ObjectACL.objects.create(
+            content_object=new_exp,
+            pluginId='django_user',
+            entityId=str(self.user.id),
+            canRead=True,
+            aclOwnershipType=ObjectACL.OWNER_OWNED)
+        experiments = '/home/%s/experiments' % self.username
+        self.assertNotIn(
+            path_mapper(new_exp),
+            [attr.filename for attr in sftp_interface.list_folder(
+                experiments)])
+        # The user's experiments are fetched again once the cache expires
+        with patch('tardis.apps.sftp.sftp.time.time',
+                   return_value=time.time() + 61):
+            self.assertIn(
+                path_mapper(new_exp),
+                [attr.filename for attr in sftp_interface.list_folder(
+                    experiments)])
+
+    def test_sftp_unnormalized_directories(self):
+        path_mapper = make_mapper(settings.DEFAULT_PATH_MAPPER, rootdir=None)
+        DataFile.objects.create(
+            dataset=self.dataset, directory='subdir/',
+            filename='trailing.txt', size=1, md5sum='bogus')
+        DataFile.objects.create(
+            dataset=self.dataset, directory='/subdir//deeper',
+            filename='leading.txt', size=1, md5sum='bogus')
+
+        server = flexmock(user=self.user)
+        sftp_interface = MyTSFTPServerInterface(server=server)
+        sftp_interface.session_started()
+        ds_path = '/home/%s/experiments/%s/%s' % (
+            self.username, path_mapper(self.exp), path_mapper(self.dataset))
+        self.assertEqual(
+            [attr.filename for attr in sftp_interface.list_folder(
+                ds_path + '/subdir')],
+            ['deeper', 'trailing.txt'])
+        self.assertEqual(
+            [attr.filename for attr in sftp_interface.list_folder(
+                ds_path + '/subdir/deeper')],
+            ['leading.txt'])
+
+    def test_sftp_read_ahead(self):
+        class CountingReader(BytesIO):
+            reads = []
+
+            def read(self, size=-1):
+                self.reads.append(size)
+                return super().read(size)
+
+        content = b"\n".join([b'some data %d' % i for i in range(1000)])
+        sessions = SFTPSessions()
+        with self.settings(SFTP_READ_AHEAD_SIZE=4096):
+            handle = MyTSFTPHandle(
+                DataFile.objects.get(filename='file.txt'), sessions=sessions)
+        handle.readfile = CountingReader(content)
+        data = b''.join(handle.read(offset, 1000)
+                        for offset in range(0, len(content), 1000))
+        self.assertEqual(data, content)
+        self.assertEqual(handle.readfile.reads,
+                         [4096] * (len(content) // 4096 + 1))
+        self.assertEqual(handle.read(10, 5), content[10:15])
+        self.assertEqual(handle.read(len(content), 1000), b'')
+        handle.close()
+        self.assertEqual(sessions.get_stats()['bytes_sent'],
+                         len(content) + 5)
+
+    def test_sftp_connection_limits(self):
+        sessions = SFTPSessions(max_connections=3,
+                                max_connections_per_user=2)
+        connections = [sessions.connect(('127.0.0.1', port))
+                       for port in range(4)]
+        self.assertIsNone(connections[3])
+        server_interfaces = [
+            MyTServerInterface(sessions=sessions, connection=connection)
+            for connection in connections[:3]]
+        self.assertEqual(
+            [server_interface.check_auth_password(
+                self.username, self.password)
+             for server_interface in server_interfaces],
+            [AUTH_SUCCESSFUL, AUTH_SUCCESSFUL, AUTH_FAILED])
+        stats = sessions.get_stats()
+        self.assertEqual(stats['active_connections'], 3)
+        self.assertEqual(stats['sessions_per_user'], {self.username: 2})
+        self.assertEqual(stats['rejected_connections'], 2)
+
+        sessions.disconnect(connections[0])
+        self.assertEqual(
+            server_interfaces[2].check_auth_password(
+                self.username, self.password),
+            AUTH_SUCCESSFUL)
+        self.assertIsNotNone(sessions.connect(('127.0.0.1', 4)))
+
     @patch('webpack_loader.loader.WebpackLoader.get_bundle')
     def test_sftp_dynamic_docs_experiment(self, mock_webpack_get_bundle):
         factory = RequestFactory()
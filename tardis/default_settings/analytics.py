@@ -11,3 +11,31 @@
 #    INSTALLED_APPS = INSTALLED_APPS + ('django_user_agents',)
 #    MIDDLEWARE = MIDDLEWARE + \
 #        ('django_user_agents.middleware.UserAgentMiddleware',)
+
+ANALYTICS_SINK = 'tardis.analytics.ga.GoogleAnalyticsSink'
+'''
+The class which delivers analytics hits, e.g. server-side download and
+SFTP tracking for GOOGLE_ANALYTICS_ID.  Hits are sent from a background
+thread, so a slow analytics service never holds up a download.  Use
+'tardis.analytics.dispatcher.FileSink' to write the hits as lines of JSON
+to ANALYTICS_FILE, or to stdout if it's None.
+'''
+
+ANALYTICS_FILE = None
+
+ANALYTICS_QUEUE_SIZE = 1000
+'''
+The maximum number of analytics hits waiting to be sent by each process.
+Further hits are dropped until the queue has room for them.
+'''
+
+ANALYTICS_BATCH_SIZE = 20
+'''
+The maximum number of analytics hits passed to the sink at a time.
+The Google Analytics batch endpoint accepts up to 20 hits per request.
+'''
+
+ANALYTICS_TIMEOUT = 5
+'''
+The timeout in seconds for requests to the analytics service.
+'''
@@ -35,6 +35,36 @@ AUTHENTICATION_BACKENDS = (
     'tardis.tardis_portal.auth.authorisation.ACLAwareBackend',
 )
 
+ACL_REQUEST_CACHE_LIFETIME = 30
+'''
+The number of seconds for which the ObjectACLs resolved for a user are
+kept on the user object (i.e. for the duration of a request) to answer
+permission checks without further ObjectACL queries.  They are discarded
+sooner if any ObjectACL or group membership changes in the same process.
+'''
+
+ACL_CACHE_TTL = 0
+'''
+If set to a number of seconds, each user's resolved ObjectACLs are also
+stored in the default cache and shared between requests and processes
+for up to that long.  Saving or deleting an ObjectACL or changing Django
+group memberships invalidates them, but changes in external group
+providers only take effect after the TTL expires.  So do changes made
+without sending ObjectACL's post_save or post_delete signals, e.g. with
+``ObjectACL.objects.filter(...).update(...)`` or ``bulk_create``, unless
+the code making them calls
+:py:func:`tardis.tardis_portal.auth.acl_cache.invalidate_acl_cache`.
+Disabled by default.
+'''
+
+EXTERNAL_GROUP_CACHE_TTL = 300
+'''
+The number of seconds for which the result of looking up an external
+group referred to by an ObjectACL (e.g. an LDAP group on an experiment's
+sharing page) is kept in the default cache.  Set to 0 to query the group
+provider every time.
+'''
+
 MANAGE_ACCOUNT_ENABLED = True
 LINK_ACCOUNTS_ENABLED = True
 
@@ -55,6 +55,40 @@ CELERY_BEAT_SCHEDULE = {
     }
 }
 
+VERIFY_DFOS_BATCH_SIZE = 100
+'''
+The verify_dfos task queues one dfo_verify_batch task for every
+VERIFY_DFOS_BATCH_SIZE unverified DataFileObjects in a storage box.
+Set to 1 to queue one dfo_verify task per DataFileObject instead.
+'''
+
+VERIFY_DFOS_MAX_BATCHES_PER_BOX = 10
+'''
+The maximum number of dfo_verify_batch tasks queued or running for any
+one storage box.  Further batches are queued by subsequent verify_dfos
+runs.
+'''
+
+VERIFY_DFOS_LOCK_EXPIRE = 60 * 60
+'''
+Seconds after which the count of a storage box's dfo_verify_batch tasks
+expires, e.g. if a worker was killed before its batch completed.
+'''
+
+DATASET_AGGREGATES_UPDATE_DELAY = 30
+'''
+Seconds between a change to a dataset's DataFileObjects and the
+recalculation of the dataset's verified file count and size.  Further
+changes in the meantime are counted by the same task.
+'''
+
+DATASET_AGGREGATES_LOCK_EXPIRE = 10 * 60
+'''
+Seconds after DATASET_AGGREGATES_UPDATE_DELAY for which a dataset's queued
+recalculation stops further changes from queueing another, in case the
+task is lost.
+'''
+
 # For local development, you can force Celery tasks to run synchronously:
 # CELERY_TASK_ALWAYS_EAGER = True
 # CELERY_TASK_EAGER_PROPAGATES = True
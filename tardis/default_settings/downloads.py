@@ -41,7 +41,28 @@ DATASET_SPACES_TO_UNDERSCORES = True
 DEFAULT_ARCHIVE_FORMATS = ['tar']
 '''
 Site's preferred archive types, with the most preferred first
-other available option: 'tgz'. Add to list if desired
+other available options: 'tgz' and 'zip'. Add to list if desired
+'''
+
+DOWNLOAD_ARCHIVE_PREFETCH_FILES = 2
+'''
+The number of files which are opened and read ahead in worker threads
+while another file is being streamed into an archive download.  This
+hides the latency of opening files on object stores and HSM backends.
+Set to 0 to read the files one after another in the request's thread.
+'''
+
+DOWNLOAD_ARCHIVE_PREFETCH_CHUNKS = 8
+'''
+The maximum number of chunks (of 128 KiB) buffered for each file which is
+read ahead for an archive download.
+'''
+
+DOWNLOAD_ARCHIVE_GZIP_THREADS = 1
+'''
+The number of threads compressing 'tgz' archive downloads.  With more
+than one thread, the archive is compressed in independent blocks like
+pigz does, which uses more CPU cores at a slight cost in compression ratio.
 '''
 
 DOWNLOAD_URI_TEMPLATES = {}
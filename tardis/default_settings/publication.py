@@ -16,11 +16,39 @@ RELATED_INFO_SCHEMA_NAMESPACE = \
 RELATED_OTHER_INFO_SCHEMA_NAMESPACE = \
     'http://www.tardis.edu.au/schemas/experiment/annotation/2011/07/07'
 
+RIFCS_PUBLISH_DELAY = 10
+'''
+The number of seconds between a change to an experiment and the
+publication of its RIF-CS document in OAI_DOCS_PATH by a Celery task.
+Further changes to the experiment in the meantime are published by the
+same task, so bulk-loading its parameters renders the document once.
+'''
+
+RIFCS_PUBLISH_LOCK_EXPIRE = 600
+'''
+The number of seconds after RIFCS_PUBLISH_DELAY for which an experiment's
+queued publication stops further changes from queueing another, in case
+the task is lost.
+'''
+
 OAIPMH_PROVIDERS = [
     'tardis.apps.oaipmh.provider.experiment.DcExperimentProvider',
     'tardis.apps.oaipmh.provider.experiment.RifCsExperimentProvider',
 ]
 
+OAIPMH_PAGE_SIZE = 100
+'''
+The number of records or identifiers returned per OAI-PMH ListRecords or
+ListIdentifiers response.  Harvesters fetch the rest of the list with the
+resumptionToken at the end of each page.
+'''
+
+OAIPMH_RESUMPTION_TOKEN_MAX_AGE = 86400
+'''
+The number of seconds an OAI-PMH resumption token is valid for.  Tokens are
+signed with SECRET_KEY, so no state is kept on the server between pages.
+'''
+
 # Example settings for the publication form workflow. Also requires the
 # corresponding app in 'INSTALLED_APPS' and the corresponding task to be
 # enabled
@@ -58,3 +86,15 @@ OAIPMH_PROVIDERS = [
 
 # Push-to app settings
 # PUSH_TO_FROM_EMAIL = 'noreply@example.com'
+
+PUSH_TO_MAX_CONNECTIONS = 4
+'''
+The number of SSH connections a push-to request uploads files over
+concurrently.
+'''
+
+PUSH_TO_PROGRESS_BATCH_SIZE = 500
+'''
+The number of push-to Progress records whose status is saved at once
+while files are uploaded.
+'''
@@ -26,12 +26,26 @@ CALCULATE_CHECKSUMS_METHODS = {
 
 The DataFileObject class's calculate_checksums method checks for a storage class
 match in the CALCULATE_CHECKSUMS_METHODS dict, and if one is not found, it calls
-the classic compute_checksums method which uses the file_object to calculate the
+tardis.tardis_portal.checksums.calculate_checksums, which memory-maps files in
+FileSystemStorage boxes and otherwise uses the file_object to calculate the
 checksums one chunk at a time.  For some storage backends (e.g. S3), representing
 the file as file-like object with Django's file storage API is not the most
 efficient way to calculate the checksum.
 '''
 
+CHECKSUM_BUFFER_SIZE = 8 * 1024 * 1024
+'''
+Size in bytes of the chunks read when calculating checksums.  Larger
+chunks reduce the per-read overhead when verifying large files.
+'''
+
+CHECKSUM_USE_MMAP = True
+'''
+Calculate checksums for files in storage boxes using a FileSystemStorage
+(sub)class by memory-mapping the files, rather than reading them through
+Django's file storage API.
+'''
+
 DEFAULT_FILE_STORAGE = \
     'tardis.tardis_portal.storage.MyTardisLocalFileSystemStorage'
 
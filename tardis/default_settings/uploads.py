@@ -10,3 +10,10 @@ To use filepicker, please also get an API key at http://filepicker.io
 
 # New in Django 1.10:
 DATA_UPLOAD_MAX_MEMORY_SIZE = 262144000  # 250 MB
+
+DATAFILE_BULK_BATCH_SIZE = 1000
+'''
+The number of DataFile records registered per transaction by the bulk
+registration API endpoint, /api/v1/dataset_file/bulk/.  Each batch is
+validated with a few queries and inserted with bulk_create.
+'''
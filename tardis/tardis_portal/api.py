@@ -8,7 +8,6 @@ Implemented with Tastypie.
 '''
 import json
 import re
-from wsgiref.util import FileWrapper
 from urllib.parse import quote
 
 from django.conf import settings
@@ -18,8 +17,10 @@ from django.contrib.auth.models import User
 from django.contrib.auth.models import Group
 from django.core.paginator import EmptyPage, InvalidPage, Paginator
 from django.db import IntegrityError
+from django.db.models import Q
+from django.db.models.query import QuerySet
 from django.http import HttpResponse, HttpResponseForbidden, \
-    StreamingHttpResponse, HttpResponseNotFound, JsonResponse
+    HttpResponseNotFound, JsonResponse, HttpResponseBadRequest
 from django.shortcuts import redirect
 
 from tastypie import fields
@@ -39,10 +40,10 @@ from tastypie.contrib.contenttypes.fields import GenericForeignKeyField
 
 from uritemplate import URITemplate
 
-from tardis.analytics.tracker import IteratorTracker
 from . import tasks
 from .auth.decorators import (
     get_accessible_datafiles_for_user,
+    get_accessible_dataset_ids,
     has_datafile_access,
     has_datafile_download_access,
     has_dataset_access,
@@ -51,9 +52,11 @@ from .auth.decorators import (
     has_experiment_access,
     has_write_permissions)
 from .auth.localdb_auth import django_user
+from .bulk_registration import BulkRegistration
+from .download import get_datafile_response
 from .models.access_control import ObjectACL
 from .models.datafile import DataFile, DataFileObject, compute_checksums
-from .models.dataset import Dataset
+from .models.dataset import Dataset, DatasetDirectory, normalize_directory
 from .models.experiment import Experiment, ExperimentAuthor
 from .models.parameters import (
     DatafileParameter,
@@ -141,78 +144,94 @@ class MyTardisAuthentication(object):
 default_authentication = MyTardisAuthentication()
 
 
+def _as_queryset(object_list, model):
+    '''
+    Returns object_list as a QuerySet which can be filtered, if it isn't
+    one already.
+    '''
+    if isinstance(object_list, QuerySet):
+        return object_list
+    return model.objects.filter(id__in=[obj.id for obj in object_list])
+
+
 class ACLAuthorization(Authorization):
     '''Authorisation class for Tastypie.
     '''
     def read_list(self, object_list, bundle):  # noqa # too complex
-        obj_ids = [obj.id for obj in object_list]
         if bundle.request.user.is_authenticated and \
            bundle.request.user.is_superuser:
             return object_list
+        # Access is checked with a single subquery for the whole list,
+        # rather than once per object
         if isinstance(bundle.obj, Experiment):
             experiments = Experiment.safe.all(bundle.request.user)
-            return experiments.filter(id__in=obj_ids)
+            return _as_queryset(object_list, Experiment).filter(
+                id__in=experiments.values('id'))
         if isinstance(bundle.obj, ExperimentAuthor):
             experiments = Experiment.safe.all(bundle.request.user)
-            return ExperimentAuthor.objects.filter(
-                experiment__in=experiments, id__in=obj_ids)
+            return _as_queryset(object_list, ExperimentAuthor).filter(
+                experiment_id__in=experiments.values('id'))
         if isinstance(bundle.obj, ExperimentParameterSet):
             experiments = Experiment.safe.all(bundle.request.user)
-            return ExperimentParameterSet.objects.filter(
-                experiment__in=experiments, id__in=obj_ids)
+            return _as_queryset(object_list, ExperimentParameterSet).filter(
+                experiment_id__in=experiments.values('id'))
         if isinstance(bundle.obj, ExperimentParameter):
             experiments = Experiment.safe.all(bundle.request.user)
-            return ExperimentParameter.objects.filter(
-                parameterset__experiment__in=experiments,
-                id__in=obj_ids
-            )
+            return _as_queryset(object_list, ExperimentParameter).filter(
+                parameterset__experiment_id__in=experiments.values('id'))
         if isinstance(bundle.obj, Dataset):
-            dataset_ids = [ds.id for ds in object_list
-                           if has_dataset_access(bundle.request, ds.id)]
-            return Dataset.objects.filter(id__in=dataset_ids)
+            dataset_ids = get_accessible_dataset_ids(bundle.request)
+            return _as_queryset(object_list, Dataset).filter(
+                id__in=dataset_ids)
         if isinstance(bundle.obj, DatasetParameterSet):
-            return [dps for dps in object_list
-                    if has_dataset_access(bundle.request, dps.dataset.id)]
+            dataset_ids = get_accessible_dataset_ids(bundle.request)
+            return _as_queryset(object_list, DatasetParameterSet).filter(
+                dataset_id__in=dataset_ids)
         if isinstance(bundle.obj, DatasetParameter):
-            return [dp for dp in object_list
-                    if has_dataset_access(bundle.request,
-                                          dp.parameterset.dataset.id)]
+            dataset_ids = get_accessible_dataset_ids(bundle.request)
+            return _as_queryset(object_list, DatasetParameter).filter(
+                parameterset__dataset_id__in=dataset_ids)
         if isinstance(bundle.obj, DataFile):
-            all_files = get_accessible_datafiles_for_user(bundle.request)
-            return all_files.filter(id__in=obj_ids)
+            datafile_ids = get_accessible_datafiles_for_user(
+                bundle.request).values('id')
+            return _as_queryset(object_list, DataFile).filter(
+                id__in=datafile_ids)
         if isinstance(bundle.obj, DatafileParameterSet):
-            datafiles = get_accessible_datafiles_for_user(bundle.request)
-            return DatafileParameterSet.objects.filter(
-                datafile__in=datafiles, id__in=obj_ids
-            )
+            datafile_ids = get_accessible_datafiles_for_user(
+                bundle.request).values('id')
+            return _as_queryset(object_list, DatafileParameterSet).filter(
+                datafile_id__in=datafile_ids)
         if isinstance(bundle.obj, DatafileParameter):
-            datafiles = get_accessible_datafiles_for_user(bundle.request)
-            return DatafileParameter.objects.filter(
-                parameterset__datafile__in=datafiles, id__in=obj_ids)
+            datafile_ids = get_accessible_datafiles_for_user(
+                bundle.request).values('id')
+            return _as_queryset(object_list, DatafileParameter).filter(
+                parameterset__datafile_id__in=datafile_ids)
         if isinstance(bundle.obj, Schema):
             return object_list
         if isinstance(bundle.obj, ParameterName):
             return object_list
         if isinstance(bundle.obj, ObjectACL):
-            experiment_ids = Experiment.safe.all(
-                bundle.request.user).values_list('id', flat=True)
-            return ObjectACL.objects.filter(
+            experiments = Experiment.safe.all(bundle.request.user)
+            return _as_queryset(object_list, ObjectACL).filter(
                 content_type__model='experiment',
-                object_id__in=experiment_ids,
-                id__in=obj_ids
+                object_id__in=experiments.values('id')
             )
         if bundle.request.user.is_authenticated and \
                 isinstance(bundle.obj, User):
             if facilities_managed_by(bundle.request.user):
                 return object_list
-            return [user for user in object_list if
-                    (user == bundle.request.user or
-                     user.experiment_set.filter(public_access__gt=1)
-                     .count() > 0)]
+            public_user_ids = Experiment.objects.filter(
+                public_access__gt=Experiment.PUBLIC_ACCESS_NONE).values(
+                    'created_by_id')
+            return _as_queryset(object_list, User).filter(
+                Q(id=bundle.request.user.id) | Q(id__in=public_user_ids))
         if isinstance(bundle.obj, Group):
             if facilities_managed_by(bundle.request.user).count() > 0:
                 return object_list
-            return bundle.request.user.groups.filter(id__in=obj_ids)
+            if not bundle.request.user.is_authenticated:
+                return []
+            return _as_queryset(object_list, Group).filter(
+                user=bundle.request.user)
         if isinstance(bundle.obj, Facility):
             facilities = facilities_managed_by(bundle.request.user)
             return [facility for facility in object_list
@@ -244,28 +263,28 @@ class ACLAuthorization(Authorization):
             return has_experiment_access(bundle.request, bundle.obj.id)
         if isinstance(bundle.obj, ExperimentAuthor):
             return has_experiment_access(
-                bundle.request, bundle.obj.experiment.id)
+                bundle.request, bundle.obj.experiment_id)
         if isinstance(bundle.obj, ExperimentParameterSet):
             return has_experiment_access(
-                bundle.request, bundle.obj.experiment.id)
+                bundle.request, bundle.obj.experiment_id)
         if isinstance(bundle.obj, ExperimentParameter):
             return has_experiment_access(
-                bundle.request, bundle.obj.parameterset.experiment.id)
+                bundle.request, bundle.obj.parameterset.experiment_id)
         if isinstance(bundle.obj, Dataset):
             return has_dataset_access(bundle.request, bundle.obj.id)
         if isinstance(bundle.obj, DatasetParameterSet):
-            return has_dataset_access(bundle.request, bundle.obj.dataset.id)
+            return has_dataset_access(bundle.request, bundle.obj.dataset_id)
         if isinstance(bundle.obj, DatasetParameter):
             return has_dataset_access(
-                bundle.request, bundle.obj.parameterset.dataset.id)
+                bundle.request, bundle.obj.parameterset.dataset_id)
         if isinstance(bundle.obj, DataFile):
-            return has_datafile_access(bundle.request, bundle.obj.id)
+            return has_dataset_access(bundle.request, bundle.obj.dataset_id)
         if isinstance(bundle.obj, DatafileParameterSet):
             return has_datafile_access(
-                bundle.request, bundle.obj.datafile.id)
+                bundle.request, bundle.obj.datafile_id)
         if isinstance(bundle.obj, DatafileParameter):
             return has_datafile_access(
-                bundle.request, bundle.obj.parameterset.datafile.id)
+                bundle.request, bundle.obj.parameterset.datafile_id)
         if isinstance(bundle.obj, User):
             # allow all authenticated users to read public user info
             # the dehydrate function also adds/removes some information
@@ -604,12 +623,10 @@ class ExperimentResource(MyTardisModelResource):
         owners = exp.get_owners()
         bundle.data['is_publication'] = exp.is_publication()
         bundle.data['owner_ids'] = [o.id for o in owners]
-        dataset_count = exp.datasets.all().count()
-        bundle.data['dataset_count'] = dataset_count
-        datafile_count = exp.get_datafiles().count()
-        bundle.data['datafile_count'] = datafile_count
-        experiment_size = exp.get_size()
-        bundle.data['experiment_size'] = experiment_size
+        aggregates = exp.get_aggregates()
+        bundle.data['dataset_count'] = aggregates['dataset_count']
+        bundle.data['datafile_count'] = aggregates['file_count']
+        bundle.data['experiment_size'] = aggregates['size']
         return bundle
 
     def hydrate_m2m(self, bundle):
@@ -697,6 +714,7 @@ class DatasetResource(MyTardisModelResource):
             'directory': ('exact', ),
             'instrument': ALL_WITH_RELATIONS,
         }
+        excludes = list(Dataset.AGGREGATE_FIELDS)
         ordering = [
             'id',
             'description'
@@ -705,12 +723,10 @@ class DatasetResource(MyTardisModelResource):
 
     def dehydrate(self, bundle):
         dataset = bundle.obj
-        size = dataset.get_size()
-        bundle.data['dataset_size'] = size
+        bundle.data['dataset_size'] = dataset.size
         dataset_experiment_count = dataset.experiments.count()
         bundle.data['dataset_experiment_count'] = dataset_experiment_count
-        dataset_datafile_count = dataset.datafile_set.count()
-        bundle.data['dataset_datafile_count'] = dataset_datafile_count
+        bundle.data['dataset_datafile_count'] = dataset.file_count
         return bundle
 
     def prepend_urls(self):
@@ -750,7 +766,7 @@ class DatasetResource(MyTardisModelResource):
 
         if file_path is not None:
             del kwargs["file_path"]
-            kwargs["directory__startswith"] = file_path
+            kwargs["directory__tree"] = file_path
 
         return DataFileResource().dispatch("list", request, **kwargs)
 
@@ -784,8 +800,8 @@ class DatasetResource(MyTardisModelResource):
         # get dirs at root level
         dir_tuples = dataset.get_dir_tuples("")
         # get files at root level
-        dfs = (DataFile.objects.filter(dataset=dataset, directory='') |
-               DataFile.objects.filter(dataset=dataset, directory__isnull=True)).distinct()
+        dfs = DataFile.objects.filter(
+            Q(directory='') | Q(directory__isnull=True), dataset=dataset)
 
         pgresults = 1000
 
@@ -813,15 +829,7 @@ class DatasetResource(MyTardisModelResource):
                 }
                 child_list.append(child_dict)
                 # append files to list
-        if dfs:
-            for df in dfs:
-                children = {}
-                children['name'] = df.filename
-                children['verified'] = df.verified
-                children['id'] = df.id
-                children['is_online'] = df.is_online
-                children['recall_url'] = df.recall_url
-                child_list.append(children)
+        child_list.extend(self._get_datafile_nodes(dfs.object_list))
         if paginator.num_pages - 1 > page_num:
             # append a marker element
             children = {}
@@ -869,11 +877,7 @@ class DatasetResource(MyTardisModelResource):
             child_list = dataset.get_dir_nodes(child_dir_tuples)
 
         # if there are files append this
-        if dfs:
-            for df in dfs:
-                child = {'name': df.filename, 'id': df.id, 'verified': df.verified, 'is_online': df.is_online,
-                         'recall_url': df.recall_url}
-                child_list.append(child)
+        child_list.extend(self._get_datafile_nodes(dfs))
 
         return JsonResponse(child_list, status=200, safe=False)
 
@@ -897,11 +901,32 @@ class DatasetResource(MyTardisModelResource):
         if not dir_path:
             return HttpResponse('Please specify folder path')
 
-        df_list = DataFile.objects.filter(dataset__id=dataset_id, directory=dir_path) | \
-            DataFile.objects.filter(dataset__id=dataset_id, directory__startswith=dir_path+"/")
-        ids = [df.id for df in df_list]
+        ids = list(DataFile.objects.filter(
+            dataset__id=dataset_id,
+            directory__in=DatasetDirectory.get_subtree_paths(
+                dir_path, dataset_id)).values_list('id', flat=True))
         return JsonResponse(ids, status=200, safe=False)
 
+    @staticmethod
+    def _get_datafile_nodes(dfs):
+        '''Return tree nodes for a query set of datafiles
+
+        The datafiles' verified DataFileObjects and storage box types are
+        prefetched and their online status is checked in bulk, so the
+        number of queries doesn't depend on the number of files.
+        '''
+        return [
+            {
+                'name': df.filename,
+                'verified': df.verified,
+                'id': df.id,
+                'is_online': df.is_online,
+                'recall_url': df.recall_url
+            }
+            for df in DataFile.prefetch_online_status(
+                list(DataFile.prefetch_verified_file_objects(dfs)))
+        ]
+
     def _populate_children(self, sub_child_dirs, dir_node, dataset):
         '''Populate the children list in a directory node
 
@@ -953,6 +978,28 @@ class DataFileResource(MyTardisModelResource):
         ]
         resource_name = 'dataset_file'
 
+    def build_filters(self, filters=None, ignore_bad_filters=False):
+        '''
+        Adds a "directory__tree" filter, which matches the files in a
+        directory and its subdirectories using the datasets' directory
+        indexes.  Directories are matched in the normalized form in which
+        DataFile.save stores them, e.g. "a/" matches "a".
+        '''
+        if filters is None or not ('directory' in filters or
+                                   'directory__tree' in filters):
+            return super().build_filters(filters, ignore_bad_filters)
+        filters = filters.copy()
+        if 'directory' in filters:
+            filters['directory'] = normalize_directory(filters['directory'])
+        if 'directory__tree' not in filters:
+            return super().build_filters(filters, ignore_bad_filters)
+        directory = filters.get('directory__tree')
+        del filters['directory__tree']
+        orm_filters = super().build_filters(filters, ignore_bad_filters)
+        orm_filters['directory__in'] = DatasetDirectory.get_subtree_paths(
+            directory, filters.get('dataset__id'))
+        return orm_filters
+
     def download_file(self, request, **kwargs):
         '''
         curl needs the -J switch to get the filename right
@@ -1013,7 +1060,6 @@ class DataFileResource(MyTardisModelResource):
             )
 
         file_object = file_record.get_file()
-        wrapper = FileWrapper(file_object)
         tracker_data = dict(
             label='file',
             session_id=request.COOKIES.get('_ga'),
@@ -1022,12 +1068,9 @@ class DataFileResource(MyTardisModelResource):
             total_size=file_record.size,
             num_files=1,
             ua=request.META.get('HTTP_USER_AGENT', None))
-        response = StreamingHttpResponse(
-            IteratorTracker(wrapper, tracker_data),
-            content_type=file_record.mimetype)
-        response['Content-Length'] = file_record.size
-        response['Content-Disposition'] = 'attachment; filename="%s"' % \
-                                          file_record.filename
+        response = get_datafile_response(
+            request, file_record, file_object,
+            content_type=file_record.mimetype, tracker_data=tracker_data)
         self.log_throttled_access(request)
         return response
 
@@ -1054,6 +1097,47 @@ class DataFileResource(MyTardisModelResource):
                 shadow=shadow)
         return HttpResponse()
 
+    def bulk_register(self, request, **kwargs):
+        '''
+        registers many files at once, from a JSON list of DataFile records
+        like those POSTed to the list endpoint, or from newline-delimited
+        JSON (Content-Type: application/x-ndjson) with one record per line.
+
+        responds with the status of every record, e.g. 409 for duplicates
+        '''
+        self.method_check(request, allowed=['post'])
+        self.is_authenticated(request)
+        self.throttle_check(request)
+
+        content_type = request.META.get('CONTENT_TYPE', '').split(';')[0]
+        try:
+            if content_type in ('application/x-ndjson',
+                                'application/jsonlines',
+                                'application/x-jsonlines'):
+                records = [json.loads(line) for line in request
+                           if line.strip()]
+            else:
+                records = json.load(request)
+                if isinstance(records, dict):
+                    records = records.get('objects')
+        except ValueError as e:
+            return HttpResponseBadRequest('Invalid JSON: %s' % e)
+        if not isinstance(records, list):
+            return HttpResponseBadRequest(
+                'Expected a list of DataFile records')
+
+        results = []
+        meta = {'total': len(records), 'created': 0, 'failed': 0}
+        for result in BulkRegistration(request).register(records):
+            if result['status'] == 201:
+                meta['created'] += 1
+                result['resource_uri'] = self.get_resource_uri(
+                    DataFile(id=result['id']))
+            else:
+                meta['failed'] += 1
+            results.append(result)
+        return JsonResponse({'meta': meta, 'objects': results})
+
     def hydrate(self, bundle):
         if 'attached_file' in bundle.data:
             # have POSTed file
@@ -1131,6 +1215,10 @@ class DataFileResource(MyTardisModelResource):
 
     def prepend_urls(self):
         return [
+            url(r"^(?P<resource_name>%s)/bulk%s$" %
+                (self._meta.resource_name, trailing_slash()),
+                self.wrap_view('bulk_register'),
+                name="api_bulk_register_files"),
             url(r"^(?P<resource_name>%s)/(?P<pk>\w[\w/-]*)/download%s$" %
                 (self._meta.resource_name, trailing_slash()),
                 self.wrap_view('download_file'), name="api_download_file"),
@@ -0,0 +1,224 @@
+'''
+Set-based resolution of the ObjectACLs which apply to a user
+
+All of a user's effective ObjectACLs are fetched with a single query and
+turned into sets of object IDs per content type and permission, so that
+subsequent permission checks are answered from memory instead of issuing
+one ObjectACL query per object.
+
+The resolved ACLs are kept on the user object for the duration of a
+request (see ACL_REQUEST_CACHE_LIFETIME), and can also be shared between
+requests via Django's default cache (see ACL_CACHE_TTL).  Both are
+invalidated whenever an ObjectACL is saved or deleted, or the user's
+group memberships change.  Code which changes ObjectACLs without their
+post_save or post_delete signals (e.g. with QuerySet.update or
+bulk_create) must call invalidate_acl_cache itself.
+'''
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Q
+
+from ..models.access_control import ObjectACL
+from .localdb_auth import django_user
+from .token_auth import TokenGroupProvider
+
+GENERATION_CACHE_KEY = 'acl-cache-generation'
+
+# Bumped in this process whenever ACLs (or anything else which the cached
+# permission checks depend on) may have changed
+_generation = 0
+
+
+def _get_cache():
+    return caches['default']
+
+
+def _get_shared_generation():
+    return _get_cache().get(GENERATION_CACHE_KEY, 0)
+
+
+def invalidate_acl_cache(shared=True):
+    '''
+    Discards the ACLs resolved in this process and, if ACL_CACHE_TTL is
+    set and ``shared`` is True, those in the cross-request cache.
+    '''
+    global _generation
+    _generation += 1
+    if shared and getattr(settings, 'ACL_CACHE_TTL', 0):
+        cache = _get_cache()
+        cache.add(GENERATION_CACHE_KEY, 0, None)
+        try:
+            cache.incr(GENERATION_CACHE_KEY)
+        except ValueError:
+            # The key was evicted in between, which invalidates too
+            pass
+
+
+def get_generation():
+    '''
+    Returns the in-process generation counter, which changes whenever
+    ACLs may have changed.  Other data derived from ACLs (e.g. an
+    experiment's owners) can be cached along with it and discarded once
+    it differs.
+    '''
+    return _generation
+
+
+def _perm_flags(verb):
+    '''
+    relates permission verbs to the ACL flags which grant them, like
+    ACLAwareBackend.get_perm_bool
+    '''
+    if verb == 'change':
+        return ('canWrite', 'isOwner')
+    if verb == 'view':
+        return ('canRead', 'isOwner')
+    if verb == 'delete':
+        return ('canDelete', 'isOwner')
+    if verb in ('owns', 'share'):
+        return ('isOwner',)
+    return None
+
+
+class UserACLs(object):
+    '''
+    The effective ObjectACLs of one user, as sets of object IDs
+    '''
+
+    def __init__(self, acl_rows, generation=None):
+        '''
+        :param acl_rows: tuples of (content_type_id, object_id, pluginId,
+            canRead, canWrite, canDelete, isOwner)
+        :param int generation: the value of the in-process generation
+            counter when the ACLs were resolved
+        '''
+        self._objects = {}
+        for ct_id, object_id, plugin_id, can_read, can_write, can_delete, \
+                is_owner in acl_rows:
+            flags = self._objects.setdefault(ct_id, {}).setdefault(
+                object_id, set())
+            flags.add('any')
+            if can_read:
+                flags.add('canRead')
+            if can_write:
+                flags.add('canWrite')
+            if can_delete:
+                flags.add('canDelete')
+            if is_owner:
+                flags.add('isOwner')
+            # Matches ExperimentManager.owned_and_shared, which only
+            # considers ownership granted to the user directly
+            if can_read or (is_owner and plugin_id == django_user):
+                flags.add('download')
+        self.generation = _generation if generation is None else generation
+        self.created = time.monotonic()
+        self._memo = {}
+        self.tokens = None
+
+    def is_current(self):
+        lifetime = getattr(settings, 'ACL_REQUEST_CACHE_LIFETIME', 30)
+        return self.generation == _generation and \
+            time.monotonic() - self.created < lifetime
+
+    def has_perm(self, verb, content_type_id, object_id):
+        '''
+        :param str verb: 'view', 'change', 'delete', 'owns', 'share' or
+            'download'; anything else is granted by any ACL
+        :param int content_type_id: the ID of the object's ContentType
+        :param int object_id: the object's primary key
+        :return: whether one of the user's ACLs grants the permission
+        :rtype: bool
+        '''
+        flags = self._objects.get(content_type_id, {}).get(int(object_id))
+        if not flags:
+            return False
+        if verb == 'download':
+            return 'download' in flags
+        required = _perm_flags(verb)
+        if required is None:
+            return True
+        return any(flag in flags for flag in required)
+
+    def object_ids(self, verb, content_type_id):
+        '''
+        :return: the IDs of all objects of the given content type for which
+            the user has the permission
+        :rtype: set
+        '''
+        return set(
+            object_id for object_id in self._objects.get(content_type_id, {})
+            if self.has_perm(verb, content_type_id, object_id))
+
+    def memoize(self, key, func):
+        '''
+        Returns the result of func(), calculated only once for each key
+        while these ACLs are current.  Used for derived permission checks,
+        e.g. dataset access which depends on the dataset's experiments.
+        '''
+        if key not in self._memo:
+            self._memo[key] = func()
+        return self._memo[key]
+
+
+def _acl_query(user):
+    query = Q(pluginId=django_user, entityId=str(user.id))
+    if user.is_authenticated:
+        for name, group in user.userprofile.ext_groups:
+            query |= Q(pluginId=name, entityId=str(group))
+    else:
+        # the only authorisation available for anonymous users is tokenauth
+        tgp = TokenGroupProvider()
+        for group in tgp.getGroups(user):
+            query |= Q(pluginId=tgp.name, entityId=str(group))
+    return query
+
+
+def _resolve_acl_rows(user):
+    return list(
+        ObjectACL.objects
+        .filter(_acl_query(user))
+        .filter(ObjectACL.get_effective_query())
+        .order_by()
+        .values_list('content_type_id', 'object_id', 'pluginId',
+                     'canRead', 'canWrite', 'canDelete', 'isOwner'))
+
+
+def get_user_acls(user):
+    '''
+    Returns the user's effective ACLs, resolving them with a single query
+    unless they are already cached on the user object or, for
+    authenticated users with ACL_CACHE_TTL set, in the default cache.
+
+    :param user: a User or AnonymousUser (with ``allowed_tokens``)
+    :rtype: UserACLs
+    '''
+    # Anonymous users' ACLs depend on the tokens they have presented
+    tokens = None
+    if not user.is_authenticated:
+        tokens = tuple(getattr(user, 'allowed_tokens', ()))
+    user_acls = getattr(user, '_acl_cache', None)
+    if user_acls is not None and user_acls.is_current() and \
+            user_acls.tokens == tokens:
+        return user_acls
+
+    generation = _generation
+    ttl = getattr(settings, 'ACL_CACHE_TTL', 0)
+    cache_key = None
+    acl_rows = None
+    if ttl and user.is_authenticated:
+        cache_key = 'user-acls-%s-%s' % (user.id, _get_shared_generation())
+        acl_rows = _get_cache().get(cache_key)
+    if acl_rows is None:
+        acl_rows = _resolve_acl_rows(user)
+        if cache_key:
+            _get_cache().set(cache_key, acl_rows, ttl)
+
+    user_acls = UserACLs(acl_rows, generation)
+    user_acls.tokens = tokens
+    try:
+        user._acl_cache = user_acls
+    except AttributeError:
+        pass
+    return user_acls
@@ -8,8 +8,7 @@ from django.contrib.contenttypes.models import ContentType
 from django.db.models import Q
 from django.db.models.query import QuerySet
 
-from ..models.access_control import ObjectACL
-from .token_auth import TokenGroupProvider
+from .acl_cache import get_user_acls
 
 
 class ACLAwareBackend(object):
@@ -41,7 +40,8 @@ class ACLAwareBackend(object):
         '''
         main method, calls other methods based on permission type queried
         '''
-        if not user_obj.is_authenticated:
+        if not user_obj.is_authenticated and \
+                not isinstance(user_obj, AnonymousUser):
             allowed_tokens = getattr(user_obj, 'allowed_tokens', [])
             user_obj = AnonymousUser()
             user_obj.allowed_tokens = allowed_tokens
@@ -92,22 +92,6 @@ class ACLAwareBackend(object):
                 if user_obj.has_perm(new_perm, msp):
                     return True
 
-        # get_acls
-        obj_acls = ObjectACL.objects\
-            .filter(content_type=ct, object_id=obj.id)\
-            .filter(self.get_perm_bool(perm_action))\
-            .filter(ObjectACL.get_effective_query())
-
-        query = Q(pluginId='django_user',
-                  entityId=str(user_obj.id))
-
-        if user_obj.is_authenticated:
-            for name, group in user_obj.userprofile.ext_groups:
-                query |= Q(pluginId=name, entityId=str(group))
-        else:
-            # the only authorisation available for anonymous users is tokenauth
-            tgp = TokenGroupProvider()
-            for group in tgp.getGroups(user_obj):
-                query |= Q(pluginId=tgp.name, entityId=str(group))
-
-        return obj_acls.filter(query).count() > 0
+        # all of the user's ACLs are resolved with a single query and
+        # cached on the user object, see acl_cache.py
+        return get_user_acls(user_obj).has_perm(perm_action, ct.id, obj.id)
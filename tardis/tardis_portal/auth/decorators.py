@@ -30,6 +30,7 @@
 #
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
 from django.contrib.sessions.models import Session
 from django.http import HttpResponse, HttpRequest
 from django.http import HttpResponseRedirect
@@ -38,6 +39,7 @@ from django.conf import settings
 
 from ..models import Experiment, Dataset, DataFile, GroupAdmin
 from ..shortcuts import return_response_error
+from .acl_cache import get_user_acls
 
 
 def get_accessible_experiments(request):
@@ -62,6 +64,33 @@ def get_owned_experiments(request):
     return Experiment.safe.owned(request.user)
 
 
+def get_experiment_access_query(request):
+    """
+    Returns a Q object matching the Experiments for which
+    has_experiment_access is true, built from the user's ACLs resolved for
+    the request, so that access to many objects can be checked in a single
+    query.
+    """
+    user = request.user
+    if user.is_active and user.is_superuser:
+        return Q()
+    experiment_ct = ContentType.objects.get_for_model(Experiment)
+    experiment_ids = get_user_acls(user).object_ids('view', experiment_ct.id)
+    return Q(public_access__gte=Experiment.PUBLIC_ACCESS_METADATA) | \
+        Q(id__in=experiment_ids)
+
+
+def get_accessible_dataset_ids(request):
+    """
+    Returns the IDs of the Datasets for which has_dataset_access is true,
+    as a values queryset to be used as a subquery.
+    """
+    experiments = Experiment.objects.filter(
+        get_experiment_access_query(request))
+    return Dataset.experiments.through.objects.filter(
+        experiment__in=experiments).values('dataset_id')
+
+
 def get_accessible_datafiles_for_user(request):
     experiments = get_accessible_experiments(request)
     experiment_ids = list(experiments.values_list('id', flat=True))
@@ -91,54 +120,91 @@ def has_experiment_write(request, experiment_id):
 
 
 def has_experiment_download_access(request, experiment_id):
-
-    if Experiment.safe.owned_and_shared(request.user) \
-                      .filter(id=experiment_id) \
-                      .exists():
-
+    experiment_ct = ContentType.objects.get_for_model(Experiment)
+    if get_user_acls(request.user).has_perm(
+            'download', experiment_ct.id, experiment_id):
         return True
     exp = Experiment.objects.get(id=experiment_id)
     return Experiment.public_access_implies_distribution(exp.public_access)
 
 
+def _get_dataset_experiments(dataset_id):
+    """
+    Fetches a dataset's experiments with a single query, raising
+    Dataset.DoesNotExist if the dataset doesn't exist.
+    """
+    experiments = list(Experiment.objects.filter(datasets__id=dataset_id))
+    if not experiments:
+        Dataset.objects.get(id=dataset_id)
+    return experiments
+
+
+def _memoize_for_user(request, key, func):
+    """
+    Dataset and datafile checks depend on the dataset's experiments as
+    well as the user's ACLs, so their results are kept with the ACLs
+    resolved for the request rather than recalculated for every file.
+    """
+    return get_user_acls(request.user).memoize(key, func)
+
+
 def has_dataset_ownership(request, dataset_id):
-    dataset = Dataset.objects.get(id=dataset_id)
-    return any(has_experiment_ownership(request, experiment.id)
-               for experiment in dataset.experiments.all())
+    Dataset.objects.get(id=dataset_id)
+    return Experiment.safe.owned(request.user).filter(
+        datasets__id=dataset_id).exists()
 
 
 def has_dataset_access(request, dataset_id):
-    dataset = Dataset.objects.get(id=dataset_id)
+    def check():
+        return any(
+            request.user.has_perm('tardis_acls.view_experiment', experiment)
+            for experiment in _get_dataset_experiments(dataset_id))
 
-    return any(has_experiment_access(request, experiment.id)
-               for experiment in dataset.experiments.all())
+    return _memoize_for_user(
+        request, ('view_dataset', int(dataset_id)), check)
 
 
 def has_dataset_write(request, dataset_id):
     dataset = Dataset.objects.get(id=dataset_id)
     if dataset.immutable:
         return False
-    return any(has_experiment_write(request, experiment.id)
-               for experiment in dataset.experiments.all())
+    return any(
+        request.user.has_perm('tardis_acls.change_experiment', experiment)
+        for experiment in dataset.experiments.all())
 
 
 def has_dataset_download_access(request, dataset_id):
-    dataset = Dataset.objects.get(id=dataset_id)
-    return any(has_experiment_download_access(request, experiment.id)
-               for experiment in dataset.experiments.all())
+    def check():
+        user_acls = get_user_acls(request.user)
+        experiment_ct = ContentType.objects.get_for_model(Experiment)
+        return any(
+            user_acls.has_perm('download', experiment_ct.id, experiment.id) or
+            Experiment.public_access_implies_distribution(
+                experiment.public_access)
+            for experiment in _get_dataset_experiments(dataset_id))
+
+    return _memoize_for_user(
+        request, ('download_dataset', int(dataset_id)), check)
+
+
+def _get_datafile_dataset_id(datafile_id):
+    return DataFile.objects.filter(id=datafile_id).values_list(
+        'dataset_id', flat=True).first()
 
 
 def has_datafile_access(request, datafile_id):
-    try:
-        dataset = Dataset.objects.get(datafile=datafile_id)
-    except Dataset.DoesNotExist:
+    dataset_id = _get_datafile_dataset_id(datafile_id)
+    if dataset_id is None:
         return False
-    return has_dataset_access(request, dataset.id)
+    return has_dataset_access(request, dataset_id)
 
 
 def has_datafile_download_access(request, datafile_id):
-    dataset = Dataset.objects.get(datafile=datafile_id)
-    return has_dataset_download_access(request, dataset.id)
+    dataset_id = _get_datafile_dataset_id(datafile_id)
+    if dataset_id is None:
+        raise Dataset.DoesNotExist(
+            'Dataset matching query does not exist.')
+    return has_dataset_download_access(request, dataset_id)
 
 
 def has_read_or_owner_ACL(request, experiment_id):
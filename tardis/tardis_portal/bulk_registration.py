@@ -0,0 +1,392 @@
+"""
+Bulk registration of DataFiles, e.g. for instrument uploaders which
+register many thousands of files at once.
+
+Records are processed in chunks of DATAFILE_BULK_BATCH_SIZE.  Each chunk
+is validated in one pass: its datasets, existing files and storage boxes
+are looked up with a few queries for the whole chunk rather than for every
+file.  The DataFiles and DataFileObjects are then inserted with
+``bulk_create``, which bypasses ``save()``, so the datasets' directory
+indexes and file counts are updated here and verification is queued in
+batches per storage box (see :func:`~tardis.tardis_portal.tasks.dfo_verify_batch`).
+
+Duplicates are detected within a request and against the files already
+registered when its chunk is validated.  Files registered concurrently by
+another request are only rejected by DataFile's unique constraint on
+dataset, directory, filename and version, which doesn't apply to files
+without a directory (NULL isn't equal to NULL), so those can be
+registered twice.
+"""
+import logging
+import re
+from itertools import islice
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import tasks
+from .auth.decorators import has_dataset_write
+from .models.datafile import DataFile, DataFileObject
+from .models.dataset import Dataset, DatasetDirectory, normalize_directory
+from .models.storage import StorageBox
+
+logger = logging.getLogger(__name__)
+
+DATASET_URI = re.compile(r'/dataset/(\d+)/?$')
+
+FIELDS = ('dataset', 'filename', 'directory', 'size', 'md5sum', 'sha512sum',
+          'mimetype', 'created_time', 'modification_time', 'replicas')
+
+
+class RecordError(Exception):
+    '''
+    A record which can't be registered, with the HTTP status describing
+    the reason, e.g. 409 for duplicates
+    '''
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _parse_dataset_id(value):
+    if isinstance(value, int):
+        return value
+    if isinstance(value, str):
+        if value.isdigit():
+            return int(value)
+        match = DATASET_URI.search(value)
+        if match:
+            return int(match.group(1))
+    raise RecordError(400, 'Invalid dataset: %s' % value)
+
+
+def _parse_datetime(record, field):
+    value = record.get(field)
+    if value is None:
+        return None
+    try:
+        parsed = parse_datetime(value)
+    except (TypeError, ValueError):
+        parsed = None
+    if parsed is None:
+        raise RecordError(400, 'Invalid %s: %s' % (field, value))
+    if settings.USE_TZ and timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def _parse_record(record):
+    '''
+    Validates a record without accessing the database
+
+    :return: the DataFile's field values and the replicas
+    :rtype: tuple
+    '''
+    if not isinstance(record, dict):
+        raise RecordError(400, 'Each record must be an object')
+    unsupported = sorted(set(record) - set(FIELDS) - {'resource_uri'})
+    if unsupported:
+        raise RecordError(
+            400, 'Unsupported fields: %s' % ', '.join(unsupported))
+    fields = {'dataset_id': _parse_dataset_id(record.get('dataset'))}
+    filename = record.get('filename')
+    if not filename or not isinstance(filename, str) or \
+            len(filename) > DataFile._meta.get_field('filename').max_length:
+        raise RecordError(400, 'Invalid filename: %s' % filename)
+    fields['filename'] = filename
+    directory = record.get('directory')
+    if directory is not None and not isinstance(directory, str):
+        raise RecordError(400, 'Invalid directory: %s' % directory)
+    # Like DataFile.save:
+    fields['directory'] = normalize_directory(directory)
+    size = record.get('size')
+    if size is not None:
+        try:
+            size = int(size)
+        except (TypeError, ValueError):
+            raise RecordError(400, 'Invalid size: %s' % size)
+    if size is None and settings.REQUIRE_DATAFILE_SIZES or \
+            size is not None and size < 0:
+        raise RecordError(
+            400, 'Invalid Datafile size (must be >= 0): %s' % size)
+    fields['size'] = size
+    fields['md5sum'] = record.get('md5sum') or ''
+    fields['sha512sum'] = record.get('sha512sum') or ''
+    if settings.REQUIRE_DATAFILE_CHECKSUMS and \
+            not fields['md5sum'] and not fields['sha512sum']:
+        raise RecordError(400, 'Every Datafile requires a checksum')
+    fields['mimetype'] = record.get('mimetype') or \
+        DataFile.guess_mimetype(filename)
+    fields['created_time'] = _parse_datetime(record, 'created_time')
+    fields['modification_time'] = _parse_datetime(
+        record, 'modification_time')
+    replicas = record.get('replicas') or []
+    if not isinstance(replicas, list) or not all(
+            isinstance(replica, dict) and
+            (replica.get('url') or replica.get('uri'))
+            for replica in replicas):
+        raise RecordError(400, 'Each replica requires a url')
+    return fields, replicas
+
+
+def _file_key(dataset_id, directory, filename, version=1):
+    return (dataset_id, directory, filename, version)
+
+
+class BulkRegistration(object):
+    '''
+    Registers DataFiles from records like those POSTed to the DataFile API,
+    without parameter sets.  Files with replicas are registered at the
+    replicas' locations, other files get a DataFileObject in the receiving
+    storage box, whose path is returned as the record's temp_url.
+    '''
+
+    def __init__(self, request):
+        self.request = request
+        self.user = request.user
+        self.may_add = self.user.is_authenticated and all([
+            self.user.has_perm('tardis_portal.change_dataset'),
+            self.user.has_perm('tardis_portal.add_datafile')])
+        self.datasets = {}
+        self.writable = {}
+        self.boxes = {}
+        self.receiving_boxes = {}
+        self.storages = {}
+
+    def _check_dataset(self, dataset_id):
+        if dataset_id not in self.datasets:
+            raise RecordError(400, 'Dataset %s does not exist' % dataset_id)
+        if dataset_id not in self.writable:
+            self.writable[dataset_id] = self.may_add and \
+                has_dataset_write(self.request, dataset_id)
+        if not self.writable[dataset_id]:
+            raise RecordError(
+                403, 'No permission to add files to dataset %s' % dataset_id)
+
+    def _load_datasets(self, dataset_ids):
+        missing = set(dataset_ids) - set(self.datasets)
+        if missing:
+            self.datasets.update(Dataset.objects.in_bulk(missing))
+
+    def _get_box(self, location, datafile):
+        '''
+        Like ReplicaResource.hydrate, falls back to the default storage box
+        for unknown locations
+        '''
+        if location is None:
+            return self._get_default_box(datafile)
+        if location not in self.boxes:
+            self.boxes[location] = StorageBox.objects.filter(
+                name=location).first()
+        return self.boxes[location] or self._get_default_box(datafile)
+
+    def _get_default_box(self, datafile):
+        key = ('default', datafile.dataset_id)
+        if key not in self.receiving_boxes:
+            self.receiving_boxes[key] = datafile.get_default_storage_box()
+        return self.receiving_boxes[key]
+
+    def _get_receiving_box(self, datafile):
+        key = ('receiving', datafile.dataset_id)
+        if key not in self.receiving_boxes:
+            self.receiving_boxes[key] = datafile.get_receiving_storage_box()
+        return self.receiving_boxes[key]
+
+    def _get_storage(self, box):
+        if box.id not in self.storages:
+            self.storages[box.id] = box.get_initialised_storage_instance()
+        return self.storages[box.id]
+
+    def register(self, records):
+        '''
+        :param records: an iterable of record dicts
+        :return: yields a result dict for every record, with its index,
+            HTTP status and either the new DataFile's id or an error
+        '''
+        batch_size = max(
+            1, int(getattr(settings, 'DATAFILE_BULK_BATCH_SIZE', 1000)))
+        records = iter(records)
+        offset = 0
+        while True:
+            chunk = list(islice(records, batch_size))
+            if not chunk:
+                return
+            yield from self._register_chunk(chunk, offset)
+            offset += len(chunk)
+
+    def _register_chunk(self, chunk, offset):
+        results = {}
+        parsed = []
+        for index, record in enumerate(chunk, offset):
+            try:
+                parsed.append((index,) + _parse_record(record))
+            except RecordError as e:
+                results[index] = {'status': e.status, 'error': str(e)}
+
+        self._load_datasets(fields['dataset_id'] for _, fields, _ in parsed)
+        existing = set(
+            DataFile.objects.filter(
+                dataset_id__in=set(fields['dataset_id']
+                                   for _, fields, _ in parsed),
+                filename__in=set(fields['filename']
+                                 for _, fields, _ in parsed))
+            .values_list('dataset_id', 'directory', 'filename', 'version')
+            .order_by())
+        new_files = []
+        for index, fields, replicas in parsed:
+            try:
+                self._check_dataset(fields['dataset_id'])
+                key = _file_key(fields['dataset_id'], fields['directory'],
+                                fields['filename'])
+                if key in existing:
+                    raise RecordError(409, 'Duplicate DataFile')
+            except RecordError as e:
+                results[index] = {'status': e.status, 'error': str(e)}
+                continue
+            existing.add(key)
+            datafile = DataFile(**fields)
+            datafile.dataset = self.datasets[fields['dataset_id']]
+            new_files.append((index, datafile, replicas))
+
+        try:
+            with transaction.atomic():
+                created = self._create(new_files)
+        except IntegrityError:
+            # Another request registered some of these files, in
+            # directories, since the chunk was validated
+            created = []
+            for new_file in new_files:
+                try:
+                    with transaction.atomic():
+                        created += self._create([new_file])
+                except IntegrityError:
+                    results[new_file[0]] = {
+                        'status': 409, 'error': 'Duplicate DataFile'}
+        for index, datafile, temp_url in created:
+            results[index] = {'status': 201, 'id': datafile.id}
+            if temp_url is not None:
+                results[index]['temp_url'] = temp_url
+        self._queue_verification([datafile for _, datafile, temp_url
+                                  in created if temp_url is None])
+
+        for index in range(offset, offset + len(chunk)):
+            result = results[index]
+            result['index'] = index
+            yield result
+
+    def _create(self, new_files):
+        '''
+        Inserts the DataFiles and their DataFileObjects
+
+        :return: (index, datafile, temp_url) tuples
+        :rtype: list
+        '''
+        if not new_files:
+            return []
+        datafiles = DataFile.objects.bulk_create(
+            [datafile for _, datafile, _ in new_files])
+        if any(datafile.pk is None for datafile in datafiles):
+            # Only some databases return the primary keys of bulk inserts
+            ids = {
+                _file_key(*row[1:]): row[0]
+                for row in DataFile.objects.filter(
+                    dataset_id__in=set(df.dataset_id for df in datafiles),
+                    filename__in=set(df.filename for df in datafiles))
+                .values_list('id', 'dataset_id', 'directory', 'filename',
+                             'version').order_by()}
+            for datafile in datafiles:
+                datafile.pk = ids[_file_key(
+                    datafile.dataset_id, datafile.directory,
+                    datafile.filename, datafile.version)]
+
+        created = []
+        dfos = []
+        changes = {}
+        for index, datafile, replicas in new_files:
+            temp_url = None
+            if replicas:
+                for replica in replicas:
+                    dfos.append(DataFileObject(
+                        datafile=datafile,
+                        storage_box=self._get_box(
+                            replica.get('location'), datafile),
+                        uri=replica.get('url') or replica.get('uri')))
+            else:
+                dfo = DataFileObject(
+                    datafile=datafile,
+                    storage_box=self._get_receiving_box(datafile))
+                dfo._cached_storage = self._get_storage(  # pylint: disable=W0212
+                    dfo.storage_box)
+                dfo.create_set_uri()
+                try:
+                    temp_url = dfo.get_full_path()
+                except NotImplementedError:
+                    temp_url = dfo.uri
+                dfos.append(dfo)
+            created.append((index, datafile, temp_url))
+            changes.setdefault(datafile.dataset_id, []).append(
+                (datafile.directory, 1, datafile.size))
+        DataFileObject.objects.bulk_create(dfos)
+        for dataset_id, dataset_changes in changes.items():
+            DatasetDirectory.update_index(dataset_id, dataset_changes)
+            Dataset.add_to_aggregates(
+                dataset_id, len(dataset_changes),
+                sum(size or 0 for _, _, size in dataset_changes))
+        self._log_uploads(datafile for _, datafile, temp_url in created
+                          if temp_url is None)
+        return created
+
+    def _log_uploads(self, datafiles):
+        if getattr(settings, "ENABLE_EVENTLOG", False):
+            from tardis.apps.eventlog.utils import log_bulk
+            counts = {}
+            for datafile in datafiles:
+                counts[datafile.dataset_id] = \
+                    counts.get(datafile.dataset_id, 0) + 1
+            for dataset_id, count in counts.items():
+                log_bulk(
+                    action="BULK_UPLOAD_DATAFILES",
+                    count=count,
+                    obj=self.datasets[dataset_id],
+                    extra={
+                        "type": "bulk"
+                    },
+                    request=self.request
+                )
+
+    def _queue_verification(self, datafiles):
+        '''
+        Queues verification of the registered replicas in batches per
+        storage box, because bulk_create doesn't call
+        DataFileObject.save, which would queue one task per replica
+        '''
+        if not datafiles:
+            return
+        batch_size = getattr(settings, 'VERIFY_DFOS_BATCH_SIZE', 100)
+        dfos_by_box = {}
+        for dfo_id, box_id in DataFileObject.objects.filter(
+                datafile__in=datafiles, verified=False) \
+                .order_by('id').values_list('id', 'storage_box_id'):
+            dfos_by_box.setdefault(box_id, []).append(dfo_id)
+        for box in StorageBox.objects.filter(id__in=dfos_by_box):
+            dfo_ids = dfos_by_box[box.id]
+            try:
+                if batch_size <= 1:
+                    shadow = 'dfo_verify location:%s' % box.name
+                    for dfo_id in dfo_ids:
+                        tasks.dfo_verify.apply_async(
+                            args=[dfo_id], countdown=5,
+                            priority=box.priority, shadow=shadow)
+                    continue
+                shadow = 'dfo_verify_batch location:%s' % box.name
+                for start in range(0, len(dfo_ids), batch_size):
+                    tasks.dfo_verify_batch.apply_async(
+                        args=[dfo_ids[start:start + batch_size], box.id],
+                        countdown=5, priority=box.priority, shadow=shadow)
+            except Exception as e:
+                logger.exception(
+                    "Failed to submit verification tasks for storage box "
+                    "%s due to %s", box.id, str(e))
@@ -0,0 +1,288 @@
+"""
+Checksum calculation for DataFiles and DataFileObjects.
+
+Files are read in large chunks into a pair of reusable buffers, so the
+next chunk can be read while the previous one is being hashed.  When
+more than one digest is requested, each hasher is updated from a thread
+in a pool shared by the process.  ``hashlib`` releases the GIL while
+hashing large buffers, so MD5 and SHA-512 are calculated concurrently
+rather than one after the other.
+
+For storage boxes whose storage class is a ``FileSystemStorage``, the
+file is memory-mapped instead of being read through Django's file
+storage API.
+"""
+import hashlib
+import io
+import logging
+import mmap
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage, get_storage_class
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHECKSUM_BUFFER_SIZE = 8 * 1024 * 1024
+
+# Buffers aren't made smaller than this for small files, in case the
+# size they were given is wrong
+MIN_CHECKSUM_BUFFER_SIZE = 64 * 1024
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    """
+    :return: the thread pool which updates hashers concurrently, created
+        when it is first needed
+    :rtype: concurrent.futures.ThreadPoolExecutor
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=max(2, os.cpu_count() or 1),
+                thread_name_prefix='checksums')
+        return _executor
+
+
+def _reset_executor():
+    # A forked process (e.g. a Celery worker) doesn't inherit the
+    # parent's threads, so it needs its own pool
+    global _executor, _executor_lock
+    _executor = None
+    _executor_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_executor)
+
+
+def get_buffer_size():
+    """
+    :return: the size in bytes of the chunks read when calculating checksums
+    :rtype: int
+    """
+    return int(getattr(settings, 'CHECKSUM_BUFFER_SIZE',
+                       DEFAULT_CHECKSUM_BUFFER_SIZE))
+
+
+def _new_hashers(compute_md5, compute_sha512):
+    hashers = {}
+    if compute_md5:
+        hashers['md5sum'] = hashlib.md5()
+    if compute_sha512:
+        hashers['sha512sum'] = hashlib.sha512()
+    return hashers
+
+
+def _hexdigests(hashers):
+    return {key: hasher.hexdigest() for key, hasher in hashers.items()}
+
+
+def _get_file_size(file_object):
+    try:
+        return os.fstat(file_object.fileno()).st_size
+    except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+        return None
+
+
+def _iter_chunks(file_object, buffer_size, buffer_count=2, size=None):
+    """Yields memoryviews of consecutive chunks of a file object
+
+    The buffers are used in turn, so with two buffers a chunk remains
+    valid until the chunk after next has been requested.  If the file's
+    size is known, the buffers are no bigger than the file needs.  File
+    objects which don't support ``readinto`` are read with ``read``
+    instead.
+    """
+    if size is not None:
+        buffer_size = min(buffer_size, max(size, MIN_CHECKSUM_BUFFER_SIZE))
+    buffers = [bytearray(buffer_size) for _ in range(buffer_count)]
+    views = [memoryview(buf) for buf in buffers]
+    readinto = getattr(file_object, 'readinto', None)
+    index = 0
+    while True:
+        if readinto is not None:
+            try:
+                nbytes = readinto(buffers[index])
+            except (AttributeError, io.UnsupportedOperation):
+                readinto = None
+                continue
+            if not nbytes:
+                return
+            yield views[index][:nbytes]
+        else:
+            data = file_object.read(buffer_size)
+            if not data:
+                return
+            yield memoryview(data)
+        index = (index + 1) % buffer_count
+
+
+def _update_hashers(hashers, file_object, buffer_size, size=None):
+    file_size = _get_file_size(file_object)
+    if file_size is not None:
+        size = file_size
+    if len(hashers) == 1:
+        # Nothing is read while the chunk is being hashed, so one buffer
+        # is enough
+        hasher = next(iter(hashers.values()))
+        for chunk in _iter_chunks(file_object, buffer_size, 1, size):
+            hasher.update(chunk)
+        return
+    executor = _get_executor()
+    pending = []
+    try:
+        for chunk in _iter_chunks(file_object, buffer_size, 2, size):
+            # The next chunk has already been read into the other buffer
+            # while the hashers were busy with this one.
+            for future in pending:
+                future.result()
+            pending = [executor.submit(hasher.update, chunk)
+                       for hasher in hashers.values()]
+    finally:
+        # Don't let the buffers go while they are being hashed
+        wait(pending)
+    for future in pending:
+        future.result()
+
+
+def compute_checksums(file_object,
+                      compute_md5=True,
+                      compute_sha512=False,
+                      close_file=True,
+                      buffer_size=None,
+                      size=None):
+    """Computes checksums for a python file object
+
+    :param object file_object: Python File object
+    :param compute_md5: whether to compute md5 default=True
+    :type compute_md5: bool
+    :param compute_sha512: whether to compute sha512, default=True
+    :type compute_sha512: bool
+    :param bool close_file: whether to close the file_object, default=True
+    :param int buffer_size: the size of the chunks to read, defaults to
+        settings.CHECKSUM_BUFFER_SIZE
+    :param int size: the expected size of the file, used if it can't be
+        found from the file object, so small files don't get full-size
+        buffers
+
+    :return: the checksums as {'md5sum': result, 'sha512sum': result}
+    :rtype: dict
+    """
+    hashers = _new_hashers(compute_md5, compute_sha512)
+    if not hashers:
+        return {}
+    file_object.seek(0)
+    _update_hashers(hashers, file_object, buffer_size or get_buffer_size(),
+                    size)
+    if close_file:
+        file_object.close()
+    else:
+        file_object.seek(0)
+    return _hexdigests(hashers)
+
+
+def _update_from_view(hasher, view, buffer_size):
+    for offset in range(0, len(view), buffer_size):
+        hasher.update(view[offset:offset + buffer_size])
+
+
+def compute_checksums_from_path(file_path,
+                                compute_md5=True,
+                                compute_sha512=False,
+                                buffer_size=None):
+    """Computes checksums for a local file by memory-mapping it
+
+    Each hasher walks the whole mapping in a thread of its own.
+
+    :param str file_path: absolute path of the file
+    :param compute_md5: whether to compute md5 default=True
+    :type compute_md5: bool
+    :param compute_sha512: whether to compute sha512, default=False
+    :type compute_sha512: bool
+    :param int buffer_size: the size of the slices passed to the hashers,
+        defaults to settings.CHECKSUM_BUFFER_SIZE
+
+    :return: the checksums as {'md5sum': result, 'sha512sum': result}
+    :rtype: dict
+    """
+    hashers = _new_hashers(compute_md5, compute_sha512)
+    if not hashers:
+        return {}
+    buffer_size = buffer_size or get_buffer_size()
+    with open(file_path, 'rb') as file_object:
+        if os.fstat(file_object.fileno()).st_size == 0:
+            # Empty files can't be memory-mapped
+            return _hexdigests(hashers)
+        with mmap.mmap(file_object.fileno(), 0,
+                       access=mmap.ACCESS_READ) as mapped:
+            if hasattr(mapped, 'madvise'):
+                mapped.madvise(mmap.MADV_SEQUENTIAL)
+            view = memoryview(mapped)
+            try:
+                if len(hashers) == 1:
+                    _update_from_view(
+                        next(iter(hashers.values())), view, buffer_size)
+                else:
+                    futures = [
+                        _get_executor().submit(
+                            _update_from_view, hasher, view, buffer_size)
+                        for hasher in hashers.values()]
+                    # The mapping can't be closed while it is being hashed
+                    wait(futures)
+                    for future in futures:
+                        future.result()
+            finally:
+                view.release()
+    return _hexdigests(hashers)
+
+
+def uses_file_system_storage(storage_box):
+    """
+    :return: True if the storage box's files can be opened by path
+    :rtype: bool
+    """
+    storage_class = get_storage_class(storage_box.django_storage_class)
+    return issubclass(storage_class, FileSystemStorage)
+
+
+def calculate_checksums(dfo, compute_md5=True, compute_sha512=False):
+    """Calculates checksums for a DataFileObject instance
+
+    Files in ``FileSystemStorage`` boxes are memory-mapped, everything
+    else is read through the storage backend's file object.  Can also be
+    used as a CALCULATE_CHECKSUMS_METHODS entry.
+
+    :param dfo: The DataFileObject instance
+    :type dfo: DataFileObject
+    :param compute_md5: whether to compute md5 default=True
+    :type compute_md5: bool
+    :param compute_sha512: whether to compute sha512, default=False
+    :type compute_sha512: bool
+
+    :return: the checksums as {'md5sum': result, 'sha512sum': result}
+    :rtype: dict
+    """
+    if dfo.uri and getattr(settings, 'CHECKSUM_USE_MMAP', True) and \
+            uses_file_system_storage(dfo.storage_box):
+        # Like compute_checksums, leave the DFO's file object closed
+        cached_file_object = getattr(dfo, '_cached_file_object', None)
+        if cached_file_object is not None:
+            cached_file_object.close()
+        try:
+            return compute_checksums_from_path(
+                dfo.get_full_path(), compute_md5, compute_sha512)
+        except FileNotFoundError:
+            raise
+        except (ValueError, OSError) as e:
+            # Fall back to the storage API, e.g. for special files
+            # which can't be memory-mapped:
+            logger.debug('Could not memory-map DFO %s: %s', dfo.id, str(e))
+    return compute_checksums(dfo.file_object, compute_md5, compute_sha512,
+                             size=dfo.datafile.size)
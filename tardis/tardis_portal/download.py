@@ -7,8 +7,11 @@ download.py
 .. moduleauthor::  Grischa Meyer <grischa.meyer@monash.edu>
 
 """
+import hashlib
 import logging
+import re
 import urllib
+import uuid
 import os
 import time
 from importlib import import_module
@@ -21,25 +24,35 @@ except ImportError:
     import binascii
     crc32 = binascii.crc32
 
+from bisect import bisect_right
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from itertools import chain
+import queue
+import struct
 import tarfile
 from tarfile import TarFile
-import gzip
+import threading
 import io
+import zipfile
 from wsgiref.util import FileWrapper
 
-from django.http import StreamingHttpResponse
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
 from django.conf import settings
+from django.utils.cache import get_conditional_response
 from django.utils.dateformat import format as dateformatter
+from django.utils.http import http_date
 from django.core.exceptions import ImproperlyConfigured
 from django.contrib.auth.decorators import login_required
 
-from tardis.analytics.tracker import IteratorTracker
+from tardis.analytics.tracker import IteratorTracker, track_download
 from .models import Dataset
 from .models import DataFile
 from .models import DataFileObject
 from .models import Experiment
 from .auth.decorators import has_datafile_download_access
+from .auth.decorators import has_dataset_download_access
 from .auth.decorators import experiment_download_required
 from .auth.decorators import dataset_download_required
 from .shortcuts import render_error_message
@@ -50,9 +63,183 @@ from .util import (get_filesystem_safe_dataset_name,
 
 logger = logging.getLogger(__name__)
 
+_RANGE_SPEC = re.compile(r'^\s*(\d*)\s*-\s*(\d*)\s*$')
+
+# Requests for more ranges than this are answered with the whole file
+MAX_BYTE_RANGES = 100
+
+FILE_DOWNLOAD_BLOCK_SIZE = 1024 * 1024
+
 DEFAULT_ORGANIZATION = settings.DEFAULT_PATH_MAPPER
 
 
+class _TrackedFileResponse(FileResponse):
+    '''
+    A FileResponse which reports the download to the analytics service
+    once the server has closed it, because the file may be sent with
+    wsgi.file_wrapper without iterating over the response.
+    '''
+    tracker_data = None
+
+    def close(self):
+        super().close()
+        if self.tracker_data is not None:
+            tracker_data, self.tracker_data = self.tracker_data, None
+            track_download(**tracker_data)
+
+
+def _get_file_size(datafile, file_obj):
+    try:
+        return int(file_obj.size)
+    except (AttributeError, OSError, TypeError, ValueError):
+        return int(datafile.size)
+
+
+def _is_seekable(file_obj):
+    try:
+        return file_obj.seekable()
+    except (AttributeError, OSError, ValueError):
+        return hasattr(file_obj, 'seek')
+
+
+def _iter_file_range(file_obj, start, end, block_size):
+    file_obj.seek(start)
+    remaining = end - start
+    while remaining > 0:
+        buf = file_obj.read(min(block_size, remaining))
+        if not buf:
+            break
+        remaining -= len(buf)
+        yield buf
+
+
+def _iter_file_ranges(file_obj, ranges, block_size, part_headers=None,
+                      boundary=None):
+    '''
+    Yields the content of the given ranges of a file, as the parts of a
+    multipart/byteranges body if part_headers and boundary are given, and
+    closes the file afterwards
+    '''
+    try:
+        for num, (start, end) in enumerate(ranges):
+            if part_headers:
+                yield part_headers[num]
+            yield from _iter_file_range(file_obj, start, end, block_size)
+            if part_headers:
+                yield b'\r\n'
+        if boundary:
+            yield b'--%s--\r\n' % boundary
+    finally:
+        file_obj.close()
+
+
+def get_datafile_response(request, datafile, file_obj,
+                          disposition='attachment', content_type=None,
+                          verified=True, tracker_data=None):
+    '''
+    Creates the response for downloading a DataFile's content.
+
+    Conditional requests are answered with the DataFile's checksum as
+    ETag and its modification time as Last-Modified.  For seekable file
+    objects, single and multiple byte ranges are supported, so that
+    clients can resume downloads or read slices of large files.  Whole
+    files and ranges up to the end of a file are sent with a FileResponse,
+    which the WSGI server can send without copying, e.g. with os.sendfile
+    for files in FileSystemStorage boxes.
+
+    :param request: the download request
+    :param DataFile datafile: the DataFile being downloaded
+    :param file_obj: the open file object for the DataFile's content
+    :param str disposition: 'attachment' or 'inline'
+    :param str content_type: defaults to the DataFile's mimetype
+    :param bool verified: whether file_obj is a verified copy, i.e. whether
+        the checksum can be used as ETag
+    :param dict tracker_data: analytics data for the download
+    :rtype: HttpResponse
+    '''
+    content_type = content_type or datafile.mimetype or \
+        'application/octet-stream'
+    size = _get_file_size(datafile, file_obj)
+    checksum = datafile.sha512sum or datafile.md5sum
+    etag = '"%s"' % checksum if verified and checksum else None
+    last_modified = None
+    if datafile.modification_time is not None:
+        last_modified = int(datafile.modification_time.timestamp())
+
+    response = get_conditional_response(
+        request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        file_obj.close()
+        return response
+
+    seekable = _is_seekable(file_obj)
+    ranges = None
+    if request.method in ('GET', 'HEAD') and seekable:
+        if_range = request.META.get('HTTP_IF_RANGE')
+        if if_range is None or (etag is not None and if_range == etag) or \
+                (last_modified is not None and
+                 if_range == http_date(last_modified)):
+            ranges = parse_range_header(request.META.get('HTTP_RANGE'), size)
+        if ranges is not None and len(ranges) > MAX_BYTE_RANGES:
+            ranges = None
+    if ranges == []:
+        file_obj.close()
+        return range_not_satisfiable_response(size)
+
+    block_size = FILE_DOWNLOAD_BLOCK_SIZE
+    if ranges and (len(ranges) > 1 or ranges[0][1] < size):
+        if len(ranges) > 1:
+            boundary = uuid.uuid4().hex.encode()
+            part_headers = [
+                b''.join([
+                    b'--%s\r\n' % boundary,
+                    b'Content-Type: %s\r\n' % content_type.encode(),
+                    b'Content-Range: bytes %d-%d/%d\r\n\r\n' % (
+                        start, end - 1, size)])
+                for start, end in ranges]
+            content = _iter_file_ranges(
+                file_obj, ranges, block_size, part_headers, boundary)
+            content_length = sum(
+                len(part_header) + end - start + 2
+                for (start, end), part_header in zip(ranges, part_headers))
+            content_length += len(boundary) + 6
+            content_type = 'multipart/byteranges; boundary=%s' % \
+                boundary.decode()
+        else:
+            content = _iter_file_ranges(file_obj, ranges, block_size)
+            content_length = ranges[0][1] - ranges[0][0]
+        if tracker_data is not None:
+            content = IteratorTracker(content, tracker_data)
+        response = StreamingHttpResponse(
+            content, status=206, content_type=content_type)
+        if len(ranges) == 1:
+            response['Content-Range'] = 'bytes %d-%d/%d' % (
+                ranges[0][0], ranges[0][1] - 1, size)
+    else:
+        # The whole file, or the rest of it from the start of the range
+        start = ranges[0][0] if ranges else 0
+        if start:
+            file_obj.seek(start)
+        response = _TrackedFileResponse(file_obj, content_type=content_type)
+        response.block_size = block_size
+        response.tracker_data = tracker_data
+        content_length = size - start
+        if ranges:
+            response.status_code = 206
+            response['Content-Range'] = 'bytes %d-%d/%d' % (
+                start, size - 1, size)
+    response['Content-Length'] = content_length
+    response['Content-Disposition'] = \
+        '%s; filename="%s"' % (disposition, datafile.filename)
+    if etag is not None:
+        response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    if seekable:
+        response['Accept-Ranges'] = 'bytes'
+    return response
+
+
 def _create_download_response(request, datafile_id, disposition='attachment'):  # too complex # noqa
     # Get datafile (and return 404 if absent)
     try:
@@ -105,12 +292,9 @@ def _create_download_response(request, datafile_id, disposition='attachment'):
                                             "please try again later.",
                                             status=503)
             return return_response_not_found(request)
-        wrapper = FileWrapper(file_obj, blksize=65535)
-        response = StreamingHttpResponse(wrapper,
-                                         content_type=datafile.get_mimetype())
-        response['Content-Disposition'] = \
-            '%s; filename="%s"' % (disposition, datafile.filename)
-        return response
+        return get_datafile_response(
+            request, datafile, file_obj, disposition,
+            content_type=datafile.get_mimetype(), verified=verified_only)
     except IOError:
         # If we can't read the file, return not found
         return return_response_not_found(request)
@@ -215,6 +399,332 @@ def _get_datafile_details_for_archive(mapper, datafiles):
     return res
 
 
+def _get_file_opener(df):
+    '''
+    Resolves the storage of a DataFile's preferred verified DFO in the
+    calling thread, so the returned function which opens the file can be
+    called from a worker thread without touching the database.
+    '''
+    dfo = df.get_preferred_dfo()
+    if dfo is None or not dfo.uri:
+        raise IOError('No verified file object for DataFile %s' % df.id)
+    storage = dfo._storage  # pylint: disable=protected-access
+    return partial(storage.open, dfo.uri, mode='rb')
+
+
+def _read_file_chunks(open_file, offset, size, chunk_size):
+    '''
+    Reads exactly ``size`` bytes starting at ``offset`` from a file in
+    chunks of up to ``chunk_size`` bytes
+    '''
+    fileobj = open_file()
+    try:
+        if offset:
+            fileobj.seek(offset)
+        remaining = size
+        while remaining > 0:
+            buf = fileobj.read(min(chunk_size, remaining))
+            if not buf:
+                raise IOError("end of file reached")
+            remaining -= len(buf)
+            yield buf
+    finally:
+        fileobj.close()
+
+
+class _PrefetchingReader(object):
+    '''
+    Reads a file in a worker thread, keeping up to ``max_chunks`` chunks
+    ahead of the consumer iterating over the reader.
+    '''
+
+    def __init__(self, open_file, offset, size, chunk_size, max_chunks,
+                 cancelled):
+        self.open_file = open_file
+        self.offset = offset
+        self.size = size
+        self.chunk_size = chunk_size
+        self.cancelled = cancelled
+        self.chunks = queue.Queue(max_chunks)
+
+    def _put(self, item):
+        while not self.cancelled.is_set():
+            try:
+                self.chunks.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def run(self):
+        try:
+            for buf in _read_file_chunks(self.open_file, self.offset,
+                                         self.size, self.chunk_size):
+                if not self._put(buf):
+                    return
+        except Exception as e:
+            self._put(e)
+            return
+        self._put(None)
+
+    def __iter__(self):
+        while True:
+            item = self.chunks.get()
+            if item is None:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+
+def _iter_prefetched_files(file_ranges, chunk_size):
+    '''
+    Yields a (datafile, chunks) tuple for each (datafile, offset, size)
+    tuple in file_ranges, where chunks iterates over that part of the
+    file's content.
+
+    While one file is being consumed, up to DOWNLOAD_ARCHIVE_PREFETCH_FILES
+    further files are opened and read ahead in a bounded pool of worker
+    threads, each of them buffering at most DOWNLOAD_ARCHIVE_PREFETCH_CHUNKS
+    chunks.  This hides the latency of opening files on object stores and
+    HSM backends at file boundaries.  The database is only accessed from
+    the calling thread.
+    '''
+    prefetch = int(getattr(settings, 'DOWNLOAD_ARCHIVE_PREFETCH_FILES', 2))
+    if prefetch < 1:
+        for df, offset, size in file_ranges:
+            if size:
+                yield df, _read_file_chunks(
+                    _get_file_opener(df), offset, size, chunk_size)
+            else:
+                yield df, iter(())
+        return
+    max_chunks = max(
+        1, int(getattr(settings, 'DOWNLOAD_ARCHIVE_PREFETCH_CHUNKS', 8)))
+    cancelled = threading.Event()
+    # The file being consumed was submitted before any of the files read
+    # ahead, so it always has a worker, even when all others are blocked
+    # on full buffers.
+    executor = ThreadPoolExecutor(max_workers=prefetch)
+    pending = deque()
+    file_ranges = iter(file_ranges)
+    try:
+        while True:
+            for df, offset, size in file_ranges:
+                if size:
+                    reader = _PrefetchingReader(
+                        _get_file_opener(df), offset, size, chunk_size,
+                        max_chunks, cancelled)
+                    executor.submit(reader.run)
+                else:
+                    reader = ()
+                pending.append((df, reader))
+                if len(pending) > prefetch:
+                    break
+            if not pending:
+                return
+            df, reader = pending.popleft()
+            yield df, iter(reader)
+    finally:
+        cancelled.set()
+        executor.shutdown(wait=False)
+
+
+class _OutputBuffer(object):
+    '''
+    Cuts the archive stream into chunks of ``chunk_size`` bytes, slicing
+    memoryviews of the incoming buffers instead of repeatedly copying the
+    remainder.
+    '''
+
+    def __init__(self, chunk_size):
+        self.chunk_size = chunk_size
+        self.pending = bytearray()
+
+    def feed(self, buf):
+        '''
+        :return: the complete chunks which are available after adding buf
+        :rtype: list
+        '''
+        view = memoryview(buf)
+        chunks = []
+        if self.pending:
+            needed = self.chunk_size - len(self.pending)
+            self.pending += view[:needed]
+            view = view[needed:]
+            if len(self.pending) < self.chunk_size:
+                return chunks
+            chunks.append(bytes(self.pending))
+            self.pending = bytearray()
+        end = len(view) - len(view) % self.chunk_size
+        for offset in range(0, end, self.chunk_size):
+            chunks.append(view[offset:offset + self.chunk_size].tobytes())
+        self.pending += view[end:]
+        return chunks
+
+    def flush(self):
+        chunks = [bytes(self.pending)] if self.pending else []
+        self.pending = bytearray()
+        return chunks
+
+
+def _deflate_block(buf, comp_level, zdict, last):
+    if zdict:
+        compressor = zlib.compressobj(
+            comp_level, zlib.DEFLATED, -zlib.MAX_WBITS, zlib.DEF_MEM_LEVEL,
+            zlib.Z_DEFAULT_STRATEGY, zdict)
+    else:
+        compressor = zlib.compressobj(
+            comp_level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(buf) + compressor.flush(
+        zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+
+class GzipStreamCompressor(object):
+    '''
+    Compresses a stream into gzip format.
+
+    With more than one thread, the stream is split into blocks which are
+    deflated concurrently like pigz does, each block primed with the last
+    32 KiB of the previous one and ending in a sync flush, so that the
+    concatenated blocks form a single deflate stream.  zlib releases the
+    GIL while compressing.
+    '''
+    BLOCK_SIZE = 1024 * 1024
+    WINDOW_SIZE = 32 * 1024
+
+    def __init__(self, comp_level=6, threads=1):
+        self.comp_level = comp_level
+        self.threads = threads
+        if threads > 1:
+            self.executor = ThreadPoolExecutor(max_workers=threads)
+            self.pending = deque()
+            self.block = bytearray()
+            self.zdict = None
+            self.crc = 0
+            self.size = 0
+            self.header = b''.join([
+                b'\x1f\x8b\x08\x00',
+                struct.pack('<I', int(time.time())),
+                b'\x00\xff'])
+        else:
+            self.compressor = zlib.compressobj(
+                comp_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def _submit(self, buf, last=False):
+        self.crc = crc32(buf, self.crc)
+        self.size += len(buf)
+        self.pending.append(self.executor.submit(
+            _deflate_block, buf, self.comp_level, self.zdict, last))
+        self.zdict = buf[-self.WINDOW_SIZE:]
+
+    def _collect(self, wait_all=False):
+        results = [self.header]
+        self.header = b''
+        while self.pending and (wait_all or self.pending[0].done() or
+                                len(self.pending) > 2 * self.threads):
+            results.append(self.pending.popleft().result())
+        return b''.join(results)
+
+    def compress(self, buf):
+        '''
+        :return: the compressed data which is available so far
+        :rtype: bytes
+        '''
+        if self.threads <= 1:
+            return self.compressor.compress(buf)
+        self.block += buf
+        while len(self.block) >= self.BLOCK_SIZE:
+            self._submit(bytes(self.block[:self.BLOCK_SIZE]))
+            del self.block[:self.BLOCK_SIZE]
+        return self._collect()
+
+    def flush(self):
+        '''
+        :return: the rest of the compressed stream, including the trailer
+        :rtype: bytes
+        '''
+        if self.threads <= 1:
+            return self.compressor.flush()
+        self._submit(bytes(self.block), last=True)
+        self.block = bytearray()
+        result = self._collect(wait_all=True)
+        self.executor.shutdown()
+        return result + struct.pack(
+            '<II', self.crc & 0xffffffff, self.size & 0xffffffff)
+
+
+def _overlap(offset, length, start, end):
+    '''
+    :return: the part of [offset, offset + length) which lies within
+        [start, end), relative to offset, as (start, end)
+    :rtype: tuple
+    '''
+    overlap_start = min(max(start - offset, 0), length)
+    overlap_end = max(min(end - offset, length), overlap_start)
+    return overlap_start, overlap_end
+
+
+def _slice(buf, offset, start, end):
+    '''
+    :return: the part of buf, located at offset, within [start, end)
+    '''
+    overlap_start, overlap_end = _overlap(offset, len(buf), start, end)
+    if overlap_start == 0 and overlap_end == len(buf):
+        return buf
+    return memoryview(buf)[overlap_start:overlap_end]
+
+
+def parse_range_header(header, size):
+    '''
+    Parses the byte ranges of an HTTP Range header
+
+    :param str header: the Range header, e.g. 'bytes=0-499,1000-'
+    :param int size: the size of the representation
+    :return: None if there is no (valid) Range header, so that the whole
+        representation should be sent, otherwise the list of satisfiable
+        ranges as (start, end) tuples, with end exclusive, which is empty
+        if none of the ranges can be satisfied
+    :rtype: list
+    '''
+    if not header:
+        return None
+    unit, sep, range_specs = header.partition('=')
+    if not sep or unit.strip().lower() != 'bytes':
+        return None
+    ranges = []
+    for range_spec in range_specs.split(','):
+        match = _RANGE_SPEC.match(range_spec)
+        if not match:
+            return None
+        first, last = match.groups()
+        if first:
+            start = int(first)
+            end = size
+            if last:
+                if int(last) < start:
+                    return None
+                end = min(int(last) + 1, size)
+        elif last:
+            start = max(size - int(last), 0)
+            end = size if int(last) else 0
+        else:
+            return None
+        if start < end:
+            ranges.append((start, end))
+    return ranges
+
+
+def range_not_satisfiable_response(size):
+    response = HttpResponse(status=416)
+    response['Content-Range'] = 'bytes */%d' % size
+    return response
+
+
+def _get_gzip_threads():
+    return max(1, int(getattr(settings, 'DOWNLOAD_ARCHIVE_GZIP_THREADS', 1)))
+
+
 class UncachedTarStream(TarFile):
     '''
     Stream files into a compressed tar stream on the fly
@@ -235,17 +745,23 @@ class UncachedTarStream(TarFile):
         filenum = len(mapped_file_objs)
         self.tarinfos = [None] * filenum
         self.tarinfo_bufs = [None] * filenum
+        # the offsets of the members' headers in the archive
+        self.member_offsets = [None] * filenum
+        self.members_size = 0
         self.filename = filename
         self.buffersize = buffersize
         self.http_buffersize = http_buffersize
+        self.comp_level = comp_level
         self.do_gzip = do_gzip
-        if do_gzip:
-            self.binary_buffer = io.BytesIO()
-            self.gzipfile = gzip.GzipFile(bytes(filename), 'w',
-                                          comp_level, self.binary_buffer)
+        self.compressor = None
+        self.output_buffer = None
         self.tar_size = self.compute_size()
 
     def compute_size(self):
+        '''
+        Computes the layout of the uncompressed archive, i.e. the offset of
+        every member, and returns its total size
+        '''
         total_size = 0
         for num, fobj in enumerate(self.mapped_file_objs):
             df, name = fobj
@@ -254,12 +770,14 @@ class UncachedTarStream(TarFile):
             tarinfo_buf = tarinfo.tobuf(self.format, self.encoding,
                                         self.errors)
             self.tarinfo_bufs[num] = tarinfo_buf
+            self.member_offsets[num] = total_size
             total_size += len(tarinfo_buf)
             size = int(tarinfo.size)
             blocks, remainder = divmod(size, tarfile.BLOCKSIZE)
             if remainder > 0:
                 blocks += 1
             total_size += blocks * tarfile.BLOCKSIZE
+        self.members_size = total_size
         blocks, remainder = divmod(total_size, tarfile.RECORDSIZE)
         if remainder > 0:
             blocks += 1
@@ -276,109 +794,96 @@ class UncachedTarStream(TarFile):
             dj_mtime = None
             logger.debug('cannot read m_time for file id'
                          ' %d, exception %s' % (df.id, str(e)))
+        # Fall back to a time which doesn't change between requests, so
+        # that the archive's bytes and ETag do, for resuming downloads
+        dj_mtime = dj_mtime or df.created_time
         if dj_mtime is not None:
             tarinfo.mtime = float(dateformatter(dj_mtime, 'U'))
         else:
-            tarinfo.mtime = time.time()
+            tarinfo.mtime = 0
         return tarinfo
 
-    def compress(self, buf):
-        self.gzipfile.write(buf)
-        self.gzipfile.flush()
-        self.binary_buffer.seek(0)
-        result = self.binary_buffer.read()
-        self.binary_buffer.seek(0)
-        self.binary_buffer.truncate()
-        return result
-
-    def prepare_output(self, uc_buf, remainder):
-        if self.do_gzip:
-            result_buf = self.compress(uc_buf)
-        else:
-            result_buf = uc_buf
-        if remainder is not None:
-            result_buf = b''.join([remainder, result_buf])
-        stream_buffers = []
-        while len(result_buf) >= self.http_buffersize:
-            stream_buffers.append(result_buf[:self.http_buffersize])
-            result_buf = result_buf[self.http_buffersize:]
-        return stream_buffers, result_buf
-
-    def close_gzip(self):
-        self.gzipfile.close()
-        self.binary_buffer.seek(0)
-        result = self.binary_buffer.read()
-        self.binary_buffer.seek(0)
-        self.binary_buffer.truncate()
-        return result
-
-    def make_tar(self):  # noqa
+    def prepare_output(self, buf):
         '''
-        main tar generator. until python 3 needs to be in one function
-        because 'yield's don't bubble up.
+        :return: the http_buffersize sized chunks of output available after
+            adding buf to the (compressed) stream
+        :rtype: list
         '''
-        remainder_buf = None
-        for num, fobj in enumerate(self.mapped_file_objs):
-            df, dummy_name = fobj
-            fileobj = df.file_object
-            self._check('aw')
-            tarinfo = self.tarinfos[num]
+        if self.compressor is not None:
+            buf = self.compressor.compress(buf)
+        return self.output_buffer.feed(buf)
+
+    def get_etag(self):
+        '''
+        :return: an ETag which identifies the content of the uncompressed
+            archive, derived from the members' headers and checksums
+        :rtype: str
+        '''
+        digest = hashlib.sha1()
+        for num, (df, dummy_name) in enumerate(self.mapped_file_objs):
+            digest.update(self.tarinfo_bufs[num])
+            digest.update((df.sha512sum or df.md5sum or '').encode())
+        return '"%s"' % digest.hexdigest()
+
+    def make_tar(self, start=0, end=None):
+        '''
+        main tar generator
+
+        Generates the bytes from ``start`` up to ``end`` of the archive
+        (before compression), using the member offsets to skip whole
+        members and to seek within the first file.
+        '''
+        if end is None:
+            end = self.tar_size
+        self.output_buffer = _OutputBuffer(self.http_buffersize)
+        if self.do_gzip:
+            self.compressor = GzipStreamCompressor(
+                self.comp_level, _get_gzip_threads())
+        first = max(bisect_right(self.member_offsets, start) - 1, 0)
+        members = []
+        file_ranges = []
+        for num in range(first, len(self.mapped_file_objs)):
+            if self.member_offsets[num] >= end:
+                break
+            data_offset = self.member_offsets[num] + \
+                len(self.tarinfo_bufs[num])
+            file_start, file_end = _overlap(
+                data_offset, self.tarinfos[num].size, start, end)
+            members.append(num)
+            file_ranges.append((self.mapped_file_objs[num][0], file_start,
+                                file_end - file_start))
+        for num, (dummy_df, chunks) in zip(
+                members, _iter_prefetched_files(file_ranges, self.buffersize)):
+            offset = self.member_offsets[num]
             buf = self.tarinfo_bufs[num]
-            stream_buffers, remainder_buf = self.prepare_output(
-                buf,
-                remainder_buf)
-            for stream_buf in stream_buffers:
-                yield stream_buf
-            self.offset += len(buf or '')
-            if tarinfo.isreg():
-                if tarinfo.size == 0:
-                    continue
-                # split into file read buffer sized chunks
-                blocks, remainder = divmod(tarinfo.size, self.buffersize)
-                for dummy_b in range(blocks):
-                    buf = fileobj.read(self.buffersize)
-                    if len(buf) < self.buffersize:
-                        raise IOError("end of file reached")
-                    # send in http_buffersize sized chunks
-                    stream_buffers, remainder_buf = self.prepare_output(
-                        buf, remainder_buf)
-                    for stream_buf in stream_buffers:
-                        yield stream_buf
-                # in case the file has remaining read bytes
-                if remainder != 0:
-                    buf = fileobj.read(remainder)
-                    if len(buf) < remainder:
-                        raise IOError("end of file reached")
-                    # send remaining file data
-                    stream_buffers, remainder_buf = self.prepare_output(
-                        buf, remainder_buf)
-                    for stream_buf in stream_buffers:
-                        yield stream_buf
-                blocks, remainder = divmod(tarinfo.size, tarfile.BLOCKSIZE)
-                if remainder > 0:
-                    buf = (tarfile.NUL * (tarfile.BLOCKSIZE - remainder))
-                    stream_buffers, remainder_buf = self.prepare_output(
-                        buf, remainder_buf)
-                    for stream_buf in stream_buffers:
-                        yield stream_buf
-                    blocks += 1
-                self.offset += blocks * tarfile.BLOCKSIZE
-            fileobj.close()
+            yield from self.prepare_output(_slice(buf, offset, start, end))
+            offset += len(buf)
+            for buf in chunks:
+                yield from self.prepare_output(buf)
+            offset += self.tarinfos[num].size
+            remainder = self.tarinfos[num].size % tarfile.BLOCKSIZE
+            if remainder > 0:
+                padding_start, padding_end = _overlap(
+                    offset, tarfile.BLOCKSIZE - remainder, start, end)
+                yield from self.prepare_output(
+                    tarfile.NUL * (padding_end - padding_start))
         # fill up the end with zero-blocks
         # (like option -b20 for tar does)
-        blocks, remainder = divmod(self.offset, tarfile.RECORDSIZE)
-        if remainder > 0:
-            buf = tarfile.NUL * (tarfile.RECORDSIZE - remainder)
-            stream_buffers, remainder_buf = self.prepare_output(
-                buf, remainder_buf)
-            for stream_buf in stream_buffers:
-                yield stream_buf
-        if remainder_buf:
-            yield remainder_buf
-        if self.do_gzip:
-            yield self.close_gzip()
-
-    def get_response(self, tracker_data=None):
+        padding_start, padding_end = _overlap(
+            self.members_size, self.tar_size - self.members_size, start, end)
+        if padding_end > padding_start:
+            yield from self.prepare_output(
+                tarfile.NUL * (padding_end - padding_start))
+        if self.compressor is not None:
+            yield from self.output_buffer.feed(self.compressor.flush())
+        yield from self.output_buffer.flush()
+
+    def get_response(self, tracker_data=None, request=None):
+        '''
+        Creates the streaming response.  For uncompressed archives, if the
+        request is given, conditional requests and single byte ranges
+        are supported, e.g. for resuming an interrupted download.
+        '''
         if self.do_gzip:
             content_type = 'application/x-gzip'
             content_length = None
@@ -386,22 +891,139 @@ class UncachedTarStream(TarFile):
         else:
             content_type = 'application/x-tar'
             content_length = self.tar_size
-        file_iterator = IteratorTracker(self.make_tar(), tracker_data)
+        byte_range = None
+        etag = None
+        if not self.do_gzip and request is not None and \
+                request.method in ('GET', 'HEAD'):
+            etag = self.get_etag()
+            response = get_conditional_response(request, etag=etag)
+            if response is not None:
+                return response
+            if request.META.get('HTTP_IF_RANGE', etag) == etag:
+                ranges = parse_range_header(
+                    request.META.get('HTTP_RANGE'), self.tar_size)
+                if ranges == []:
+                    return range_not_satisfiable_response(self.tar_size)
+                if ranges is not None and len(ranges) == 1:
+                    byte_range = ranges[0]
+        if byte_range is not None:
+            file_iterator = IteratorTracker(
+                self.make_tar(*byte_range), tracker_data)
+        else:
+            file_iterator = IteratorTracker(self.make_tar(), tracker_data)
         response = StreamingHttpResponse(file_iterator,
                                          content_type=content_type)
         response['Content-Disposition'] = 'attachment; filename="%s"' % \
                                           self.filename
         response['X-Accel-Buffering'] = 'no'
+        if etag is not None:
+            response['ETag'] = etag
+            response['Accept-Ranges'] = 'bytes'
+        if byte_range is not None:
+            start, end = byte_range
+            response.status_code = 206
+            response['Content-Range'] = 'bytes %d-%d/%d' % (
+                start, end - 1, self.tar_size)
+            content_length = end - start
         if content_length is not None:
             response['Content-Length'] = content_length
         return response
 
 
+class _ZipSink(object):
+    '''
+    Write-only file object for zipfile.ZipFile which collects the output
+    '''
+
+    def __init__(self, output_buffer):
+        self.output_buffer = output_buffer
+        self.chunks = []
+
+    def write(self, buf):
+        self.chunks.extend(self.output_buffer.feed(buf))
+        return len(buf)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        chunks = self.chunks
+        self.chunks = []
+        return chunks
+
+
+class UncachedZipStream(object):
+    '''
+    Stream files into an uncompressed ZIP archive on the fly, using ZIP64
+    extensions for large files and archives
+    '''
+
+    def __init__(self, mapped_file_objs, filename, buffersize=2*65536,
+                 http_buffersize=65535):
+        self.mapped_file_objs = mapped_file_objs
+        self.filename = filename
+        self.buffersize = buffersize
+        self.http_buffersize = http_buffersize
+        self.zip_size = sum(int(df.get_size())
+                            for df, dummy_name in mapped_file_objs)
+
+    @staticmethod
+    def zipinfo_for_df(df, name):
+        # Like tarinfo_for_df, the fallback mustn't change between requests
+        dj_mtime = df.modification_time or df.created_time
+        if dj_mtime is not None:
+            mtime = float(dateformatter(dj_mtime, 'U'))
+        else:
+            mtime = 0
+        # ZIP can't represent times before 1980
+        date_time = time.localtime(max(mtime, 315532800))[:6]
+        zinfo = zipfile.ZipInfo(name, date_time)
+        zinfo.external_attr = 0o644 << 16
+        zinfo.file_size = int(df.get_size())
+        return zinfo
+
+    def make_zip(self):
+        '''
+        main zip generator
+        '''
+        sink = _ZipSink(_OutputBuffer(self.http_buffersize))
+        archive = zipfile.ZipFile(sink, 'w', zipfile.ZIP_STORED,
+                                  allowZip64=True)
+        file_ranges = [(df, 0, int(df.get_size()))
+                       for df, dummy_name in self.mapped_file_objs]
+        for num, (df, chunks) in enumerate(
+                _iter_prefetched_files(file_ranges, self.buffersize)):
+            dummy_df, name = self.mapped_file_objs[num]
+            entry = archive.open(self.zipinfo_for_df(df, name), 'w')
+            for buf in chunks:
+                entry.write(buf)
+                yield from sink.drain()
+            entry.close()
+            yield from sink.drain()
+        archive.close()
+        yield from sink.drain()
+        yield from sink.output_buffer.flush()
+
+    def get_response(self, tracker_data=None, request=None):
+        self.filename = os.path.splitext(self.filename)[0] + '.zip'
+        file_iterator = IteratorTracker(self.make_zip(), tracker_data)
+        response = StreamingHttpResponse(file_iterator,
+                                         content_type='application/zip')
+        response['Content-Disposition'] = 'attachment; filename="%s"' % \
+                                          self.filename
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+
 def _streaming_downloader(request, datafiles, rootdir, filename,
-                          comptype='tgz', organization=DEFAULT_ORGANIZATION):
+                          comptype='tgz', organization=DEFAULT_ORGANIZATION,
+                          obj=None):
     '''
     private function to be called by wrappers
     creates download response with given files and names
+
+    ``obj`` is the experiment or dataset being downloaded, if any, which
+    the download event refers to
     '''
     mapper = make_mapper(organization, rootdir)
     if not mapper:
@@ -410,32 +1032,37 @@ def _streaming_downloader(request, datafiles, rootdir, filename,
             status=400)
 
     if getattr(settings, "ENABLE_EVENTLOG", False):
-        from tardis.apps.eventlog.utils import log
-        for df in datafiles:
-            log(
-                action="DOWNLOAD_DATAFILE",
-                extra={
-                    "id": df.id,
-                    "type": "tar"
-                },
-                request=request
-            )
+        from tardis.apps.eventlog.utils import log_bulk
+        log_bulk(
+            action="BULK_DOWNLOAD_DATAFILES",
+            count=len(datafiles),
+            obj=obj,
+            extra={
+                "type": "tar"
+            },
+            request=request
+        )
 
     try:
         files = _get_datafile_details_for_archive(mapper, datafiles)
-        tfs = UncachedTarStream(
-            files,
-            filename=filename,
-            do_gzip=comptype != 'tar')
+        if comptype == 'zip':
+            tfs = UncachedZipStream(files, filename=filename)
+            total_size = tfs.zip_size
+        else:
+            tfs = UncachedTarStream(
+                files,
+                filename=filename,
+                do_gzip=comptype != 'tar')
+            total_size = tfs.tar_size
         tracker_data = dict(
-            label='tar',
+            label='zip' if comptype == 'zip' else 'tar',
             session_id=request.COOKIES.get('_ga'),
             ip=request.META.get('REMOTE_ADDR', ''),
             user=request.user,
-            total_size=tfs.tar_size,
+            total_size=total_size,
             num_files=len(datafiles),
             ua=request.META.get('HTTP_USER_AGENT', None))
-        return tfs.get_response(tracker_data)
+        return tfs.get_response(tracker_data, request)
     except ValueError:  # raised when replica not verified TODO: custom excptn
         message = """The experiment you are trying to access has not yet been
                      verified completely.
@@ -456,9 +1083,12 @@ def streaming_download_experiment(request, experiment_id, comptype='tgz',
     df_ids = DataFileObject.objects.filter(
         datafile__dataset__experiments__id=experiment_id, verified=True) \
                 .values('datafile_id').distinct()
-    datafiles = DataFile.objects.filter(id__in=df_ids)
+    # A stable order keeps the archive's byte offsets the same across
+    # requests, so interrupted downloads can be resumed
+    datafiles = DataFile.objects.filter(id__in=df_ids).order_by(
+        'filename', 'id')
     return _streaming_downloader(request, datafiles, rootdir, filename,
-                                 comptype, organization)
+                                 comptype, organization, experiment)
 
 
 @dataset_download_required
@@ -471,15 +1101,18 @@ def streaming_download_dataset(request, dataset_id, comptype='tgz',
     df_ids = DataFileObject.objects.filter(
         datafile__dataset=dataset, verified=True) \
         .values('datafile_id').distinct()
-    datafiles = DataFile.objects.filter(id__in=df_ids)
+    # A stable order keeps the archive's byte offsets the same across
+    # requests, so interrupted downloads can be resumed
+    datafiles = DataFile.objects.filter(id__in=df_ids).order_by(
+        'filename', 'id')
     return _streaming_downloader(request, datafiles, rootdir, filename,
-                                 comptype, organization)
+                                 comptype, organization, dataset)
 
 
 def streaming_download_datafiles(request):  # too complex # noqa
     """
     takes string parameter "comptype" for compression method.
-    Currently implemented: "tgz" and "tar"
+    Currently implemented: "tgz", "tar" and "zip"
     The datafiles to be downloaded are selected using "datafile", "dataset"
     or "url" parameters.  An "expid" parameter may be supplied for use in
     the download archive name.  If "url" is used, the "expid" parameter
@@ -503,16 +1136,20 @@ def streaming_download_datafiles(request):  # too complex # noqa
 
             # Generator to produce datafiles from dataset id
             def get_dataset_datafiles(dsid):
+                try:
+                    if not has_dataset_download_access(
+                            request=request, dataset_id=dsid):
+                        return
+                except Dataset.DoesNotExist:
+                    return
                 for datafile in DataFile.objects.filter(dataset=dsid):
-                    if has_datafile_download_access(
-                            request=request, datafile_id=datafile.id):
-                        yield datafile
+                    yield datafile
 
             # Generator to produce datafile from datafile id
             def get_datafile(dfid):
                 datafile = DataFile.objects.get(pk=dfid)
-                if has_datafile_download_access(request=request,
-                                                datafile_id=datafile.id):
+                if has_dataset_download_access(
+                        request=request, dataset_id=datafile.dataset_id):
                     yield datafile
 
             # Take chained generators and turn them into a set of datafiles
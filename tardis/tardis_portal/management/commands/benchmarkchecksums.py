@@ -0,0 +1,80 @@
+"""
+Management command to measure checksum calculation throughput (MB/s)
+for each storage class in use, by calculating checksums for a sample
+of verified DataFileObjects.  The DataFileObjects are not modified.
+"""
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from ...models import DataFileObject, StorageBox
+
+
+class Command(BaseCommand):
+    help = 'Report checksum calculation throughput per storage class'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sample',
+            type=int,
+            default=20,
+            dest='sample',
+            help='Number of DataFileObjects to checksum per storage class'
+        )
+        parser.add_argument(
+            '--storage-box',
+            type=int,
+            action='append',
+            dest='storage_boxes',
+            help='Only benchmark this StorageBox ID (can be repeated)'
+        )
+        parser.add_argument(
+            '--sha512',
+            action='store_true',
+            default=getattr(settings, 'COMPUTE_SHA512', False),
+            dest='sha512',
+            help='Calculate SHA-512 sums as well as MD5 sums'
+        )
+
+    def handle(self, *args, **options):
+        boxes = StorageBox.objects.all()
+        if options['storage_boxes']:
+            boxes = boxes.filter(id__in=options['storage_boxes'])
+        storage_classes = sorted(set(
+            boxes.values_list('django_storage_class', flat=True)))
+
+        for storage_class in storage_classes:
+            dfos = DataFileObject.objects.filter(
+                verified=True,
+                storage_box__in=boxes.filter(
+                    django_storage_class=storage_class)) \
+                .select_related('datafile', 'storage_box') \
+                .order_by('-datafile__size')[:options['sample']]
+            total_bytes = 0
+            total_time = 0.0
+            files = 0
+            errors = 0
+            for dfo in dfos:
+                start = time.perf_counter()
+                try:
+                    dfo.calculate_checksums(
+                        compute_md5=True, compute_sha512=options['sha512'])
+                except IOError:
+                    errors += 1
+                    continue
+                total_time += time.perf_counter() - start
+                total_bytes += dfo.datafile.size or 0
+                files += 1
+            if not total_time:
+                self.stdout.write(
+                    '%s: no readable files (%d errors)' %
+                    (storage_class, errors))
+                continue
+            self.stdout.write(
+                '%s: %.1f MB/s (%d files, %.1f MB, %d errors)' % (
+                    storage_class,
+                    total_bytes / total_time / 1e6,
+                    files,
+                    total_bytes / 1e6,
+                    errors))
@@ -0,0 +1,31 @@
+"""
+Management command to rebuild the directory index of datasets, e.g. after
+DataFiles have been modified with bulk database updates which don't
+maintain the index.
+"""
+from django.core.management.base import BaseCommand
+
+from ...models import Dataset, DatasetDirectory
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the directory index of datasets from their DataFiles'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'dataset_ids',
+            type=int,
+            nargs='*',
+            help='The IDs of the datasets to rebuild, default: all datasets'
+        )
+
+    def handle(self, *args, **options):
+        dataset_ids = options['dataset_ids'] or \
+            Dataset.objects.values_list('id', flat=True).iterator()
+        count = 0
+        for dataset_id in dataset_ids:
+            DatasetDirectory.rebuild_index(dataset_id)
+            count += 1
+        if options['verbosity'] > 0:
+            self.stdout.write('Rebuilt the directory index of %d datasets'
+                              % count)
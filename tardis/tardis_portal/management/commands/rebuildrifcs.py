@@ -0,0 +1,79 @@
+"""
+Management command to rebuild the RIF-CS documents of experiments in
+OAI_DOCS_PATH, e.g. after changing RIFCS_PROVIDERS or the RIF-CS templates.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from ...models import Experiment
+from ...publish.publishservice import publish_experiment_rifcs
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the RIF-CS documents of experiments'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'experiment_ids',
+            type=int,
+            nargs='*',
+            help='The IDs of the experiments to rebuild, '
+            'default: all experiments'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='The number of documents to render at a time, default: 1'
+        )
+
+    def handle(self, *args, **options):
+        experiment_ids = options['experiment_ids'] or \
+            Experiment.objects.values_list('id', flat=True).iterator()
+        providers = getattr(settings, 'RIFCS_PROVIDERS', None)
+
+        def rebuild(experiment_id):
+            try:
+                publish_experiment_rifcs(
+                    experiment_id, settings.OAI_DOCS_PATH, providers)
+                return experiment_id, None
+            except Exception as err:
+                return experiment_id, err
+
+        if options['workers'] > 1:
+            # Each thread has its own database connections, which are
+            # closed once the threads have finished
+            worker_connections = []
+            lock = threading.Lock()
+
+            def init_worker():
+                with lock:
+                    worker_connections.extend(connections.all())
+
+            try:
+                with ThreadPoolExecutor(max_workers=options['workers'],
+                                        initializer=init_worker) as pool:
+                    self._report(pool.map(rebuild, experiment_ids), options)
+            finally:
+                for conn in worker_connections:
+                    conn.inc_thread_sharing()
+                    try:
+                        conn.close()
+                    finally:
+                        conn.dec_thread_sharing()
+        else:
+            self._report(map(rebuild, experiment_ids), options)
+
+    def _report(self, results, options):
+        count = 0
+        for experiment_id, err in results:
+            if err is not None:
+                self.stderr.write('Failed to rebuild the RIF-CS of '
+                                  'experiment %s: %s' % (experiment_id, err))
+            count += 1
+        if options['verbosity'] > 0:
+            self.stdout.write('Rebuilt the RIF-CS of %d experiments' % count)
@@ -0,0 +1,37 @@
+"""
+Management command to recalculate the file counts and sizes of datasets,
+e.g. after DataFiles or DataFileObjects have been modified with bulk
+database updates which don't maintain them.
+"""
+from django.core.management.base import BaseCommand
+
+from ...models import Dataset
+
+
+class Command(BaseCommand):
+    help = 'Recalculate the file counts and sizes of datasets'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'dataset_ids',
+            type=int,
+            nargs='*',
+            help='The IDs of the datasets to reconcile, default: all datasets'
+        )
+
+    def handle(self, *args, **options):
+        dataset_ids = options['dataset_ids'] or \
+            Dataset.objects.values_list('id', flat=True).iterator()
+        count = 0
+        repaired = 0
+        for dataset_id in dataset_ids:
+            if Dataset.update_aggregates(dataset_id):
+                repaired += 1
+                if options['verbosity'] > 1:
+                    self.stdout.write('Repaired the aggregates of dataset %s'
+                                      % dataset_id)
+            count += 1
+        if options['verbosity'] > 0:
+            self.stdout.write('Reconciled the aggregates of %d datasets, '
+                              '%d of which were out of date'
+                              % (count, repaired))
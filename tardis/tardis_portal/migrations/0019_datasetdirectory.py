@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 3.2.7 on 2026-10-18 18:31
+from __future__ import unicode_literals
+from __future__ import print_function
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def build_directory_index(apps, schema_editor):
+    Dataset = apps.get_model("tardis_portal", "Dataset")
+    DataFile = apps.get_model("tardis_portal", "DataFile")
+    DatasetDirectory = apps.get_model("tardis_portal", "DatasetDirectory")
+    total_datasets = Dataset.objects.count()
+
+    print()
+    current_dataset = 0
+    for dataset_id in Dataset.objects.values_list('id', flat=True).iterator():
+        directories = {}
+        rows = DataFile.objects.filter(dataset_id=dataset_id) \
+            .order_by().values_list('directory') \
+            .annotate(file_count=models.Count('id'),
+                      size=models.Sum('size'))
+        for directory, file_count, size in rows:
+            parts = [part for part in (directory or '').split('/') if part]
+            for depth in range(1, len(parts) + 1):
+                path = '/'.join(parts[:depth])
+                if path not in directories:
+                    directories[path] = DatasetDirectory(
+                        dataset_id=dataset_id,
+                        path=path,
+                        parent_path=path.rpartition('/')[0],
+                        name=path.rpartition('/')[2])
+                directories[path].file_count += file_count
+                directories[path].size += size or 0
+        DatasetDirectory.objects.bulk_create(directories.values())
+        current_dataset += 1
+        if current_dataset % 1000 == 0:
+            print("{0} of {1} dataset directory indexes built".format(
+                current_dataset, total_datasets))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tardis_portal', '0018_make_default_storage_box_status_online'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DatasetDirectory',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=255)),
+                ('parent_path', models.CharField(blank=True, max_length=255)),
+                ('name', models.CharField(max_length=255)),
+                ('file_count', models.BigIntegerField(default=0)),
+                ('size', models.BigIntegerField(default=0)),
+                ('dataset', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='directories', to='tardis_portal.dataset')),
+            ],
+            options={
+                'verbose_name_plural': 'Dataset directories',
+                'ordering': ['path'],
+                'unique_together': {('dataset', 'path')},
+                'index_together': {('dataset', 'parent_path')},
+            },
+        ),
+        migrations.RunPython(build_directory_index,
+                             migrations.RunPython.noop),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 3.2.7 on 2026-10-18 19:30
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tardis_portal', '0019_datasetdirectory'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='storagebox',
+            name='options_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 3.2.7 on 2026-10-18 20:05
+from __future__ import unicode_literals
+from __future__ import print_function
+
+from django.db import migrations, models
+
+
+def calculate_dataset_aggregates(apps, schema_editor):
+    Dataset = apps.get_model("tardis_portal", "Dataset")
+    DataFile = apps.get_model("tardis_portal", "DataFile")
+    total_datasets = Dataset.objects.count()
+
+    print()
+    current_dataset = 0
+    for dataset_id in Dataset.objects.values_list('id', flat=True).iterator():
+        datafiles = DataFile.objects.filter(dataset_id=dataset_id).order_by()
+        totals = datafiles.aggregate(
+            file_count=models.Count('id'), size=models.Sum('size'))
+        verified = datafiles.values('id', 'size').annotate(
+            min_verified=models.Min(models.Case(
+                models.When(file_objects__verified=True, then=1),
+                default=0, output_field=models.IntegerField()))) \
+            .filter(min_verified=1) \
+            .aggregate(file_count=models.Count('id'),
+                       size=models.Sum('size'))
+        Dataset.objects.filter(id=dataset_id).update(
+            file_count=totals['file_count'],
+            size=totals['size'] or 0,
+            verified_file_count=verified['file_count'],
+            verified_size=verified['size'] or 0)
+        current_dataset += 1
+        if current_dataset % 1000 == 0:
+            print("{0} of {1} dataset aggregates calculated".format(
+                current_dataset, total_datasets))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tardis_portal', '0020_storagebox_options_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dataset',
+            name='file_count',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='dataset',
+            name='size',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='dataset',
+            name='verified_file_count',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='dataset',
+            name='verified_size',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(calculate_dataset_aggregates,
+                             migrations.RunPython.noop),
+    ]
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 3.2.7 on 2026-10-18 21:40
+from __future__ import unicode_literals
+from __future__ import print_function
+
+import logging
+
+from django.db import migrations
+from django.db.models import Max, Q
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_datafile_directories(apps, schema_editor):
+    '''
+    Strips leading, trailing and repeated slashes from DataFile directories,
+    so that they match the paths in the datasets' directory indexes.
+
+    A file which would then clash with another file of the same name and
+    version in the same directory (e.g. "a/f.txt" and "a//f.txt") becomes
+    the next version of that file, so that both stay reachable.  These
+    files are logged as warnings with their IDs and old directories.
+    '''
+    DataFile = apps.get_model("tardis_portal", "DataFile")
+    datafiles = DataFile.objects.filter(
+        Q(directory__startswith='/') | Q(directory__endswith='/') |
+        Q(directory__contains='//')).order_by('id')
+    total_datafiles = datafiles.count()
+
+    print()
+    current_datafile = 0
+    for datafile in list(datafiles.only(
+            'id', 'dataset_id', 'directory', 'filename', 'version')):
+        directory = '/'.join(
+            part for part in datafile.directory.split('/') if part)
+        same_path = DataFile.objects.filter(
+            dataset_id=datafile.dataset_id, directory=directory,
+            filename=datafile.filename)
+        version = datafile.version
+        if same_path.filter(version=version).exists():
+            version = same_path.aggregate(
+                version=Max('version'))['version'] + 1
+            message = (
+                "DataFile {0} moved from directory {1!r} to {2!r} as "
+                "version {3} of {4}, which already exists".format(
+                    datafile.id, datafile.directory, directory, version,
+                    datafile.filename))
+            logger.warning(message)
+            print(message)
+        DataFile.objects.filter(id=datafile.id).update(
+            directory=directory, version=version)
+        current_datafile += 1
+        if current_datafile % 1000 == 0:
+            print("{0} of {1} datafile directories normalized".format(
+                current_datafile, total_datafiles))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tardis_portal', '0021_dataset_aggregates'),
+    ]
+
+    operations = [
+        migrations.RunPython(normalize_datafile_directories,
+                             migrations.RunPython.noop),
+    ]
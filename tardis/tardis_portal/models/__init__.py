@@ -49,7 +49,7 @@ from .access_control import ObjectACL
 from .facility import Facility
 from .instrument import Instrument
 from .experiment import Experiment, ExperimentAuthor
-from .dataset import Dataset
+from .dataset import Dataset, DatasetDirectory
 from .datafile import DataFile
 from .datafile import DataFileObject
 from .storage import StorageBox
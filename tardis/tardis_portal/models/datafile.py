@@ -1,4 +1,3 @@
-import hashlib
 import logging
 import re
 import mimetypes
@@ -16,7 +15,7 @@ from django.urls import reverse
 from django.db import models
 from django.db import transaction
 from django.db.models import Q, Sum
-from django.db.models.signals import pre_delete
+from django.db.models.signals import post_delete, post_save, pre_delete
 from django.dispatch import receiver
 from django.forms.models import model_to_dict
 from django.utils import timezone
@@ -24,8 +23,11 @@ from django.utils.functional import cached_property
 
 import magic
 
-from .. import tasks
-from .dataset import Dataset
+from .. import checksums, tasks
+from ..checksums import compute_checksums  # noqa # pylint: disable=W0611
+from .dataset import Dataset, DatasetDirectory, deleting, is_being_deleted, \
+    mark_deleting, normalize_directory
+from .hooks import queue_dataset_aggregates_update
 from .storage import StorageBox, StorageBoxOption, StorageBoxAttribute
 
 logger = logging.getLogger(__name__)
@@ -48,6 +50,9 @@ class DataFile(models.Model):
     :attribute dataset: The foreign key to the
        :class:`tardis.tardis_portal.models.Dataset` the file belongs to.
     :attribute filename: The name of the file, excluding the path.
+    :attribute directory: The directory of the file within the dataset.
+      It is saved without leading, trailing or repeated slashes, e.g.
+      'a//b/' is saved as 'a/b'.
     :attribute size: The size of the file.
     :attribute created_time: Should be populated with the file's creation time
       from the instrument PC.
@@ -107,7 +112,7 @@ class DataFile(models.Model):
         States are defined in StorageBox
         """
         return {dfo.storage_type
-                for dfo in self.file_objects.filter(verified=True)}
+                for dfo in self._get_verified_file_objects()}
 
     @cached_property
     def is_online(self):
@@ -116,8 +121,8 @@ class DataFile(models.Model):
         At this stage it checks it returns true for no file objects, because
         those files are offline through other checks
         """
-        dfos = self.file_objects.filter(verified=True)
-        if dfos.count() == 0:
+        dfos = self._get_verified_file_objects()
+        if not dfos:
             return True
         for dfo in dfos:
             if dfo.storage_box.django_storage_class == \
@@ -192,6 +197,42 @@ class DataFile(models.Model):
         """
         return datafiles.aggregate(size=Sum('size'))['size'] or 0
 
+    @classmethod
+    def prefetch_verified_file_objects(cls, datafiles):
+        """
+        Takes a query set of datafiles and prefetches their verified
+        DataFileObjects, along with the DataFileObjects' storage boxes and
+        storage box attributes, so that the ``verified``, ``is_online``,
+        ``status`` and ``recall_url`` properties of the datafiles don't
+        query the database for each datafile.
+        """
+        return datafiles.prefetch_related(
+            models.Prefetch(
+                'file_objects',
+                queryset=DataFileObject.objects.filter(
+                    verified=True).prefetch_related(
+                        'storage_box__attributes'),
+                to_attr='verified_file_objects'))
+
+    @classmethod
+    def prefetch_online_status(cls, datafiles):
+        """
+        Takes a list of datafiles and sets their ``is_online`` properties
+        with a bulk check when the HSM app is installed, so that files in
+        HSM storage boxes aren't checked one at a time.
+        """
+        if 'tardis.apps.hsm' in settings.INSTALLED_APPS and datafiles:
+            from tardis.apps.hsm.check import datafiles_online
+            online = datafiles_online([df.id for df in datafiles])
+            for df in datafiles:
+                df.is_online = online[df.id]
+        return datafiles
+
+    def _get_verified_file_objects(self):
+        if hasattr(self, 'verified_file_objects'):
+            return self.verified_file_objects
+        return self.file_objects.filter(verified=True)
+
     # pylint: disable=W0222
     def save(self, *args, **kwargs):
         if self.size is not None:
@@ -208,8 +249,60 @@ class DataFile(models.Model):
                 raise Exception('Invalid Datafile size (must be >= 0): %d' %
                                 self.size)
         self.update_mimetype(save=False)
+        # Store the directory as it appears in the directory index, so that
+        # the index's paths can be used to look up the files
+        self.directory = normalize_directory(self.directory)
 
+        if self._state.adding:
+            indexed = None
+        else:
+            indexed = getattr(self, '_directory_index_state', None) or \
+                DataFile.objects.filter(pk=self.pk).values_list(
+                    'dataset_id', 'directory', 'size').first()
         super().save(*args, **kwargs)
+        self._update_directory_index(indexed)
+
+    def delete(self, *args, **kwargs):
+        # The DataFileObjects deleted with the file don't need to queue
+        # their own updates of the dataset's aggregates
+        with deleting(self):
+            return super().delete(*args, **kwargs)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if all(field in field_names
+               for field in ('dataset_id', 'directory', 'size')):
+            instance._directory_index_state = (
+                instance.dataset_id, instance.directory, instance.size)
+        return instance
+
+    def _update_directory_index(self, indexed):
+        """
+        Updates the dataset's directory index after this file has been
+        saved.  ``indexed`` is the (dataset_id, directory, size) the file
+        was previously indexed with, or None for new files.
+        """
+        current = (self.dataset_id, self.directory, self.size)
+        if indexed == current:
+            return
+        changes = [(self.directory, 1, self.size)]
+        if indexed is not None:
+            removed = (indexed[1], -1, -(indexed[2] or 0))
+            if indexed[0] == self.dataset_id:
+                changes.append(removed)
+            else:
+                DatasetDirectory.update_index(indexed[0], [removed])
+                Dataset.add_to_aggregates(indexed[0], -1, removed[2])
+                queue_dataset_aggregates_update(indexed[0])
+            # The file may have been verified:
+            queue_dataset_aggregates_update(self.dataset_id)
+        DatasetDirectory.update_index(self.dataset_id, changes)
+        Dataset.add_to_aggregates(
+            self.dataset_id,
+            sum(change[1] for change in changes),
+            sum(change[2] or 0 for change in changes))
+        self._directory_index_state = current
 
     def get_size(self):
         return self.size
@@ -270,7 +363,7 @@ class DataFile(models.Model):
 
         from tardis.apps.hsm.storage import HsmFileSystemStorage
 
-        dfos = self.file_objects.filter(verified=True)
+        dfos = self._get_verified_file_objects()
 
         for dfo in dfos:
             storage_class_name = dfo.storage_box.django_storage_class
@@ -438,6 +531,16 @@ class DataFile(models.Model):
     def _has_delete_perm(self, user_obj):
         return self._has_any_perm(user_obj)
 
+    @staticmethod
+    def guess_mimetype(filename):
+        '''
+        Guesses a file's MIME type from its name, without reading it
+        '''
+        mimetype, encoding = mimetypes.guess_type(filename)
+        if mimetype is not None and encoding is not None:
+            mimetype = '%s; %s' % (mimetype, encoding)
+        return mimetype or 'application/octet-stream'
+
     def update_mimetype(self, mimetype=None, force=False, save=True):
         if self.mimetype is not None and self.mimetype != '' and not force:
             return self.mimetype
@@ -447,10 +550,7 @@ class DataFile(models.Model):
             mimetype = m.from_buffer(fo.read(1024))
             fo.close()
         if mimetype is None:
-            mimetype, encoding = mimetypes.guess_type(self.filename)
-            if mimetype is not None and encoding is not None:
-                mimetype = '%s; %s' % (mimetype, encoding)
-            mimetype = mimetype or 'application/octet-stream'
+            mimetype = self.guess_mimetype(self.filename)
         if ';' in mimetype:
             mt, enc = mimetype.split(';')
             if enc.endswith('charset=binary'):
@@ -464,8 +564,9 @@ class DataFile(models.Model):
     def verified(self):
         """Return True if at least one DataFileObject is verified
         """
-        dfos = [dfo.verified for dfo in self.file_objects.all()]
-        return any(dfos)
+        if hasattr(self, 'verified_file_objects'):
+            return bool(self.verified_file_objects)
+        return self.file_objects.filter(verified=True).exists()
 
     def verify(self, reverify=False):
         dfos = [dfo.verify() for dfo in self.file_objects.all()
@@ -749,9 +850,10 @@ class DataFileObject(models.Model):
             calculate_checksums = getattr(module, method_name)
             return calculate_checksums(self, compute_md5, compute_sha512)
 
-        return compute_checksums(self.file_object, compute_md5, compute_sha512)
+        return checksums.calculate_checksums(
+            self, compute_md5, compute_sha512)
 
-    def verify(self, add_checksums=True, add_size=True):  # too complex # noqa
+    def verify(self, add_checksums=True, add_size=True, save=True):  # too complex # noqa
         compute_md5 = getattr(settings, 'COMPUTE_MD5', True)
         compute_sha512 = getattr(settings, 'COMPUTE_SHA512', False)
         comparisons = ['size']
@@ -826,11 +928,22 @@ class DataFileObject(models.Model):
 
         self.verified = result
         self.last_verified_time = timezone.now()
-        self.save(update_fields=['verified', 'last_verified_time'])
-        df.update_mimetype()
+        if save:
+            self.save(update_fields=['verified', 'last_verified_time'])
+            self.post_verify()
+        # Otherwise the caller saves the result (e.g. batch verification,
+        # with a single update for many DataFileObjects) and then calls
+        # post_verify, so that filters see the saved result
+        return result
+
+    def post_verify(self):
+        """
+        Updates the DataFile's MIME type and applies filters, once the
+        result of verify has been saved.
+        """
+        self.datafile.update_mimetype()
         if getattr(settings, 'USE_FILTERS', False):
             self.apply_filters()
-        return result
 
     def apply_filters(self):
         from django.core.files.storage import FileSystemStorage
@@ -898,42 +1011,38 @@ def delete_dfo(sender, instance, **kwargs):
                      '%s, because deletes are disabled' % instance.id)
 
 
-def compute_checksums(file_object,
-                      compute_md5=True,
-                      compute_sha512=False,
-                      close_file=True):
-    """Computes checksums for a python file object
-
-    :param object file_object: Python File object
-    :param compute_md5: whether to compute md5 default=True
-    :type compute_md5: bool
-    :param compute_sha512: whether to compute sha512, default=True
-    :type compute_sha512: bool
-    :param bool close_file: whether to close the file_object, default=True
-
-    :return: the checksums as {'md5sum': result, 'sha512sum': result}
-    :rtype: dict
-    """
-    blocksize = 0
-    results = {}
-    if compute_md5:
-        md5_hasher = hashlib.new('md5')
-        blocksize = max(md5_hasher.block_size, blocksize)
-        results['md5sum'] = md5_hasher
-    if compute_sha512:
-        sha512_hasher = hashlib.new('sha512')
-        blocksize = max(sha512_hasher.block_size, blocksize)
-        results['sha512sum'] = sha512_hasher
-    update_fns = {'md5sum': lambda x, y: x.update(y),
-                  'sha512sum': lambda x, y: x.update(y)}
-    file_object.seek(0)
-    for chunk in iter(lambda: file_object.read(32 * blocksize), b''):
-        for key, val in results.items():
-            update_fns[key](val, chunk)
-    if close_file:
-        file_object.close()
+@receiver(pre_delete, sender=DataFile,
+          dispatch_uid='datafile_delete_with_dataset')
+def mark_datafile_deleted_with_dataset(sender, instance, **kwargs):
+    # Lets the DataFileObjects' receivers skip the DataFile too
+    if is_being_deleted(Dataset, instance.dataset_id):
+        mark_deleting(DataFile, instance.id)
+
+
+@receiver(post_delete, sender=DataFile, dispatch_uid='datafile_delete')
+def remove_datafile_from_directory_index(sender, instance, **kwargs):
+    if is_being_deleted(Dataset, instance.dataset_id):
+        # The index and aggregates are deleted along with the dataset
+        return
+    DatasetDirectory.update_index(
+        instance.dataset_id,
+        [(instance.directory, -1, -(instance.size or 0))])
+    Dataset.add_to_aggregates(
+        instance.dataset_id, -1, -(instance.size or 0))
+    queue_dataset_aggregates_update(instance.dataset_id)
+
+
+@receiver(post_save, sender=DataFileObject, dispatch_uid='dfo_aggregates_save')
+@receiver(post_delete, sender=DataFileObject,
+          dispatch_uid='dfo_aggregates_delete')
+def update_dataset_verified_aggregates(sender, instance, **kwargs):
+    if is_being_deleted(DataFile, instance.datafile_id):
+        # The DataFile's own receiver updates the dataset's aggregates
+        return
+    if DataFileObject.datafile.field.is_cached(instance):
+        dataset_id = instance.datafile.dataset_id
     else:
-        file_object.seek(0)
-    final_fns = {'md5sum': lambda x: x.hexdigest(),
-                 'sha512sum': lambda x: x.hexdigest()}
-    return {key: final_fns[key](val) for key, val in results.items()}
+        dataset_id = DataFile.objects.filter(id=instance.datafile_id) \
+            .values_list('dataset_id', flat=True).first()
+    if dataset_id is not None:
+        queue_dataset_aggregates_update(dataset_id)
@@ -1,9 +1,11 @@
 import logging
+import threading
+from contextlib import contextmanager
 from os import path
 
 from django.conf import settings
 from django.urls import reverse
-from django.db import models
+from django.db import models, transaction
 from django.utils import timezone
 
 from ..managers import OracleSafeManager
@@ -14,6 +16,44 @@ from .instrument import Instrument
 
 logger = logging.getLogger(__name__)
 
+_deletions = threading.local()
+
+
+def _get_deletions():
+    if not hasattr(_deletions, 'objects'):
+        _deletions.objects = set()
+    return _deletions.objects
+
+
+@contextmanager
+def deleting(instance):
+    """
+    Marks a model instance as being deleted in this thread, while its
+    delete method cascades to its related objects.  Signal receivers for
+    those objects can then skip updating the instance (see
+    is_being_deleted).  Anything marked with mark_deleting in the meantime
+    is unmarked at the end.
+    """
+    deletions = _get_deletions()
+    saved = set(deletions)
+    deletions.add((instance._meta.label, instance.pk))
+    try:
+        yield
+    finally:
+        deletions.clear()
+        deletions.update(saved)
+
+
+def mark_deleting(model, pk):
+    """
+    Marks an object which is deleted along with one marked by deleting
+    """
+    _get_deletions().add((model._meta.label, pk))
+
+
+def is_being_deleted(model, pk):
+    return (model._meta.label, pk) in _get_deletions()
+
 
 class Dataset(models.Model):
     """A dataset represents a collection files usually associated
@@ -35,6 +75,19 @@ class Dataset(models.Model):
     :attribute description: Description of this dataset, which usually \
         corresponds to the folder name on the instrument PC
     :attribute immutable: Whether this dataset is read-only
+    :attribute file_count: The number of files in this dataset
+    :attribute size: The total size in bytes of the files in this dataset
+    :attribute verified_file_count: The number of files in this dataset
+        whose DataFileObjects are all verified
+    :attribute verified_size: The total size in bytes of the verified files
+        in this dataset
+
+    ``file_count`` and ``size`` are updated along with the directory index
+    whenever a :class:`~tardis.tardis_portal.models.datafile.DataFile` is
+    created, moved, resized or deleted.  ``verified_file_count`` and
+    ``verified_size`` are updated by a Celery task shortly after the
+    dataset's DataFileObjects change.  Use the ``reconcileaggregates``
+    management command to repair them after bulk database updates.
     """
 
     experiments = models.ManyToManyField(Experiment, related_name='datasets')
@@ -45,8 +98,15 @@ class Dataset(models.Model):
     immutable = models.BooleanField(default=False)
     instrument = models.ForeignKey(Instrument, null=True, blank=True,
                                    on_delete=models.CASCADE)
+    file_count = models.BigIntegerField(default=0, editable=False)
+    size = models.BigIntegerField(default=0, editable=False)
+    verified_file_count = models.BigIntegerField(default=0, editable=False)
+    verified_size = models.BigIntegerField(default=0, editable=False)
     objects = OracleSafeManager()
 
+    AGGREGATE_FIELDS = ('file_count', 'size',
+                        'verified_file_count', 'verified_size')
+
     class Meta:
         app_label = 'tardis_portal'
         ordering = ['-id']
@@ -54,18 +114,40 @@ class Dataset(models.Model):
     # pylint: disable=W0222
     def save(self, *args, **kwargs):
         self.modified_time = timezone.now()
+        if not self._state.adding and not args and \
+                kwargs.get('update_fields') is None and \
+                not kwargs.get('force_insert'):
+            # The aggregates are maintained in the database, so they
+            # mustn't be overwritten by an instance loaded before its
+            # files changed
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and
+                field.name not in self.AGGREGATE_FIELDS]
         super().save(*args, **kwargs)
 
+    def delete(self, *args, **kwargs):
+        # The dataset's files don't need to be removed from its directory
+        # index and aggregates one by one
+        with deleting(self):
+            return super().delete(*args, **kwargs)
+
     @property
     def is_online(self):
-        return all(df.is_online for df in self.datafile_set.all())
+        if 'tardis.apps.hsm' in settings.INSTALLED_APPS:
+            from tardis.apps.hsm.check import datafiles_online
+            return all(datafiles_online(self.datafile_set.all()).values())
+        from .datafile import DataFile
+        return all(df.is_online for df in
+                   DataFile.prefetch_verified_file_objects(
+                       self.datafile_set.all()))
 
     @property
     def online_files_count(self):
         if 'tardis.apps.hsm' in settings.INSTALLED_APPS:
             from tardis.apps.hsm.check import dataset_online_count
             return dataset_online_count(self)
-        return self.datafile_set.count()
+        return self.file_count
 
     def getParameterSets(self, schemaType=None):
         """Return the dataset parametersets associated with this
@@ -122,7 +204,7 @@ class Dataset(models.Model):
         render_image_ds_size_limit = getattr(
             settings, 'RENDER_IMAGE_DATASET_SIZE_LIMIT', 0)
         if render_image_ds_size_limit and \
-                self.datafile_set.count() > render_image_ds_size_limit:
+                self.file_count > render_image_ds_size_limit:
             return DataFile.objects.none()
         return self.datafile_set.order_by('filename').filter(IMAGE_FILTER)\
             .filter(file_objects__verified=True).distinct()
@@ -147,8 +229,54 @@ class Dataset(models.Model):
                                'format': 'jpg'})
 
     def get_size(self):
+        return self.size
+
+    @classmethod
+    def add_to_aggregates(cls, dataset_id, file_count, size):
+        """
+        Adds the number and total size of files added to a dataset, or
+        subtracts them for files removed, to the dataset's ``file_count``
+        and ``size``.
+        """
+        if file_count or size:
+            cls.objects.filter(id=dataset_id).update(
+                file_count=models.F('file_count') + file_count,
+                size=models.F('size') + (size or 0))
+
+    @classmethod
+    def update_aggregates(cls, dataset_id):
+        """
+        Recalculates a dataset's aggregates from its DataFiles and their
+        DataFileObjects
+
+        :return: True if the stored aggregates were out of date
+        :rtype: bool
+        """
         from .datafile import DataFile
-        return DataFile.sum_sizes(self.datafile_set)
+        datafiles = DataFile.objects.filter(dataset_id=dataset_id).order_by()
+        with transaction.atomic():
+            # Files added or removed meanwhile wait for the lock before
+            # updating file_count and size:
+            stored = cls.objects.select_for_update().filter(
+                id=dataset_id).values_list(*cls.AGGREGATE_FIELDS).first()
+            if stored is None:
+                return False
+            totals = datafiles.aggregate(
+                file_count=models.Count('id'), size=models.Sum('size'))
+            verified = datafiles.values('id', 'size').annotate(
+                min_verified=models.Min(models.Case(
+                    models.When(file_objects__verified=True, then=1),
+                    default=0, output_field=models.IntegerField()))) \
+                .filter(min_verified=1) \
+                .aggregate(file_count=models.Count('id'),
+                           size=models.Sum('size'))
+            aggregates = (totals['file_count'], totals['size'] or 0,
+                          verified['file_count'], verified['size'] or 0)
+            if aggregates == stored:
+                return False
+            cls.objects.filter(id=dataset_id).update(
+                **dict(zip(cls.AGGREGATE_FIELDS, aggregates)))
+            return True
 
     def _has_any_perm(self, user_obj):
         if not hasattr(self, 'id'):
@@ -213,27 +341,12 @@ class Dataset(models.Model):
         >>> ds.get_dir_tuples("test files/subdir3/subdir4")
         [('..', 'test files/subdir3/subdir4')]
         """
-        from .datafile import DataFile
-
         dir_tuples = []
         if basedir:
             dir_tuples.append(('..', basedir))
-        dirs_query = DataFile.objects.filter(dataset=self)
-        if basedir:
-            dirs_query = dirs_query.filter(directory__startswith='%s/' % basedir)
-        dir_paths = set(dirs_query.values_list('directory', flat=True))
-        for dir_path in dir_paths:
-            if not dir_path:
-                continue
-            if basedir:
-                dir_name = dir_path[len(basedir)+1:].lstrip('/').split('/')[0]
-            else:
-                dir_name = dir_path.split('/')[0]
-            # Reconstruct the dir_path, eliminating subdirs within dir_name:
-            dir_path = '/'.join([basedir, dir_name]).lstrip('/')
-            dir_tuple = (dir_name, dir_path)
-            if dir_name and dir_tuple not in dir_tuples:
-                dir_tuples.append((dir_name, dir_path))
+        subdirs = self.directories.filter(
+            parent_path='/'.join(split_directory(basedir)))
+        dir_tuples.extend(subdirs.values_list('name', 'path'))
 
         return sorted(dir_tuples, key=lambda x: x[0])
 
@@ -314,3 +427,138 @@ class Dataset(models.Model):
             }
             dir_list.append(child_dict)
         return dir_list
+
+
+def split_directory(directory):
+    """
+    Splits a DataFile's directory into its components, ignoring leading,
+    trailing and repeated separators, e.g. 'a//b/' -> ['a', 'b']
+    """
+    return [part for part in (directory or '').split('/') if part]
+
+
+def normalize_directory(directory):
+    """
+    Returns a DataFile's directory in the form used by the directory
+    index, e.g. 'a//b/' -> 'a/b'.  None is left as it is.
+    """
+    if directory is None:
+        return None
+    return '/'.join(split_directory(directory))
+
+
+class DatasetDirectory(models.Model):
+    """An entry in the directory index of a dataset.
+
+    There is one ``DatasetDirectory`` for every directory in a dataset
+    which contains files, directly or in one of its subdirectories.
+    ``file_count`` and ``size`` include the files in all subdirectories.
+    The index is updated whenever a
+    :class:`~tardis.tardis_portal.models.datafile.DataFile` is created,
+    moved, resized or deleted, so that listing subdirectories and finding
+    the files within a directory tree don't need to scan all of a
+    dataset's files.  Use the ``rebuilddirectoryindex`` management command
+    after modifying DataFiles without calling their ``save`` or ``delete``
+    methods (e.g. with ``QuerySet.update``).
+
+    :attribute dataset: The dataset containing the directory
+    :attribute path: The directory's path, e.g. 'subdir1/subdir2'
+    :attribute parent_path: The path of the parent directory, e.g.
+        'subdir1', or '' for top-level directories
+    :attribute name: The directory's name, e.g. 'subdir2'
+    :attribute file_count: The number of files within the directory
+    :attribute size: The total size in bytes of the files within the
+        directory
+    """
+
+    dataset = models.ForeignKey(Dataset, on_delete=models.CASCADE,
+                                related_name='directories')
+    path = models.CharField(max_length=255)
+    parent_path = models.CharField(max_length=255, blank=True)
+    name = models.CharField(max_length=255)
+    file_count = models.BigIntegerField(default=0)
+    size = models.BigIntegerField(default=0)
+
+    class Meta:
+        app_label = 'tardis_portal'
+        ordering = ['path']
+        unique_together = ['dataset', 'path']
+        index_together = [['dataset', 'parent_path']]
+        verbose_name_plural = 'Dataset directories'
+
+    def __str__(self):
+        return '%s: %s' % (self.dataset_id, self.path)
+
+    @classmethod
+    def get_subtree_paths(cls, directory, dataset_id=None):
+        """
+        Returns the paths of a directory and all of its subdirectories, as
+        a values query set which can be used in a ``directory__in`` filter
+        for DataFiles.
+        """
+        path = '/'.join(split_directory(directory))
+        paths = cls.objects.filter(
+            models.Q(path=path) | models.Q(path__startswith=path + '/'))
+        if dataset_id is not None:
+            paths = paths.filter(dataset_id=dataset_id)
+        return paths.values('path')
+
+    @classmethod
+    def update_index(cls, dataset_id, changes):
+        """
+        Updates the index for files added to or removed from a dataset.
+
+        :param int dataset_id: the dataset's ID
+        :param changes: an iterable of (directory, file count, size)
+            tuples, with negative counts and sizes for removed files
+        """
+        deltas = {}
+        for directory, file_count, size in changes:
+            parts = split_directory(directory)
+            for depth in range(1, len(parts) + 1):
+                delta = deltas.setdefault('/'.join(parts[:depth]), [0, 0])
+                delta[0] += file_count
+                delta[1] += size or 0
+        deltas = {path: tuple(delta) for path, delta in deltas.items()
+                  if delta != [0, 0]}
+        if not deltas:
+            return
+
+        with transaction.atomic():
+            cls.objects.bulk_create([
+                cls(dataset_id=dataset_id,
+                    path=path,
+                    parent_path=path.rpartition('/')[0],
+                    name=path.rpartition('/')[2])
+                for path, (file_count, _) in deltas.items()
+                if file_count > 0
+            ], ignore_conflicts=True)
+            # Directories with the same number of files and bytes added
+            # or removed (e.g. all parents of a single file) are updated
+            # together:
+            paths_by_delta = {}
+            for path, delta in deltas.items():
+                paths_by_delta.setdefault(delta, []).append(path)
+            for (file_count, size), paths in paths_by_delta.items():
+                cls.objects.filter(
+                    dataset_id=dataset_id, path__in=paths).update(
+                        file_count=models.F('file_count') + file_count,
+                        size=models.F('size') + size)
+            if any(file_count < 0 for file_count, _ in deltas.values()):
+                cls.objects.filter(
+                    dataset_id=dataset_id, path__in=list(deltas),
+                    file_count__lte=0).delete()
+
+    @classmethod
+    def rebuild_index(cls, dataset_id):
+        """
+        Rebuilds the index for a dataset from its DataFiles
+        """
+        from .datafile import DataFile
+        changes = DataFile.objects.filter(dataset_id=dataset_id) \
+            .order_by().values_list('directory') \
+            .annotate(file_count=models.Count('id'),
+                      size=models.Sum('size'))
+        with transaction.atomic():
+            cls.objects.filter(dataset_id=dataset_id).delete()
+            cls.update_index(dataset_id, changes)
@@ -86,12 +86,6 @@ class Experiment(models.Model):
     class Meta:
         app_label = 'tardis_portal'
 
-    # pylint: disable=W0222
-    def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-        from .hooks import publish_public_expt_rifcs
-        publish_public_expt_rifcs(self)
-
     def is_publication(self):
         return self.experimentparameterset_set.filter(
             schema__namespace__startswith=getattr(
@@ -180,8 +174,22 @@ class Experiment(models.Model):
             .filter(IMAGE_FILTER)
 
     def get_size(self):
-        from .datafile import DataFile
-        return DataFile.sum_sizes(self.get_datafiles())
+        return self.datasets.aggregate(
+            size=models.Sum('size'))['size'] or 0
+
+    def get_aggregates(self):
+        '''
+        Returns the number of datasets in this experiment, and the file
+        counts and sizes of the datasets, summed from the datasets'
+        aggregates rather than from their DataFiles
+        '''
+        totals = self.datasets.aggregate(
+            dataset_count=models.Count('id'),
+            file_count=models.Sum('file_count'),
+            size=models.Sum('size'),
+            verified_file_count=models.Sum('verified_file_count'),
+            verified_size=models.Sum('verified_size'))
+        return {key: value or 0 for key, value in totals.items()}
 
     @classmethod
     def public_access_implies_distribution(cls, public_access_level):
@@ -202,19 +210,42 @@ class Experiment(models.Model):
     def get_ct(self):
         return ContentType.objects.get_for_model(self)
 
+    @classmethod
+    def prefetch_owners_and_groups(cls, experiments):
+        '''
+        Resolves the owners and groups of many experiments with a constant
+        number of queries (see ExperimentManager.owners_and_groups), so that
+        get_owners and get_groups don't query the database for each of them.
+        The results are discarded when an ObjectACL is saved or deleted in
+        this process.
+        '''
+        from ..auth.acl_cache import get_generation
+        generation = get_generation()
+        experiments = [experiment for experiment in experiments
+                       if experiment.id is not None]
+        owners, groups = cls.safe.owners_and_groups(
+            experiment.id for experiment in experiments)
+        for experiment in experiments:
+            experiment._owners_and_groups = (
+                generation,
+                owners.get(experiment.id, []), groups.get(experiment.id, []))
+
+    def _get_owners_and_groups(self):
+        from ..auth.acl_cache import get_generation
+        cached = getattr(self, '_owners_and_groups', None)
+        if cached is None or cached[0] != get_generation():
+            Experiment.prefetch_owners_and_groups([self])
+        return self._owners_and_groups[1:]
+
     def get_owners(self):
-        acls = ObjectACL.objects.filter(pluginId='django_user',
-                                        content_type=self.get_ct(),
-                                        object_id=self.id,
-                                        isOwner=True)
-        return [acl.get_related_object() for acl in acls]
+        if self.id is None:
+            return []
+        return list(self._get_owners_and_groups()[0])
 
     def get_groups(self):
-        acls = ObjectACL.objects.filter(pluginId='django_group',
-                                        content_type=self.get_ct(),
-                                        object_id=self.id,
-                                        canRead=True)
-        return [acl.get_related_object() for acl in acls]
+        if self.id is None:
+            return []
+        return list(self._get_owners_and_groups()[1])
 
     def _has_view_perm(self, user_obj):
         '''
@@ -279,15 +310,6 @@ class ExperimentAuthor(models.Model):
         blank=True, null=True,
         help_text="URL identifier for the author")
 
-    # pylint: disable=W0222
-    def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-        try:
-            from .hooks import publish_public_expt_rifcs
-            publish_public_expt_rifcs(self.experiment)
-        except Exception:
-            logger.exception('')
-
     def __str__(self):
         return SafeText(self.author) + ' | ' \
             + SafeText(self.experiment.id) + ' | ' \
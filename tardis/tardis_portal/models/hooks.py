@@ -1,9 +1,14 @@
 import logging
 
 from django.conf import settings
-from django.db.models.signals import post_save, post_delete
+from django.contrib.auth.models import Group, User
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, m2m_changed
 from django.dispatch import receiver
 
+from .access_control import ObjectACL
+from .dataset import Dataset
 from .experiment import Experiment, ExperimentAuthor
 from .parameters import ExperimentParameter, ExperimentParameterSet
 
@@ -11,29 +16,33 @@ logger = logging.getLogger(__name__)
 
 
 # ## RIF-CS hooks ## #
-def publish_public_expt_rifcs(experiment):
-    try:
-        providers = settings.RIFCS_PROVIDERS
-    except:
-        providers = None
-    from ..publish.publishservice import PublishService
-    pservice = PublishService(providers, experiment)
-    try:
-        pservice.manage_rifcs(settings.OAI_DOCS_PATH)
-    except:
-        logger.error('RIF-CS publish hook failed for experiment %d.'
-                     % experiment.id)
+def queue_rifcs_publication(experiment_id):
+    '''
+    Queues the publication of an experiment's RIF-CS document once the
+    current transaction commits.  Publication is delayed by
+    RIFCS_PUBLISH_DELAY seconds, and changes to the same experiment in the
+    meantime are published along with it, instead of rendering the same
+    document for each change.
+    '''
+    def queue_publication():
+        from ..tasks import publish_rifcs, rifcs_publish_key
+        delay = getattr(settings, 'RIFCS_PUBLISH_DELAY', 0)
+        expiry = delay + getattr(settings, 'RIFCS_PUBLISH_LOCK_EXPIRE', 600)
+        # Only the first change in the window queues a task:
+        if caches['celery-locks'].add(
+                rifcs_publish_key(experiment_id), True, expiry):
+            publish_rifcs.apply_async(
+                args=[experiment_id], countdown=delay,
+                priority=settings.DEFAULT_TASK_PRIORITY)
+
+    transaction.on_commit(queue_publication)
 
 
 @receiver(post_save, sender=ExperimentAuthor)
 @receiver(post_delete, sender=ExperimentAuthor)
 def post_save_experimentauthor(sender, **kwargs):
     experimentauthor = kwargs['instance']
-    try:
-        publish_public_expt_rifcs(experimentauthor.experiment)
-    except Experiment.DoesNotExist:
-        # If for some reason the experiment is missing, then ignore update
-        pass
+    queue_rifcs_publication(experimentauthor.experiment_id)
 
 
 @receiver(post_save, sender=ExperimentParameter)
@@ -41,7 +50,7 @@ def post_save_experimentauthor(sender, **kwargs):
 def post_save_experiment_parameter(sender, **kwargs):
     experiment_param = kwargs['instance']
     try:
-        publish_public_expt_rifcs(experiment_param.parameterset.experiment)
+        queue_rifcs_publication(experiment_param.parameterset.experiment_id)
     except ExperimentParameterSet.DoesNotExist:
         # If for some reason the experiment parameter set is missing,
         # then ignore update
@@ -52,4 +61,52 @@ def post_save_experiment_parameter(sender, **kwargs):
 @receiver(post_delete, sender=Experiment)
 def post_save_experiment(sender, **kwargs):
     experiment = kwargs['instance']
-    publish_public_expt_rifcs(experiment)
+    queue_rifcs_publication(experiment.id)
+
+
+# ## Dataset aggregate hooks ## #
+def queue_dataset_aggregates_update(dataset_id):
+    '''
+    Queues the recalculation of a dataset's verified file count and size
+    once the current transaction commits.  The recalculation is delayed by
+    DATASET_AGGREGATES_UPDATE_DELAY seconds, and changes to the dataset's
+    files in the meantime are counted along with it.
+    '''
+    def queue_update():
+        from ..tasks import update_dataset_aggregates, dataset_aggregates_key
+        delay = getattr(settings, 'DATASET_AGGREGATES_UPDATE_DELAY', 0)
+        expiry = delay + getattr(
+            settings, 'DATASET_AGGREGATES_LOCK_EXPIRE', 600)
+        # Only the first change in the window queues a task:
+        if caches['celery-locks'].add(
+                dataset_aggregates_key(dataset_id), True, expiry):
+            update_dataset_aggregates.apply_async(
+                args=[dataset_id], countdown=delay,
+                priority=settings.DEFAULT_TASK_PRIORITY)
+
+    transaction.on_commit(queue_update)
+
+
+# ## ACL cache hooks ## #
+@receiver(post_save, sender=ObjectACL, dispatch_uid='acl_cache_objectacl_save')
+@receiver(post_delete, sender=ObjectACL,
+          dispatch_uid='acl_cache_objectacl_delete')
+@receiver(m2m_changed, sender=User.groups.through,
+          dispatch_uid='acl_cache_user_groups')
+@receiver(post_delete, sender=Group, dispatch_uid='acl_cache_group_delete')
+def post_save_objectacl(sender, **kwargs):
+    from ..auth.acl_cache import invalidate_acl_cache
+    invalidate_acl_cache()
+
+
+@receiver(post_save, sender=Experiment,
+          dispatch_uid='acl_cache_experiment_save')
+@receiver(post_delete, sender=Experiment,
+          dispatch_uid='acl_cache_experiment_delete')
+@receiver(m2m_changed, sender=Dataset.experiments.through,
+          dispatch_uid='acl_cache_dataset_experiments')
+def post_save_experiment_datasets(sender, **kwargs):
+    # Dataset and datafile access checks cached with the user's ACLs
+    # depend on experiments' public access and the datasets they contain
+    from ..auth.acl_cache import invalidate_acl_cache
+    invalidate_acl_cache(shared=False)
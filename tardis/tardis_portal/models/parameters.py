@@ -480,15 +480,6 @@ class ExperimentParameter(Parameter):
         'ExperimentParameterSet', on_delete=models.CASCADE)
     parameter_type = 'Experiment'
 
-    # pylint: disable=W0222
-    def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-        try:
-            from .hooks import publish_public_expt_rifcs
-            publish_public_expt_rifcs(self.parameterset.experiment)
-        except Exception:
-            logger.exception('')
-
 
 class InstrumentParameter(Parameter):
     parameterset = models.ForeignKey(
@@ -3,10 +3,15 @@ import os
 import logging
 import pickle
 import random
+import threading
 
 from django.conf import settings
+from django.core.signals import setting_changed
 from django.db import models
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
 from django.db.utils import DatabaseError
+from django.dispatch import receiver
 import django.core.files.storage as django_storage
 
 #from celery.contrib.methods import task
@@ -14,6 +19,11 @@ import django.core.files.storage as django_storage
 
 logger = logging.getLogger(__name__)
 
+# Initialised storage backends, keyed by storage box ID, options version and
+# storage class.  See StorageBox.get_initialised_storage_instance.
+_storage_instances = {}
+_storage_instances_lock = threading.Lock()
+
 
 class StorageBox(models.Model):
     '''
@@ -21,6 +31,9 @@ class StorageBox(models.Model):
     to extend to new types, add fields if necessary
 
     :attribute max_size: max size in bytes
+    :attribute options_version: incremented whenever the box's options are
+        saved or deleted, so initialised storage backends can be reused
+        until then
     '''
 
     django_storage_class = models.TextField(
@@ -33,6 +46,7 @@ class StorageBox(models.Model):
     master_box = models.ForeignKey('self', null=True, blank=True,
                                    related_name='child_boxes',
                                    on_delete=models.CASCADE)
+    options_version = models.PositiveIntegerField(default=0, editable=False)
 
     # state values for different types of storage:
     DISK = 1
@@ -72,8 +86,29 @@ class StorageBox(models.Model):
     def __str__(self):
         return self.name or "anonymous Storage Box"
 
+    # pylint: disable=W0222
+    def save(self, *args, **kwargs):
+        if not self._state.adding and not args and \
+                kwargs.get('update_fields') is None and \
+                not kwargs.get('force_insert'):
+            # The options version is maintained in the database, so it
+            # mustn't be overwritten by an instance loaded before the
+            # options changed
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and
+                field.name != 'options_version']
+        super().save(*args, **kwargs)
+
     @property
     def storage_type(self):
+        if 'attributes' in getattr(self, '_prefetched_objects_cache', {}):
+            # Use attributes fetched with prefetch_related('attributes')
+            for attribute in self.attributes.all():
+                if attribute.key == 'type':
+                    return StorageBox.TYPES.get(
+                        attribute.value, StorageBox.TYPE_UNKNOWN)
+            return StorageBox.TYPE_UNKNOWN
         try:
             storage_type = self.attributes.get(key='type').value
             return StorageBox.TYPES.get(
@@ -112,6 +147,29 @@ class StorageBox(models.Model):
         return opts_dict
 
     def get_initialised_storage_instance(self):
+        """
+        Get the box's storage backend, initialised with the box's options
+
+        Backends are shared by everything in the process which uses the
+        box, until the box's options change, so their setup (and any
+        connection pools, e.g. for object stores) is reused rather than
+        repeated for every DataFileObject.
+
+        :return: the storage backend
+        :rtype: django.core.files.storage.Storage
+        """
+        if self.id is None:
+            return self._create_storage_instance()
+        key = (self.id, self.options_version, self.django_storage_class)
+        storage = _storage_instances.get(key)
+        if storage is None:
+            storage = self._create_storage_instance()
+            with _storage_instances_lock:
+                forget_storage_instances(self.id, lock=False)
+                storage = _storage_instances.setdefault(key, storage)
+        return storage
+
+    def _create_storage_instance(self):
         storage_class = django_storage.get_storage_class(
             self.django_storage_class)
         return storage_class(**self.get_options_as_dict())
@@ -298,3 +356,45 @@ class StorageBoxAttribute(models.Model):
 
     class Meta:
         app_label = 'tardis_portal'
+
+
+def forget_storage_instances(storage_box_id=None, lock=True):
+    """
+    Remove initialised storage backends from this process's registry, so
+    they are recreated from the database when they are next used
+
+    :param int storage_box_id: the storage box whose backends to remove,
+        default: all storage boxes
+    :param bool lock: whether to acquire the registry's lock
+    """
+    if lock:
+        with _storage_instances_lock:
+            forget_storage_instances(storage_box_id, lock=False)
+        return
+    for key in list(_storage_instances):
+        if storage_box_id is None or key[0] == storage_box_id:
+            del _storage_instances[key]
+
+
+@receiver(post_save, sender=StorageBoxOption,
+          dispatch_uid='storage_box_option_changed')
+@receiver(post_delete, sender=StorageBoxOption,
+          dispatch_uid='storage_box_option_changed')
+def storage_box_option_changed(sender, instance, **kwargs):
+    # Other processes notice the new version when they next load the box
+    StorageBox.objects.filter(id=instance.storage_box_id).update(
+        options_version=F('options_version') + 1)
+    forget_storage_instances(instance.storage_box_id)
+
+
+@receiver(post_save, sender=StorageBox, dispatch_uid='storage_box_changed')
+@receiver(post_delete, sender=StorageBox, dispatch_uid='storage_box_changed')
+def storage_box_changed(sender, instance, **kwargs):
+    forget_storage_instances(instance.id)
+
+
+@receiver(setting_changed, dispatch_uid='storage_setting_changed')
+def storage_setting_changed(**kwargs):
+    # Storage backends may be initialised from settings, e.g.
+    # DEFAULT_STORAGE_BASE_DIR, which tests override
+    forget_storage_instances()
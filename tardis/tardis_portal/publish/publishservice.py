@@ -1,4 +1,69 @@
 import os
+import threading
+
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+# Provider instances, keyed by the tuple of RIFCS_PROVIDERS they were
+# created from, so they aren't imported and created for each experiment
+_providers = {}
+_providers_lock = threading.Lock()
+
+
+@receiver(setting_changed, dispatch_uid='rifcs_providers_setting_changed')
+def forget_providers(setting, **kwargs):
+    if setting == 'RIFCS_PROVIDERS':
+        with _providers_lock:
+            _providers.clear()
+
+
+def get_providers(provider_names):
+    key = tuple(provider_names or ())
+    with _providers_lock:
+        providers = _providers.get(key)
+        if providers is None:
+            providers = [_create_provider(name) for name in key]
+            _providers[key] = providers
+    return providers
+
+
+def _create_provider(pmodule):
+    from importlib import import_module
+    # Import the module
+    try:
+        module_name, klass_name = pmodule.rsplit('.', 1)
+        module = import_module(module_name)
+    except ImportError as e:
+        # TODO Show appropriate error msg
+        raise e
+
+    # Create the Instance
+    try:
+        provider_class = getattr(module, klass_name)
+        return provider_class()
+    except AttributeError as e:
+        # TODO Show appropriate error msg
+        raise e
+
+
+def publish_experiment_rifcs(experiment_id, oaipath, providers=None):
+    '''
+    Writes or removes the RIF-CS document of an experiment, removing it if
+    the experiment has been deleted
+    '''
+    from ..models import Experiment
+    try:
+        experiment = Experiment.objects.get(id=experiment_id)
+    except Experiment.DoesNotExist:
+        _remove_rifcs_file(oaipath, experiment_id)
+        return
+    PublishService(providers, experiment).manage_rifcs(oaipath)
+
+
+def _remove_rifcs_file(oaipath, experiment_id):
+    filename = os.path.join(oaipath, "MyTARDIS-%s.xml" % experiment_id)
+    if os.path.exists(filename):
+        os.remove(filename)
 
 
 class PublishService():
@@ -10,28 +75,10 @@ class PublishService():
 
     def _get_provider(self):
         from .provider.rifcsprovider import RifCsProvider
-        if self.rc_providers:
-            from importlib import import_module
-            for pmodule in self.rc_providers:
-                # Import the module
-                try:
-                    module_name, klass_name = pmodule.rsplit('.', 1)
-                    module = import_module(module_name)
-                except ImportError as e:
-                    # TODO Show appropriate error msg
-                    raise e
-
-                # Create the Instance
-                try:
-                    provider_class = getattr(module, klass_name)
-                    provider = provider_class()
-                except AttributeError as e:
-                    # TODO Show appropriate error msg
-                    raise e
-
-                # Retrieve the provider that can deal with the experiment
-                if provider and provider.is_schema_valid(self.experiment):
-                    return provider
+        for provider in get_providers(self.rc_providers):
+            # Retrieve the provider that can deal with the experiment
+            if provider and provider.is_schema_valid(self.experiment):
+                return provider
         # Can't find a matching provider, return a default one
         return RifCsProvider()
 
@@ -45,9 +92,7 @@ class PublishService():
             self._remove_rifcs_from_oai_dir(oaipath)
 
     def _remove_rifcs_from_oai_dir(self, oaipath):
-        filename = os.path.join(oaipath, "MyTARDIS-%s.xml" % self.experiment.id)
-        if os.path.exists(filename):
-            os.remove(filename)
+        _remove_rifcs_file(oaipath, self.experiment.id)
 
     def _write_rifcs_to_oai_dir(self, oaipath):
         from ..xmlwriter import XMLWriter
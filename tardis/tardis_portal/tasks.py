@@ -1,10 +1,14 @@
 import logging
+import time
 
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.sites.models import Site
+from django.core.cache import caches
 from django.db import transaction
 from django.db.models import Q
+from django.utils import timezone
 
 from tardis.celery import tardis_app
 from .email import email_user
@@ -55,13 +59,113 @@ def cleanup_dfos(**kwargs):
 
 @tardis_app.task(name="tardis_portal.verify_dfos", ignore_result=True)
 def verify_dfos(**kwargs):
-    from .models import DataFileObject
-    dfos_to_verify = DataFileObject.objects.filter(verified=False)
+    """
+    Queue verification of all unverified DataFileObjects.
+
+    Unless VERIFY_DFOS_BATCH_SIZE is 1 or less, the DataFileObjects are
+    verified in batches grouped by storage box (see dfo_verify_batch),
+    rather than with one dfo_verify task per DataFileObject.
+    """
+    from .models import DataFileObject, StorageBox
     kwargs['transaction_lock'] = kwargs.get('transaction_lock', True)
-    for dfo in dfos_to_verify:
-        kwargs['priority'] = dfo.priority
-        kwargs['shadow'] = 'dfo_verify location:%s' % dfo.storage_box.name
-        dfo_verify.apply_async(args=[dfo.id], **kwargs)
+    batch_size = getattr(settings, 'VERIFY_DFOS_BATCH_SIZE', 100)
+    unverified_box_ids = DataFileObject.objects.filter(verified=False) \
+        .order_by().values_list('storage_box', flat=True).distinct()
+    for box in StorageBox.objects.filter(id__in=unverified_box_ids):
+        if batch_size > 1:
+            queue_dfo_verify_batches(box, batch_size, **kwargs)
+            continue
+        kwargs['priority'] = box.priority
+        kwargs['shadow'] = 'dfo_verify location:%s' % box.name
+        dfo_ids = DataFileObject.objects.filter(
+            storage_box=box, verified=False).values_list('id', flat=True)
+        for dfo_id in dfo_ids.iterator():
+            dfo_verify.apply_async(args=[dfo_id], **kwargs)
+
+
+def _verify_batches_key(box_id):
+    return 'verify-dfos-batches-%s' % box_id
+
+
+def _verify_cursor_key(box_id):
+    return 'verify-dfos-cursor-%s' % box_id
+
+
+def queue_dfo_verify_batches(box, batch_size, **kwargs):
+    """
+    Queue dfo_verify_batch tasks for a storage box's unverified
+    DataFileObjects.
+
+    The DataFileObjects are scanned in ID order without loading them all
+    at once.  At most VERIFY_DFOS_MAX_BATCHES_PER_BOX batches are in
+    progress for each storage box at any one time.  While batches are in
+    progress, subsequent calls continue from the last DataFileObject
+    queued, instead of queuing the same DataFileObjects again.
+    """
+    from .models import DataFileObject
+    cache = caches['celery-locks']
+    max_batches = getattr(settings, 'VERIFY_DFOS_MAX_BATCHES_PER_BOX', 10)
+    expiry = getattr(settings, 'VERIFY_DFOS_LOCK_EXPIRE', 60 * 60)
+    batches_key = _verify_batches_key(box.id)
+    cursor_key = _verify_cursor_key(box.id)
+
+    last_id = 0
+    if cache.get(batches_key, 0):
+        last_id = cache.get(cursor_key, 0)
+    task_kwargs = {'transaction_lock': kwargs.pop('transaction_lock', False),
+                   'counted': True}
+    kwargs['priority'] = box.priority
+    kwargs['shadow'] = 'dfo_verify_batch location:%s' % box.name
+    unverified = DataFileObject.objects.filter(
+        storage_box=box, verified=False).order_by('id')
+    while cache.get(batches_key, 0) < max_batches:
+        dfo_ids = list(unverified.filter(id__gt=last_id)
+                       .values_list('id', flat=True)[:batch_size])
+        if not dfo_ids:
+            break
+        last_id = dfo_ids[-1]
+        cache.add(batches_key, 0, expiry)
+        cache.incr(batches_key)
+        cache.set(cursor_key, last_id, expiry)
+        dfo_verify_batch.apply_async(
+            args=[dfo_ids, box.id], kwargs=task_kwargs, **kwargs)
+
+
+def rifcs_publish_key(experiment_id):
+    return 'rifcs-publish-%s' % experiment_id
+
+
+@tardis_app.task(name='tardis_portal.publish_rifcs', ignore_result=True)
+def publish_rifcs(experiment_id):
+    '''
+    Writes or removes the RIF-CS document of an experiment in OAI_DOCS_PATH
+    '''
+    from .publish.publishservice import publish_experiment_rifcs
+    # Changes from now on need publishing again:
+    caches['celery-locks'].delete(rifcs_publish_key(experiment_id))
+    try:
+        publish_experiment_rifcs(
+            experiment_id, settings.OAI_DOCS_PATH,
+            getattr(settings, 'RIFCS_PROVIDERS', None))
+    except Exception:
+        logger.exception('RIF-CS publish failed for experiment %s.',
+                         experiment_id)
+
+
+def dataset_aggregates_key(dataset_id):
+    return 'dataset-aggregates-%s' % dataset_id
+
+
+@tardis_app.task(name='tardis_portal.update_dataset_aggregates',
+                 ignore_result=True)
+def update_dataset_aggregates(dataset_id):
+    '''
+    Recalculates the file counts and sizes of a dataset
+    '''
+    from .models import Dataset
+    # Changes from now on need counting again:
+    caches['celery-locks'].delete(dataset_aggregates_key(dataset_id))
+    Dataset.update_aggregates(dataset_id)
 
 
 @tardis_app.task(name='tardis_portal.ingest_received_files', ignore_result=True)
@@ -229,6 +333,110 @@ def dfo_verify(dfo_id, *args, **kwargs):
     return False
 
 
+def _post_verify_batch(dfos):
+    for dfo in dfos:
+        try:
+            dfo.post_verify()
+        except Exception:
+            logger.exception('Failed to process verified DFO ID %s', dfo.id)
+
+
+def _verify_locked(dfo, **kwargs):
+    """
+    Verifies a DataFileObject while holding a lock on its row, like
+    dfo_verify with transaction_lock.  Returns None without verifying it
+    if it is already being verified elsewhere or has been verified since.
+    """
+    from .models import DataFileObject
+    with transaction.atomic():
+        if not list(DataFileObject.objects.filter(id=dfo.id, verified=False)
+                    .select_for_update(skip_locked=True)
+                    .values_list('id', flat=True)):
+            return None
+        return dfo.verify(save=False, **kwargs)
+
+
+@tardis_app.task(name="tardis_portal.dfo.verify_batch", ignore_result=True)
+def dfo_verify_batch(dfo_ids, storage_box_id, **kwargs):
+    """
+    Verify a batch of unverified DataFileObjects from one storage box.
+
+    The storage backend is initialised once for the whole batch, and the
+    verified flags and verification times are saved with one update per
+    outcome, rather than one save per DataFileObject.  Files are read
+    outside of any transaction, except that with ``transaction_lock``
+    each DataFileObject is locked (in its own transaction) while it is
+    verified, so that a failure only affects that DataFileObject.
+
+    Batches queued by queue_dfo_verify_batches are ``counted`` in the
+    storage box's count of batches in progress, which is decremented when
+    the batch finishes.  Batches queued elsewhere (e.g. by bulk
+    registration) are not.
+    """
+    from .models import DataFileObject, StorageBox
+    from .models.hooks import queue_dataset_aggregates_update
+    start = time.time()
+    transaction_lock = kwargs.pop('transaction_lock', False)
+    counted = kwargs.pop('counted', False)
+    verified_ids = []
+    failed_ids = []
+    checked = []
+    dataset_ids = set()
+    try:
+        box = StorageBox.objects.get(id=storage_box_id)
+        storage = box.get_initialised_storage_instance()
+        unverified = DataFileObject.objects.filter(
+            id__in=dfo_ids, storage_box=box, verified=False) \
+            .select_related('datafile')
+        for dfo in unverified:
+            dfo.storage_box = box
+            dfo._cached_storage = storage  # pylint: disable=W0212
+            try:
+                if transaction_lock:
+                    result = _verify_locked(dfo, **kwargs)
+                    if result is None:
+                        continue
+                else:
+                    result = dfo.verify(save=False, **kwargs)
+            except Exception:
+                logger.exception('Failed to verify DFO ID %s', dfo.id)
+                result = False
+            if result:
+                verified_ids.append(dfo.id)
+                dataset_ids.add(dfo.datafile.dataset_id)
+            else:
+                failed_ids.append(dfo.id)
+            checked.append(dfo)
+        now = timezone.now()
+        with transaction.atomic():
+            DataFileObject.objects.filter(id__in=verified_ids).update(
+                verified=True, last_verified_time=now)
+            DataFileObject.objects.filter(id__in=failed_ids).update(
+                verified=False, last_verified_time=now)
+            # Filters run in other processes, so they are only applied
+            # once the results have been committed:
+            transaction.on_commit(lambda: _post_verify_batch(checked))
+            # The updates bypass the DataFileObjects' post_save signals:
+            for dataset_id in dataset_ids:
+                queue_dataset_aggregates_update(dataset_id)
+    finally:
+        if counted:
+            try:
+                caches['celery-locks'].decr(
+                    _verify_batches_key(storage_box_id))
+            except ValueError:
+                # The batch counter has expired
+                pass
+    elapsed = time.time() - start
+    verify_count = len(verified_ids) + len(failed_ids)
+    logger.info(
+        'Worker %s verified %d DFOs (%d failed) from storage box %s '
+        'in %.2fs (%.1f DFOs/s)',
+        dfo_verify_batch.request.hostname, verify_count, len(failed_ids),
+        storage_box_id, elapsed, verify_count / elapsed if elapsed else 0)
+    return len(verified_ids)
+
+
 @tardis_app.task(name='tardis_portal.clear_sessions', ignore_result=True)
 def clear_sessions(**kwargs):
     """Clean up expired sessions using Django management command."""
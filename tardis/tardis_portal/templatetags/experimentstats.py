@@ -1,14 +1,17 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 from django import template
-from ..models.datafile import DataFile
+from django.db.models import Sum
+
+from ..models.dataset import Dataset
 
 register = template.Library()
 
 
 @register.filter
 def experiment_file_count(value):
-    return DataFile.objects.filter(dataset__experiments__pk=value).count()
+    return Dataset.objects.filter(experiments__pk=value).aggregate(
+        file_count=Sum('file_count'))['file_count'] or 0
 
 # @register.filter
 # def experiment_file_size(value):....
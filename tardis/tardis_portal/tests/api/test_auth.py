@@ -5,13 +5,86 @@ MyTardis REST API
 .. moduleauthor:: Grischa Meyer <grischa@gmail.com>
 .. moduleauthor:: James Wettenhall <james.wettenhall@monash.edu>
 '''
-from django.test import TestCase
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import RequestFactory, TestCase
+from django.test.utils import CaptureQueriesContext
 
+from tastypie.bundle import Bundle
+
+from ...api import ACLAuthorization
+from ...auth.localdb_auth import django_user
+from ...models.access_control import ObjectACL
+from ...models.dataset import Dataset
+from ...models.experiment import Experiment
+from ...models.parameters import (
+    DatasetParameter, DatasetParameterSet, ParameterName, Schema)
 from . import MyTardisResourceTestCase
 
 
 class ACLAuthorizationTest(TestCase):
-    pass
+    def setUp(self):
+        self.user = User.objects.create_user('reader', '', 'secret')
+        self.shared_exp = Experiment.objects.create(
+            title='shared', created_by=self.user)
+        ObjectACL.objects.create(
+            content_object=self.shared_exp,
+            pluginId=django_user,
+            entityId=str(self.user.id),
+            canRead=True,
+            aclOwnershipType=ObjectACL.OWNER_OWNED)
+        self.public_exp = Experiment.objects.create(
+            title='public', created_by=self.user,
+            public_access=Experiment.PUBLIC_ACCESS_METADATA)
+        self.private_exp = Experiment.objects.create(
+            title='private', created_by=self.user)
+        self.schema = Schema.objects.create(
+            namespace='http://example.com/ds', type=Schema.DATASET)
+        self.param_name = ParameterName.objects.create(
+            schema=self.schema, name='value',
+            data_type=ParameterName.NUMERIC)
+        self.authorization = ACLAuthorization()
+
+    def _create_datasets(self, count):
+        for i in range(count):
+            dataset = Dataset.objects.create(description='ds %d' % i)
+            dataset.experiments.add(
+                (self.shared_exp, self.public_exp, self.private_exp)[i % 3])
+            parameterset = DatasetParameterSet.objects.create(
+                schema=self.schema, dataset=dataset)
+            DatasetParameter.objects.create(
+                parameterset=parameterset, name=self.param_name,
+                numerical_value=i)
+
+    def _read_list(self, model):
+        request = RequestFactory().get('/')
+        request.user = User.objects.get(id=self.user.id)
+        bundle = Bundle(obj=model(), request=request)
+        with CaptureQueriesContext(connection) as queries:
+            readable = set(self.authorization.read_list(
+                model.objects.all(), bundle).values_list('id', flat=True))
+        return readable, len(queries)
+
+    def test_read_list_query_count(self):
+        for model in (Dataset, DatasetParameterSet, DatasetParameter):
+            self._create_datasets(3)
+            readable, small_query_count = self._read_list(model)
+            self.assertEqual(len(readable), 2 * model.objects.count() // 3)
+
+            self._create_datasets(30)
+            readable, large_query_count = self._read_list(model)
+            self.assertEqual(len(readable), 2 * model.objects.count() // 3)
+            self.assertEqual(large_query_count, small_query_count)
+
+            Dataset.objects.all().delete()
+
+    def test_read_list_excludes_inaccessible(self):
+        self._create_datasets(3)
+        readable, _ = self._read_list(Dataset)
+        self.assertEqual(
+            readable,
+            set(Dataset.objects.exclude(
+                experiments=self.private_exp).values_list('id', flat=True)))
 
 
 class MyTardisAuthenticationTest(MyTardisResourceTestCase):
@@ -14,7 +14,7 @@ from django.test.client import Client
 import magic
 
 from ...models.datafile import DataFile, DataFileObject
-from ...models.dataset import Dataset
+from ...models.dataset import Dataset, DatasetDirectory
 from ...models.parameters import ParameterName
 from ...models.parameters import Schema
 
@@ -115,6 +115,52 @@ class DataFileResourceTest(MyTardisResourceTestCase):
             % new_datafile.id)
         self.assertHttpOK(response)
 
+    def test_bulk_register(self):
+        ds_uri = "/api/v1/dataset/%d/" % self.testds.id
+        records = [{
+            "dataset": ds_uri,
+            "directory": "run1" if i % 2 else None,
+            "filename": "bulk%d.txt" % i,
+            "md5sum": "930e419034038dfad994f0d2e602146c",
+            "size": "8",
+            "replicas": [{"url": "bulk%d.txt" % i, "location": "local"}]
+        } for i in range(5)]
+        records.append({"dataset": ds_uri, "filename": "testfile.txt",
+                        "md5sum": "bogus", "size": 42})
+        records.append({"dataset": ds_uri, "filename": "bulk0.txt",
+                        "md5sum": "bogus", "size": 42})
+        records.append({"dataset": ds_uri, "filename": "nosize.txt",
+                        "md5sum": "bogus"})
+        records.append({"dataset": ds_uri, "filename": "staged.txt",
+                        "md5sum": "bogus", "size": 1})
+        datafile_count = DataFile.objects.count()
+        dfo_count = DataFileObject.objects.count()
+        response = self.django_client.post(
+            '/api/v1/dataset_file/bulk/',
+            "\n".join(json.dumps(record) for record in records),
+            content_type='application/x-ndjson')
+        self.assertHttpOK(response)
+        data = json.loads(response.content)
+        self.assertEqual(data['meta'],
+                         {'total': 9, 'created': 6, 'failed': 3})
+        self.assertEqual([result['status'] for result in data['objects']],
+                         [201] * 5 + [409, 409, 400, 201])
+        self.assertEqual(datafile_count + 6, DataFile.objects.count())
+        self.assertEqual(dfo_count + 6, DataFileObject.objects.count())
+        new_file = DataFile.objects.get(id=data['objects'][1]['id'])
+        self.assertEqual(new_file.directory, "run1")
+        self.assertEqual(new_file.mimetype, "text/plain")
+        self.assertEqual(data['objects'][1]['resource_uri'],
+                         "/api/v1/dataset_file/%d/" % new_file.id)
+        staged = DataFileObject.objects.get(
+            datafile_id=data['objects'][8]['id'])
+        self.assertEqual(data['objects'][8]['temp_url'],
+                         staged.get_full_path())
+        self.assertEqual(
+            DatasetDirectory.objects.values_list(
+                'path', 'file_count', 'size').get(dataset=self.testds),
+            ('run1', 2, 16))
+
     def test_shared_fs_single_file(self):
         pass
 
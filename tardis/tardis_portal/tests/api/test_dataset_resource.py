@@ -9,10 +9,14 @@ import json
 
 from urllib.parse import quote
 
-from ...models.datafile import DataFile
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from ...models.datafile import DataFile, DataFileObject
 from ...models.dataset import Dataset
 from ...models.experiment import Experiment
 from ...models.instrument import Instrument
+from ...models.storage import StorageBox
 
 from . import MyTardisResourceTestCase
 
@@ -348,3 +352,39 @@ class DatasetResourceTest(MyTardisResourceTestCase):
         self.assertEqual(
             sorted(returned_data, key=lambda x: x['name']),
             sorted(expected_data, key=lambda x: x['name']))
+
+    def test_dir_nodes_query_count(self):
+        box = StorageBox.get_default_storage()
+        dataset = Dataset.objects.create(description='test dataset')
+        dataset.experiments.add(self.testexp)
+
+        def add_files(count):
+            for directory in ('', 'subdir'):
+                for _ in range(count):
+                    datafile = DataFile.objects.create(
+                        dataset=dataset, directory=directory,
+                        filename='file%d' % DataFile.objects.count(),
+                        size=0, md5sum='bogus')
+                    DataFileObject.objects.filter(
+                        id=DataFileObject.objects.create(
+                            datafile=datafile, storage_box=box,
+                            uri=datafile.filename).id).update(verified=True)
+
+        def count_queries(uri):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.api_client.get(
+                    uri, authentication=self.get_credentials())
+            self.assertHttpOK(response)
+            return len(queries)
+
+        root_uri = '/api/v1/dataset/%d/root-dir-nodes/' % dataset.id
+        child_uri = '/api/v1/dataset/%d/child-dir-nodes/?dir_path=subdir' \
+            % dataset.id
+        add_files(2)
+        # The first request also populates the content types cache
+        count_queries(root_uri)
+        root_queries = count_queries(root_uri)
+        child_queries = count_queries(child_uri)
+        add_files(20)
+        self.assertEqual(count_queries(root_uri), root_queries)
+        self.assertEqual(count_queries(child_uri), child_queries)
@@ -6,10 +6,14 @@ test_dataset.py
 .. moduleauthor::  James Wettenhall <james.wettenhall@monash.edu>
 
 """
+from unittest.mock import patch
+
 from django.contrib.auth.models import Group
+from django.core.management import call_command
 
 from tardis.tardis_portal.models import (
-    Dataset, DataFile, Experiment, Facility, Instrument)
+    Dataset, DatasetDirectory, DataFile, DataFileObject, Experiment,
+    Facility, Instrument)
 
 from . import ModelTestCase
 
@@ -153,3 +157,204 @@ class DatasetTestCase(ModelTestCase):
         self.assertEqual(
             dataset.get_dir_tuples('dir2/subdir2'),
             [('..', 'dir2/subdir2')])
+
+    def _get_index(self, dataset):
+        return {
+            directory.path: (directory.file_count, directory.size)
+            for directory in DatasetDirectory.objects.filter(dataset=dataset)}
+
+    def test_directory_index(self):
+        dataset = Dataset.objects.create(description='test dataset1')
+        DataFile.objects.create(
+            dataset=dataset, filename='filename1', size=1, md5sum='bogus')
+        df2 = DataFile.objects.create(
+            dataset=dataset, filename='filename2', size=2, md5sum='bogus',
+            directory='dir1/subdir1')
+        DataFile.objects.create(
+            dataset=dataset, filename='filename3', size=4, md5sum='bogus',
+            directory='dir1/subdir2')
+        self.assertEqual(
+            self._get_index(dataset),
+            {'dir1': (2, 6), 'dir1/subdir1': (1, 2), 'dir1/subdir2': (1, 4)})
+
+        # Moving and resizing a file updates the old and new directories
+        df2 = DataFile.objects.get(id=df2.id)
+        df2.directory = 'dir2'
+        df2.size = 8
+        df2.save()
+        self.assertEqual(
+            self._get_index(dataset),
+            {'dir1': (1, 4), 'dir1/subdir2': (1, 4), 'dir2': (1, 8)})
+        self.assertEqual(
+            dataset.get_dir_tuples(''), [('dir1', 'dir1'), ('dir2', 'dir2')])
+
+        # Moving a file to another dataset
+        dataset2 = Dataset.objects.create(description='test dataset2')
+        df2.dataset = dataset2
+        df2.save()
+        self.assertEqual(
+            self._get_index(dataset),
+            {'dir1': (1, 4), 'dir1/subdir2': (1, 4)})
+        self.assertEqual(self._get_index(dataset2), {'dir2': (1, 8)})
+
+        df2.delete()
+        self.assertEqual(self._get_index(dataset2), {})
+
+        self.assertEqual(
+            set(DatasetDirectory.get_subtree_paths('dir1/', dataset.id)
+                .values_list('path', flat=True)),
+            {'dir1', 'dir1/subdir2'})
+
+    def test_delete_dataset(self):
+        dataset = Dataset.objects.create(description='test dataset1')
+        for i in range(3):
+            DataFile.objects.create(
+                dataset=dataset, filename='filename%d' % i, size=1,
+                md5sum='bogus', directory='dir1')
+
+        # The files aren't removed from the index and aggregates one by one
+        with patch.object(DatasetDirectory, 'update_index') as update_index, \
+                patch.object(Dataset, 'add_to_aggregates') as add_to_aggregates:
+            dataset.delete()
+        update_index.assert_not_called()
+        add_to_aggregates.assert_not_called()
+        self.assertFalse(DatasetDirectory.objects.exists())
+        self.assertFalse(DataFile.objects.exists())
+
+    def test_unnormalized_directories(self):
+        dataset = Dataset.objects.create(description='test dataset1')
+        df1 = DataFile.objects.create(
+            dataset=dataset, filename='filename1', size=1, md5sum='bogus',
+            directory='sub/')
+        df2 = DataFile.objects.create(
+            dataset=dataset, filename='filename2', size=2, md5sum='bogus',
+            directory='/sub//subdir1')
+        self.assertEqual(DataFile.objects.get(id=df1.id).directory, 'sub')
+        self.assertEqual(
+            DataFile.objects.get(id=df2.id).directory, 'sub/subdir1')
+        self.assertEqual(
+            set(DataFile.objects.filter(
+                dataset=dataset,
+                directory__in=DatasetDirectory.get_subtree_paths(
+                    'sub/', dataset.id)).values_list('id', flat=True)),
+            {df1.id, df2.id})
+
+    def test_rebuild_directory_index(self):
+        dataset = Dataset.objects.create(description='test dataset1')
+        DataFile.objects.create(
+            dataset=dataset, filename='filename1', size=1, md5sum='bogus',
+            directory='dir1/subdir1')
+        DataFile.objects.create(
+            dataset=dataset, filename='filename2', size=2, md5sum='bogus',
+            directory='dir1')
+        expected = {'dir1': (2, 3), 'dir1/subdir1': (1, 1)}
+        self.assertEqual(self._get_index(dataset), expected)
+
+        # Bulk updates bypass DataFile.save, so the index must be rebuilt
+        DataFile.objects.filter(dataset=dataset).update(directory='dir2')
+        call_command('rebuilddirectoryindex', dataset.id, verbosity=0)
+        self.assertEqual(self._get_index(dataset), {'dir2': (2, 3)})
+
+    def _get_aggregates(self, dataset):
+        return Dataset.objects.filter(id=dataset.id).values_list(
+            *Dataset.AGGREGATE_FIELDS).get()
+
+    def test_aggregates(self):
+        dataset = Dataset.objects.create(description='test dataset1')
+        loaded = Dataset.objects.get(id=dataset.id)
+        DataFile.objects.create(
+            dataset=dataset, filename='filename1', size=1, md5sum='bogus')
+        df2 = DataFile.objects.create(
+            dataset=dataset, filename='filename2', size=2, md5sum='bogus',
+            directory='dir1')
+        self.assertEqual(self._get_aggregates(dataset), (2, 3, 0, 0))
+
+        # Saving an instance loaded before the files were added keeps the
+        # aggregates
+        loaded.description = 'renamed dataset1'
+        loaded.save()
+        self.assertEqual(self._get_aggregates(dataset), (2, 3, 0, 0))
+
+        df2 = DataFile.objects.get(id=df2.id)
+        df2.size = 8
+        df2.save()
+        self.assertEqual(self._get_aggregates(dataset), (2, 9, 0, 0))
+
+        dataset2 = Dataset.objects.create(description='test dataset2')
+        df2.dataset = dataset2
+        df2.save()
+        self.assertEqual(self._get_aggregates(dataset), (1, 1, 0, 0))
+        self.assertEqual(self._get_aggregates(dataset2), (1, 8, 0, 0))
+
+        exp = Experiment.objects.create(title='test exp1',
+                                        created_by=self.user)
+        dataset.experiments.add(exp)
+        dataset2.experiments.add(exp)
+        self.assertEqual(exp.get_size(), 9)
+        self.assertEqual(
+            exp.get_aggregates(),
+            {'dataset_count': 2, 'file_count': 2, 'size': 9,
+             'verified_file_count': 0, 'verified_size': 0})
+
+        df2.delete()
+        self.assertEqual(self._get_aggregates(dataset2), (0, 0, 0, 0))
+
+    def test_verified_aggregates(self):
+        from ...tasks import update_dataset_aggregates
+        dataset = Dataset.objects.create(description='test dataset1')
+        df1 = DataFile.objects.create(
+            dataset=dataset, filename='filename1', size=1, md5sum='bogus')
+        df2 = DataFile.objects.create(
+            dataset=dataset, filename='filename2', size=2, md5sum='bogus')
+        box = df1.get_default_storage_box()
+        # bulk_create doesn't queue verification
+        dfo1, dfo2 = DataFileObject.objects.bulk_create([
+            DataFileObject(datafile=df1, storage_box=box, uri='filename1'),
+            DataFileObject(datafile=df2, storage_box=box, uri='filename2')])
+
+        with patch.object(update_dataset_aggregates,
+                          'apply_async') as apply_async:
+            with self.captureOnCommitCallbacks(execute=True):
+                for dfo in (dfo1, dfo2):
+                    dfo.verified = True
+                    dfo.save(update_fields=['verified'])
+            apply_async.assert_called_once()
+            self.assertEqual(apply_async.call_args[1]['args'], [dataset.id])
+
+        update_dataset_aggregates(dataset.id)
+        self.assertEqual(self._get_aggregates(dataset), (2, 3, 2, 3))
+
+        # A file is only verified if all of its replicas are
+        DataFileObject.objects.create(
+            datafile=df2, storage_box=box, uri='filename2.copy')
+        update_dataset_aggregates(dataset.id)
+        self.assertEqual(self._get_aggregates(dataset), (2, 3, 1, 1))
+
+        # Deleting a file queues one update, not one per replica
+        with patch.object(update_dataset_aggregates,
+                          'apply_async') as apply_async:
+            with self.captureOnCommitCallbacks(execute=True):
+                DataFile.objects.get(id=df2.id).delete()
+            apply_async.assert_called_once()
+        update_dataset_aggregates(dataset.id)
+
+        # Deleting the dataset leaves nothing to update
+        with patch.object(update_dataset_aggregates,
+                          'apply_async') as apply_async:
+            with self.captureOnCommitCallbacks(execute=True):
+                dataset.delete()
+            apply_async.assert_not_called()
+
+    def test_reconcile_aggregates(self):
+        dataset = Dataset.objects.create(description='test dataset1')
+        DataFile.objects.create(
+            dataset=dataset, filename='filename1', size=1, md5sum='bogus')
+        DataFile.objects.create(
+            dataset=dataset, filename='filename2', size=2, md5sum='bogus')
+
+        # Bulk updates bypass DataFile.save, so the aggregates drift
+        DataFile.objects.filter(dataset=dataset).update(size=4)
+        self.assertEqual(self._get_aggregates(dataset), (2, 3, 0, 0))
+        call_command('reconcileaggregates', dataset.id, verbosity=0)
+        self.assertEqual(self._get_aggregates(dataset), (2, 8, 0, 0))
+        self.assertFalse(Dataset.update_aggregates(dataset.id))
@@ -9,8 +9,9 @@ test_experiment.py
 import os
 
 from django.conf import settings
+from django.contrib.auth.models import Group, User
 
-from tardis.tardis_portal.models import Experiment
+from tardis.tardis_portal.models import Experiment, ObjectACL
 from . import ModelTestCase
 
 
@@ -35,3 +36,48 @@ class ExperimentTestCase(ModelTestCase):
             exp.get_absolute_url() + ' != /experiment/view/%d/' % target_id)
         self.assertEqual(exp.get_or_create_directory(),
                          os.path.join(settings.FILE_STORE_PATH, str(exp.id)))
+
+    def test_owners_and_groups(self):
+        group = Group.objects.create(name='test group')
+        other_user = User.objects.create_user('tardis_user2', '', 'secret')
+        experiments = []
+        for i in range(3):
+            exp = Experiment(title='test exp%d' % i, created_by=self.user)
+            exp.save()
+            for entity, plugin in ((self.user, 'django_user'),
+                                   (other_user, 'django_user'),
+                                   (group, 'django_group')):
+                ObjectACL(content_object=exp,
+                          pluginId=plugin,
+                          entityId=str(entity.id),
+                          canRead=True,
+                          isOwner=plugin == 'django_user',
+                          aclOwnershipType=ObjectACL.OWNER_OWNED).save()
+            experiments.append(exp)
+        # A reader who isn't an owner
+        ObjectACL(content_object=experiments[0],
+                  pluginId='django_user',
+                  entityId=str(User.objects.create_user(
+                      'tardis_user3', '', 'secret').id),
+                  canRead=True,
+                  aclOwnershipType=ObjectACL.OWNER_OWNED).save()
+
+        experiments = list(Experiment.objects.filter(
+            id__in=[exp.id for exp in experiments]).order_by('id'))
+        # The ObjectACLs, Users and Groups, however many experiments
+        with self.assertNumQueries(3):
+            Experiment.prefetch_owners_and_groups(experiments)
+        with self.assertNumQueries(0):
+            for exp in experiments:
+                self.assertEqual(exp.get_owners(), [self.user, other_user])
+                self.assertEqual(exp.get_groups(), [group])
+
+        exp = Experiment.objects.get(id=experiments[0].id)
+        self.assertEqual(exp.get_owners(), [self.user, other_user])
+        self.assertEqual(exp.get_groups(), [group])
+        self.assertEqual(Experiment(title='unsaved').get_owners(), [])
+
+        # Changing the experiment's ACLs discards the cached owners
+        ObjectACL.objects.filter(
+            object_id=exp.id, entityId=str(other_user.id)).get().delete()
+        self.assertEqual(exp.get_owners(), [self.user])
@@ -0,0 +1,149 @@
+"""
+test_acl_cache.py
+
+Tests for the set-based ACL resolution in tardis_portal/auth/acl_cache.py
+"""
+from django.contrib.auth.models import Group, User
+from django.test import RequestFactory, TestCase
+from django.test.utils import override_settings
+
+from ..auth.acl_cache import get_user_acls
+from ..auth.decorators import (
+    has_datafile_download_access, has_dataset_access,
+    has_dataset_download_access, has_experiment_download_access)
+from ..auth.localdb_auth import django_group, django_user
+from ..models import DataFile, Dataset, Experiment, ObjectACL
+
+
+class ACLCacheTestCase(TestCase):
+
+    def setUp(self):
+        self.owner = User.objects.create_user('owner', '', 'secret')
+        self.user = User.objects.create_user('reader', '', 'secret')
+        self.experiments = []
+        for i in range(5):
+            experiment = Experiment.objects.create(
+                title='Experiment %d' % i, created_by=self.owner)
+            ObjectACL.objects.create(
+                content_object=experiment,
+                pluginId=django_user,
+                entityId=str(self.owner.id),
+                isOwner=True,
+                aclOwnershipType=ObjectACL.OWNER_OWNED)
+            self.experiments.append(experiment)
+        self.dataset = Dataset.objects.create(description='dataset')
+        self.dataset.experiments.add(self.experiments[0])
+        self.datafiles = [
+            DataFile.objects.create(
+                dataset=self.dataset, filename='file%d.txt' % i,
+                size=1, md5sum='bogus')
+            for i in range(10)]
+
+    def _request(self, user):
+        request = RequestFactory().get('/')
+        request.user = user
+        return request
+
+    def _share(self, experiment, user, **kwargs):
+        return ObjectACL.objects.create(
+            content_object=experiment,
+            pluginId=django_user,
+            entityId=str(user.id),
+            aclOwnershipType=ObjectACL.OWNER_OWNED,
+            **kwargs)
+
+    def test_has_perm_resolves_acls_once(self):
+        owner = User.objects.get(id=self.owner.id)
+        # The user's profile, groups and ACLs are each fetched once
+        with self.assertNumQueries(3):
+            for experiment in self.experiments:
+                self.assertTrue(owner.has_perm(
+                    'tardis_acls.view_experiment', experiment))
+                self.assertTrue(owner.has_perm(
+                    'tardis_acls.owns_experiment', experiment))
+        user = User.objects.get(id=self.user.id)
+        self.assertFalse(any(
+            user.has_perm('tardis_acls.view_experiment', experiment)
+            for experiment in self.experiments))
+
+    def test_download_checks_per_dataset(self):
+        request = self._request(User.objects.get(id=self.owner.id))
+        self.assertTrue(has_datafile_download_access(
+            request, self.datafiles[0].id))
+        # Only the datafile's dataset ID is looked up for further files
+        with self.assertNumQueries(len(self.datafiles) - 1):
+            for datafile in self.datafiles[1:]:
+                self.assertTrue(has_datafile_download_access(
+                    request, datafile.id))
+        request = self._request(User.objects.get(id=self.user.id))
+        self.assertFalse(has_dataset_download_access(
+            request, self.dataset.id))
+        self.assertFalse(has_experiment_download_access(
+            request, self.experiments[0].id))
+
+    def test_acl_changes_invalidate(self):
+        user = User.objects.get(id=self.user.id)
+        request = self._request(user)
+        self.assertFalse(has_dataset_access(request, self.dataset.id))
+
+        acl = self._share(self.experiments[0], self.user, canRead=True)
+        self.assertTrue(has_dataset_access(request, self.dataset.id))
+        self.assertTrue(has_dataset_download_access(request, self.dataset.id))
+        self.assertFalse(user.has_perm(
+            'tardis_acls.change_experiment', self.experiments[0]))
+
+        acl.delete()
+        self.assertFalse(has_dataset_access(request, self.dataset.id))
+
+    def test_public_access_invalidates(self):
+        request = self._request(User.objects.get(id=self.user.id))
+        self.assertFalse(has_dataset_download_access(
+            request, self.dataset.id))
+        self.experiments[0].public_access = Experiment.PUBLIC_ACCESS_FULL
+        self.experiments[0].save()
+        self.assertTrue(has_dataset_download_access(
+            request, self.dataset.id))
+
+    def test_group_membership_invalidates(self):
+        group = Group.objects.create(name='readers')
+        ObjectACL.objects.create(
+            content_object=self.experiments[1],
+            pluginId=django_group,
+            entityId=str(group.id),
+            canRead=True,
+            aclOwnershipType=ObjectACL.OWNER_OWNED)
+        user = User.objects.get(id=self.user.id)
+        user_acls = get_user_acls(user)
+        self.assertFalse(user.has_perm(
+            'tardis_acls.view_experiment', self.experiments[1]))
+
+        user.groups.add(group)
+        self.assertIsNot(get_user_acls(user), user_acls)
+
+    def test_missing_objects(self):
+        request = self._request(User.objects.get(id=self.owner.id))
+        with self.assertRaises(Dataset.DoesNotExist):
+            has_dataset_access(request, self.dataset.id + 1)
+        with self.assertRaises(Dataset.DoesNotExist):
+            has_datafile_download_access(request, self.datafiles[-1].id + 1)
+
+    @override_settings(ACL_CACHE_TTL=60)
+    def test_cross_request_cache(self):
+        self.assertTrue(User.objects.get(id=self.owner.id).has_perm(
+            'tardis_acls.owns_experiment', self.experiments[0]))
+
+        # A new user object (i.e. a new request) reuses the cached ACLs,
+        # only looking up the generation counter and the ACLs in the cache
+        owner = User.objects.get(id=self.owner.id)
+        with self.assertNumQueries(2):
+            self.assertTrue(owner.has_perm(
+                'tardis_acls.owns_experiment', self.experiments[1]))
+
+        self._share(self.experiments[2], self.user, canRead=True)
+        user = User.objects.get(id=self.user.id)
+        self.assertTrue(user.has_perm(
+            'tardis_acls.view_experiment', self.experiments[2]))
+        ObjectACL.objects.filter(entityId=str(self.user.id)).delete()
+        user = User.objects.get(id=self.user.id)
+        self.assertFalse(user.has_perm(
+            'tardis_acls.view_experiment', self.experiments[2]))
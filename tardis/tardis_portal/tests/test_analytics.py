@@ -0,0 +1,76 @@
+"""
+test_analytics.py
+
+Tests for the background delivery of analytics hits in tardis/analytics
+"""
+import json
+import os
+import threading
+from tempfile import mkdtemp
+from unittest.mock import MagicMock, patch
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from tardis.analytics import ga
+from tardis.analytics.dispatcher import Dispatcher
+
+
+class BlockingSink(object):
+    sent = []
+    release = threading.Event()
+
+    def send(self, hits):
+        BlockingSink.release.wait(5)
+        BlockingSink.sent.extend(hits)
+
+
+class AnalyticsTestCase(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('testuser', '', 'secret')
+
+    def test_file_sink(self):
+        path = os.path.join(mkdtemp(), 'analytics.log')
+        dispatcher = Dispatcher()
+        with override_settings(
+                ANALYTICS_SINK='tardis.analytics.dispatcher.FileSink',
+                ANALYTICS_FILE=path), \
+                patch.object(ga, 'GA_ID', 'UA-TEST'), \
+                patch.object(ga, 'dispatcher', dispatcher):
+            ga.track_download('dataset', session_id='abc', ip='127.0.0.1',
+                              user=self.user, total_size=100, num_files=2)
+            dispatcher.flush(5)
+        with open(path) as log_file:
+            hits = [json.loads(line) for line in log_file]
+        self.assertEqual(len(hits), 1)
+        self.assertEqual(hits[0]['tid'], 'UA-TEST')
+        self.assertEqual(hits[0]['ea'], 'download')
+        self.assertEqual(hits[0]['cm1'], 2)
+
+    @override_settings(
+        ANALYTICS_SINK='%s.BlockingSink' % __name__,
+        ANALYTICS_QUEUE_SIZE=2, ANALYTICS_BATCH_SIZE=1)
+    def test_drop_on_overflow(self):
+        dispatcher = Dispatcher()
+        # The sink blocks on the first hit, so only two more can be queued:
+        queued = [dispatcher.put({'n': n}) for n in range(10)]
+        self.assertGreaterEqual(queued.count(False), 7)
+        self.assertEqual(dispatcher.dropped, queued.count(False))
+        BlockingSink.release.set()
+        dispatcher.flush(5)
+        self.assertEqual(len(BlockingSink.sent), queued.count(True))
+
+    def test_google_analytics_batches(self):
+        sink = ga.GoogleAnalyticsSink()
+        sink.session = MagicMock()
+        sink.send([{'t': 'event', 'ea': 'download', '_queued': 0}] * 25)
+        self.assertEqual(sink.session.post.call_count, 2)
+        url, = sink.session.post.call_args_list[0][0]
+        kwargs = sink.session.post.call_args_list[0][1]
+        self.assertEqual(url, ga.GA_BATCH_URL)
+        self.assertEqual(kwargs['timeout'], 5)
+        lines = kwargs['data'].split('\n')
+        self.assertEqual(len(lines), 20)
+        self.assertTrue(lines[0].startswith('t=event&ea=download&qt='))
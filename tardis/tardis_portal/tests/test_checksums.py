@@ -0,0 +1,89 @@
+"""
+test_checksums.py
+
+Tests for the checksum calculation engine in tardis_portal/checksums.py
+"""
+import hashlib
+import os
+from io import BytesIO, StringIO
+from tempfile import NamedTemporaryFile
+
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.test import TestCase
+
+from ..checksums import compute_checksums, compute_checksums_from_path
+from ..models import Dataset, DataFile
+
+
+class ChecksumsTestCase(TestCase):
+
+    def setUp(self):
+        # Several chunks plus a partial chunk with buffer_size=1000:
+        self.data = os.urandom(4500)
+        self.expected = {
+            'md5sum': hashlib.md5(self.data).hexdigest(),
+            'sha512sum': hashlib.sha512(self.data).hexdigest()
+        }
+
+    def test_compute_checksums(self):
+        file_object = BytesIO(self.data)
+        file_object.read(10)
+        checksums = compute_checksums(
+            file_object, compute_md5=True, compute_sha512=True,
+            close_file=False, buffer_size=1000)
+        self.assertEqual(checksums, self.expected)
+        self.assertEqual(file_object.tell(), 0)
+
+        checksums = compute_checksums(
+            file_object, compute_md5=False, compute_sha512=True,
+            buffer_size=1000)
+        self.assertEqual(checksums,
+                         {'sha512sum': self.expected['sha512sum']})
+        self.assertTrue(file_object.closed)
+
+    def test_compute_checksums_without_readinto(self):
+        class ReadOnlyFile:
+            def __init__(self, data):
+                self._file = BytesIO(data)
+                self.read = self._file.read
+                self.seek = self._file.seek
+                self.close = self._file.close
+
+        checksums = compute_checksums(
+            ReadOnlyFile(self.data), compute_md5=True, compute_sha512=True,
+            buffer_size=1000)
+        self.assertEqual(checksums, self.expected)
+
+    def test_compute_checksums_from_path(self):
+        with NamedTemporaryFile() as temp_file:
+            temp_file.write(self.data)
+            temp_file.flush()
+            checksums = compute_checksums_from_path(
+                temp_file.name, compute_md5=True, compute_sha512=True,
+                buffer_size=1000)
+        self.assertEqual(checksums, self.expected)
+
+    def test_compute_checksums_from_empty_path(self):
+        with NamedTemporaryFile() as temp_file:
+            checksums = compute_checksums_from_path(temp_file.name)
+        self.assertEqual(checksums,
+                         {'md5sum': hashlib.md5(b'').hexdigest()})
+
+    def test_benchmark_command(self):
+        dataset = Dataset.objects.create(description='benchmark dataset')
+        datafile = DataFile.objects.create(
+            dataset=dataset, filename='benchmark_testfile',
+            size=len(self.data), md5sum=self.expected['md5sum'])
+        datafile.file_object = ContentFile(self.data, datafile.filename)
+        dfo = datafile.file_objects.get()
+        self.assertTrue(dfo.verified)
+
+        stdout = StringIO()
+        call_command('benchmarkchecksums', sample=1, stdout=stdout)
+        storage_class = dfo.storage_box.django_storage_class
+        self.assertIn('%s: ' % storage_class, stdout.getvalue())
+        self.assertIn('(1 files, 0.0 MB, 0 errors)', stdout.getvalue())
+        # The DataFileObject is left as it was
+        dfo.refresh_from_db()
+        self.assertTrue(dfo.verified)
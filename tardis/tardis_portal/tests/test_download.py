@@ -354,6 +354,47 @@ class DownloadTestCase(TestCase):
                     for ds in self.experiment2.datasets.all()]),
             simpleNames=True, noTxt=True)
 
+    def testDownloadRange(self):
+        client = Client()
+        url = '/download/datafile/%i/' % self.datafile1.id
+
+        response = client.get(url)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['ETag'],
+                         '"%s"' % self.datafile1.sha512sum)
+        etag = response['ETag']
+        response.close()
+
+        response = client.get(url, HTTP_RANGE='bytes=6-10')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 6-10/13')
+        self.assertEqual(b''.join(response.streaming_content), b'World')
+
+        # Resume the download
+        response = client.get(url, HTTP_RANGE='bytes=6-',
+                              HTTP_IF_RANGE=etag)
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Length'], '7')
+        self.assertEqual(b''.join(response.streaming_content), b'World!\n')
+        response.close()
+
+        response = client.get(url, HTTP_RANGE='bytes=0-4,-2')
+        self.assertEqual(response.status_code, 206)
+        self.assertTrue(response['Content-Type'].startswith(
+            'multipart/byteranges; boundary='))
+        content = b''.join(response.streaming_content)
+        self.assertEqual(len(content), int(response['Content-Length']))
+        self.assertIn(b'Content-Range: bytes 0-4/13\r\n\r\nHello\r\n',
+                      content)
+        self.assertIn(b'Content-Range: bytes 11-12/13\r\n\r\n!\n\r\n',
+                      content)
+
+        response = client.get(url, HTTP_RANGE='bytes=13-')
+        self.assertEqual(response.status_code, 416)
+
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
     def testDatasetFile(self):
         # check registered text file for physical file meta information
         df = DataFile.objects.get(pk=self.datafile1.id)  # skipping test # noqa # pylint: disable=W0101
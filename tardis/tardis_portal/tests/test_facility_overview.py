@@ -11,6 +11,7 @@ from django.contrib.auth.models import Group
 from django.test import RequestFactory
 from django.test import TestCase
 
+from ..models.access_control import ObjectACL
 from ..models.datafile import DataFile
 from ..models.datafile import DataFileObject
 from ..models.dataset import Dataset
@@ -104,3 +105,35 @@ class FacilityOverviewTestCase(TestCase):
         self.assertEqual(
             [dataset['description'] for dataset in dataset_list],
             [self.dataset.description])
+
+    def test_facility_overview_experiments_keyset(self):
+        ObjectACL.objects.create(
+            content_object=self.exp, pluginId='django_user',
+            entityId=str(self.user.id), isOwner=True, canRead=True,
+            aclOwnershipType=ObjectACL.OWNER_OWNED)
+        ObjectACL.objects.create(
+            content_object=self.exp, pluginId='django_group',
+            entityId=str(self.group.id), canRead=True,
+            aclOwnershipType=ObjectACL.OWNER_OWNED)
+        datasets = [self.dataset]
+        for i in range(2, 5):
+            dataset = Dataset.objects.create(
+                description='test dataset%d' % i, instrument=self.instrument)
+            dataset.experiments.add(self.exp)
+            datasets.append(dataset)
+
+        factory = RequestFactory()
+        request = factory.get(
+            '/facility/fetch_data/%s/2/4/' % self.facility.id,
+            {'before': datasets[2].id})
+        request.user = self.user
+        response = facility_overview_experiments(
+            request, self.facility.id, 2, 4)
+        dataset_list = json.loads(response.content.decode())
+        self.assertEqual([dataset['id'] for dataset in dataset_list],
+                         [datasets[1].id, datasets[0].id])
+        self.assertEqual(dataset_list[0]['owner'], self.user.username)
+        self.assertEqual(dataset_list[0]['group'], self.group.name)
+        self.assertEqual(dataset_list[1]['parent_experiment']['id'],
+                         self.exp.id)
+        self.assertEqual(dataset_list[1]['datafile_count'], 3)
@@ -1,11 +1,14 @@
 import os
+from unittest.mock import patch
 
-from django.test import TestCase
+from django.core.management import call_command
+from django.test import TestCase, override_settings
 from django.conf import settings
 
-from ..models import User, Experiment
+from ..models import User, Experiment, ExperimentAuthor
 from ..publish.provider.rifcsprovider import RifCsProvider
-from ..publish.publishservice import PublishService
+from ..publish.publishservice import PublishService, get_providers
+from ..tasks import publish_rifcs
 
 BEAMLINE_VALUE = "myBeamline"
 LICENSE_URL_VALUE = "http://some.uri.com"
@@ -105,3 +108,63 @@ class PublishServiceTestCase(TestCase):
         self.e1.public_access = Experiment.PUBLIC_ACCESS_NONE
         service.manage_rifcs(settings.OAI_DOCS_PATH)
         self.assertFalse(os.path.exists(rifcs_file))
+
+    def testProvidersAreCached(self):
+        service1 = PublishService(self.settings, self.e1)
+        service2 = PublishService(self.settings, self.e1)
+        self.assertIs(service1.provider, service2.provider)
+        self.assertIs(get_providers(list(self.settings))[0], service1.provider)
+
+
+@override_settings(
+    RIFCS_PROVIDERS=(
+        'tardis.tardis_portal.tests.test_publishservice.MockRifCsProvider',),
+    RIFCS_PUBLISH_DELAY=10)
+class PublishRifCsTaskTestCase(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='TestUser',
+                                             email='user@test.com',
+                                             password='secret')
+        self.experiment = Experiment.objects.create(
+            title="Experiment 1", created_by=self.user,
+            public_access=Experiment.PUBLIC_ACCESS_FULL)
+        self.rifcs_file = os.path.join(
+            settings.OAI_DOCS_PATH, "MyTARDIS-%s.xml" % self.experiment.id)
+
+    def tearDown(self):
+        if os.path.exists(self.rifcs_file):
+            os.remove(self.rifcs_file)
+
+    def testChangesArePublishedOnce(self):
+        with patch.object(publish_rifcs, 'apply_async') as apply_async:
+            with self.captureOnCommitCallbacks(execute=True) as callbacks:
+                self.experiment.save()
+                for i in range(5):
+                    ExperimentAuthor.objects.create(
+                        experiment=self.experiment, author="Author %d" % i,
+                        order=i)
+            self.assertEqual(len(callbacks), 6)
+            apply_async.assert_called_once()
+            self.assertEqual(apply_async.call_args[1]['args'],
+                             [self.experiment.id])
+            self.assertEqual(apply_async.call_args[1]['countdown'], 10)
+
+            # Changes after the task has started are published again:
+            publish_rifcs(self.experiment.id)
+            with self.captureOnCommitCallbacks(execute=True):
+                self.experiment.save()
+            self.assertEqual(apply_async.call_count, 2)
+
+    def testPublishAndRemove(self):
+        experiment_id = self.experiment.id
+        publish_rifcs(experiment_id)
+        self.assertTrue(os.path.exists(self.rifcs_file))
+
+        self.experiment.delete()
+        publish_rifcs(experiment_id)
+        self.assertFalse(os.path.exists(self.rifcs_file))
+
+    def testRebuildCommand(self):
+        call_command('rebuildrifcs', verbosity=0)
+        self.assertTrue(os.path.exists(self.rifcs_file))
@@ -40,6 +40,31 @@ class ModelTestCase(TestCase):
         self.assertEqual(options_dict['an_option'], string_input)
         self.assertEqual(options_dict['optional'], object_input)
 
+    def test_initialised_storage_instance(self):
+        location_option = StorageBoxOption(storage_box=self.test_box,
+                                           key='location',
+                                           value='/tmp/first')
+        location_option.save()
+        box = StorageBox.objects.get(id=self.test_box.id)
+        storage = box.get_initialised_storage_instance()
+        self.assertEqual(storage.location, '/tmp/first')
+        # The backend is shared until the box's options change
+        self.assertIs(
+            StorageBox.objects.get(id=self.test_box.id)
+            .get_initialised_storage_instance(), storage)
+        location_option.value = '/tmp/second'
+        location_option.save()
+        # Saving an instance loaded before the options changed keeps the
+        # new version
+        box.description = 'renamed box'
+        box.save()
+        box = StorageBox.objects.get(id=self.test_box.id)
+        self.assertEqual(box.options_version, 2)
+        self.assertEqual(box.description, 'renamed box')
+        new_storage = box.get_initialised_storage_instance()
+        self.assertIsNot(new_storage, storage)
+        self.assertEqual(new_storage.location, '/tmp/second')
+
     def test_get_receiving_box(self):
         dataset = Dataset(description="dataset description")
         dataset.save()
@@ -3,6 +3,8 @@ import os
 
 from tarfile import TarFile
 from tempfile import NamedTemporaryFile
+from unittest.mock import PropertyMock, patch
+from zipfile import ZipFile
 
 from io import BytesIO
 from urllib.parse import quote
@@ -10,8 +12,10 @@ from urllib.parse import quote
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.urls import reverse
-from django.test import Client, TestCase
+from django.test import Client, SimpleTestCase, TestCase, override_settings
 
+from ..download import GzipStreamCompressor, parse_range_header
+from ..models.datafile import DataFile, DataFileObject
 from ..models.experiment import Experiment
 
 
@@ -34,6 +38,7 @@ class TarDownloadTestCase(TestCase):
 
         datafile_content = b"\n".join([b'some data %d' % i
                                        for i in range(1000)])
+        self.datafile_content = datafile_content
         filesize = len(datafile_content)
         md5sum = hashlib.md5(datafile_content).hexdigest()
         # create test datafiles and datafile objects
@@ -91,3 +96,111 @@ class TarDownloadTestCase(TestCase):
                         self.assertEqual(
                             os.stat(os.path.join('/tmp', full_path)).st_size,
                             int(df.size))
+
+    def _get_archive_contents(self, comptype):
+        response = self.client.get(reverse(
+            'tardis.tardis_portal.download.streaming_download_experiment',
+            args=(self.exp.id, comptype)))
+        self.assertEqual(response.status_code, 200)
+        content = BytesIO(b''.join(response.streaming_content))
+        if comptype == 'zip':
+            self.assertTrue(
+                response['Content-Disposition'].endswith('.zip"'))
+            with ZipFile(content) as zf:
+                return {name: zf.read(name) for name in zf.namelist()}
+        mode = 'r:gz' if comptype == 'tgz' else 'r:'
+        with TarFile.open(fileobj=content, mode=mode) as tf:
+            return {member.name: tf.extractfile(member).read()
+                    for member in tf.getmembers()}
+
+    def _check_archive(self, comptype):
+        contents = self._get_archive_contents(comptype)
+        self.assertEqual(len(contents), len(self.dfs))
+        for name, content in contents.items():
+            self.assertEqual(content, self.datafile_content, name)
+        return contents
+
+    def test_tgz_experiment_download(self):
+        self._check_archive('tgz')
+
+    @override_settings(DOWNLOAD_ARCHIVE_GZIP_THREADS=4)
+    @patch.object(GzipStreamCompressor, 'BLOCK_SIZE', 16384)
+    def test_parallel_tgz_experiment_download(self):
+        self._check_archive('tgz')
+
+    def test_zip_experiment_download(self):
+        self._check_archive('zip')
+
+    def test_archive_prefetch_settings(self):
+        with self.settings(DOWNLOAD_ARCHIVE_PREFETCH_FILES=1,
+                           DOWNLOAD_ARCHIVE_PREFETCH_CHUNKS=1):
+            prefetched = self._check_archive('tar')
+        with self.settings(DOWNLOAD_ARCHIVE_PREFETCH_FILES=0):
+            self.assertEqual(self._check_archive('tar'), prefetched)
+
+    def test_tar_range_download(self):
+        url = reverse(
+            'tardis.tardis_portal.download.streaming_download_experiment',
+            args=(self.exp.id, 'tar'))
+        response = self.client.get(url)
+        content = b''.join(response.streaming_content)
+        size = len(content)
+        etag = response['ETag']
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+
+        # Resume in the middle of a file's header, content and padding
+        for start in (700, 2000, size - 6000):
+            response = self.client.get(
+                url, HTTP_RANGE='bytes=%d-' % start, HTTP_IF_RANGE=etag)
+            self.assertEqual(response.status_code, 206)
+            self.assertEqual(response['Content-Range'],
+                             'bytes %d-%d/%d' % (start, size - 1, size))
+            self.assertEqual(int(response['Content-Length']), size - start)
+            self.assertEqual(b''.join(response.streaming_content),
+                             content[start:])
+
+        # The archive has changed since the download started
+        response = self.client.get(
+            url, HTTP_RANGE='bytes=100-', HTTP_IF_RANGE='"outdated"')
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.get(url, HTTP_RANGE='bytes=%d-' % size)
+        self.assertEqual(response.status_code, 416)
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    @patch.object(DataFileObject, 'modified_time', new_callable=PropertyMock,
+                  side_effect=IOError)
+    def test_etag_without_modification_times(self, mock_modified_time):
+        DataFile.objects.filter(dataset=self.ds).update(
+            modification_time=None)
+        url = reverse(
+            'tardis.tardis_portal.download.streaming_download_experiment',
+            args=(self.exp.id, 'tar'))
+        responses = []
+        for now in (1000000000, 1000000100):
+            with patch('time.time', return_value=now):
+                response = self.client.get(url)
+                responses.append((response['ETag'],
+                                  b''.join(response.streaming_content)))
+        self.assertEqual(responses[0], responses[1])
+
+
+class ParseRangeHeaderTestCase(SimpleTestCase):
+
+    def test_parse_range_header(self):
+        self.assertIsNone(parse_range_header(None, 1000))
+        self.assertIsNone(parse_range_header('items=0-1', 1000))
+        self.assertIsNone(parse_range_header('bytes=5-1', 1000))
+        self.assertIsNone(parse_range_header('bytes=a-', 1000))
+        self.assertEqual(parse_range_header('bytes=0-499', 1000),
+                         [(0, 500)])
+        self.assertEqual(parse_range_header('bytes=500-', 1000),
+                         [(500, 1000)])
+        self.assertEqual(parse_range_header('bytes=-100', 1000),
+                         [(900, 1000)])
+        self.assertEqual(parse_range_header('bytes=900-2000, 0-0', 1000),
+                         [(900, 1000), (0, 1)])
+        self.assertEqual(parse_range_header('bytes=1000-', 1000), [])
+        self.assertEqual(parse_range_header('bytes=-0', 1000), [])
@@ -1,12 +1,15 @@
 import hashlib
 from os import urandom
 
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import caches
 from django.core.files.base import ContentFile
-from django.test import TestCase
+from django.test import RequestFactory, TestCase
 
-from ..models import Experiment, Dataset, DataFile, User
+from ..bulk_registration import BulkRegistration
+from ..models import Experiment, Dataset, DataFile, DataFileObject, User
 
-from ..tasks import verify_dfos
+from ..tasks import verify_dfos, _verify_batches_key
 
 
 class BackgroundTaskTestCase(TestCase):
@@ -66,3 +69,71 @@ class BackgroundTaskTestCase(TestCase):
         # verify explicitly to catch Exceptions hidden by celery
         datafile.verify()
         self.assertFalse(datafile.file_objects.get().verified)
+
+    def _create_unverified_datafiles(self, count, bad_md5_count=0):
+        datafiles = []
+        for i in range(count):
+            content = urandom(1024)
+            cf = ContentFile(content, 'batch_testfile_%d' % i)
+            datafile = DataFile(dataset=self.dataset)
+            datafile.filename = cf.name
+            datafile.size = len(content)
+            if i < bad_md5_count:
+                datafile.md5sum = hashlib.md5(b'bad').hexdigest()
+            else:
+                datafile.md5sum = hashlib.md5(content).hexdigest()
+            datafile.save()
+            datafile.file_object = cf
+            datafiles.append(datafile)
+        DataFileObject.objects.filter(datafile__in=datafiles).update(
+            verified=False, last_verified_time=None)
+        return datafiles
+
+    def test_batch_verification(self):
+        datafiles = self._create_unverified_datafiles(5, bad_md5_count=1)
+        with self.settings(VERIFY_DFOS_BATCH_SIZE=2):
+            verify_dfos()
+        dfos = DataFileObject.objects.filter(datafile__in=datafiles)
+        self.assertEqual(dfos.filter(verified=True).count(), 4)
+        self.assertFalse(dfos.filter(last_verified_time=None).exists())
+        box_id = dfos.first().storage_box_id
+        self.assertEqual(
+            caches['celery-locks'].get(_verify_batches_key(box_id)), 0)
+
+    def test_batch_verification_limit(self):
+        datafiles = self._create_unverified_datafiles(2)
+        box_id = datafiles[0].file_objects.get().storage_box_id
+        cache = caches['celery-locks']
+        cache.set(_verify_batches_key(box_id), 1)
+        try:
+            with self.settings(VERIFY_DFOS_BATCH_SIZE=2,
+                               VERIFY_DFOS_MAX_BATCHES_PER_BOX=1):
+                verify_dfos()
+        finally:
+            cache.delete(_verify_batches_key(box_id))
+        self.assertFalse(DataFileObject.objects.filter(
+            datafile__in=datafiles, verified=True).exists())
+
+    def test_bulk_registration_during_batch_verification(self):
+        datafiles = self._create_unverified_datafiles(2)
+        box_id = datafiles[0].file_objects.get().storage_box_id
+        request = RequestFactory().get('/')
+        request.user = AnonymousUser()
+        cache = caches['celery-locks']
+        # A batch queued by verify_dfos is still in progress:
+        cache.set(_verify_batches_key(box_id), 1)
+        try:
+            with self.settings(VERIFY_DFOS_BATCH_SIZE=2):
+                BulkRegistration(request)._queue_verification(datafiles)
+            self.assertEqual(cache.get(_verify_batches_key(box_id)), 1)
+        finally:
+            cache.delete(_verify_batches_key(box_id))
+        self.assertEqual(DataFileObject.objects.filter(
+            datafile__in=datafiles, verified=True).count(), 2)
+
+    def test_unbatched_verification(self):
+        datafiles = self._create_unverified_datafiles(2)
+        with self.settings(VERIFY_DFOS_BATCH_SIZE=1):
+            verify_dfos()
+        self.assertEqual(DataFileObject.objects.filter(
+            datafile__in=datafiles, verified=True).count(), 2)
@@ -19,7 +19,7 @@ from django.test.client import Client
 from django.contrib.auth.models import User, Permission
 
 from ...auth.localdb_auth import django_user
-from ...models import ObjectACL, Experiment, Dataset
+from ...models import ObjectACL, Experiment, Dataset, DataFile
 
 
 class ExperimentTestCase(TestCase):
@@ -248,3 +248,56 @@ class ExperimentTestCase(TestCase):
             # Check it no longer exists
             response = client.get(json_url+str(item['id']))
             self.assertEqual(response.status_code, 404)
+
+    def test_checksums_download(self):
+        experiment = Experiment.objects.create(
+            title='Checksums Experiment', created_by=self.user)
+        ObjectACL.objects.create(
+            pluginId=django_user,
+            entityId=str(self.user.id),
+            content_object=experiment,
+            canRead=True,
+            isOwner=True,
+            aclOwnershipType=ObjectACL.OWNER_OWNED)
+        datasets = []
+        for i in range(2):
+            dataset = Dataset.objects.create(description='dataset %d' % i)
+            dataset.experiments.add(experiment)
+            datasets.append(dataset)
+        DataFile.objects.create(
+            dataset=datasets[0], filename='file1.txt', size=1,
+            md5sum='a' * 32)
+        DataFile.objects.create(
+            dataset=datasets[1], filename='file2.txt', directory='sub%dir',
+            size=1, md5sum='b' * 32)
+
+        client = Client()
+        self.assertTrue(client.login(username=self.username,
+                                     password=self.password))
+        url = reverse('tardis_portal.experiment_checksums',
+                      args=[experiment.id])
+
+        response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertIn('Checksums_Experiment-manifest-md5.txt',
+                      response['Content-Disposition'])
+        self.assertEqual(
+            b''.join(response.streaming_content).decode(),
+            '%s  %s/file1.txt\n%s  %s/sub%%dir/file2.txt\n\n' % (
+                'a' * 32, datasets[0].id, 'b' * 32, datasets[1].id))
+
+        response = client.get(url, {'format': 'bagit'})
+        self.assertIn('filename="manifest-md5.txt"',
+                      response['Content-Disposition'])
+        self.assertEqual(
+            b''.join(response.streaming_content).decode().splitlines()[1],
+            '%s  data/%s/sub%%25dir/file2.txt' % ('b' * 32, datasets[1].id))
+
+        response = client.get(
+            reverse('tardis_portal.dataset_checksums', args=[datasets[0].id]),
+            {'format': 'json'})
+        self.assertEqual(
+            json.loads(b''.join(response.streaming_content)),
+            {'checksums': [{'checksum': 'a' * 32, 'file': 'file1.txt',
+                            'type': 'md5'}]})
@@ -59,8 +59,7 @@ def experiment_description(request, experiment_id):
 
     c['owners'] = experiment.get_owners()
 
-    # calculate the sum of the datafile sizes
-    c['size'] = DataFile.sum_sizes(c['datafiles'])
+    c['size'] = experiment.get_size()
 
     c['has_download_permissions'] = \
         authz.has_experiment_download_access(request, experiment_id)
@@ -282,7 +281,8 @@ def retrieve_datafile_list(
         except ValueError:
             limit = pgresults
         datafile_properties_list = []
-        for datafile in dataset[offset:offset + limit]:
+        for datafile in DataFile.prefetch_online_status(
+                list(dataset[offset:offset + limit])):
             datafile_properties_list.append({
                 'id': datafile.id,
                 'filename': datafile.filename,
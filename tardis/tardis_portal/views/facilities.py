@@ -8,16 +8,13 @@ import logging
 import time
 
 from django.contrib.auth.decorators import login_required
+from django.db.models import OuterRef, Prefetch, Subquery
 from django.http import HttpResponse
 from django.utils import timezone
 from django.views.decorators.cache import never_cache
-from django.db.models import Sum
-from django.db.models import Min
-from django.db.models import Case
-from django.db.models import When
-from django.db.models import IntegerField
 
-from ..models import Dataset, Experiment, DataFile
+from ..models import (
+    Dataset, Experiment, DataFile, DataFileObject)
 from ..models.facility import facilities_managed_by
 
 logger = logging.getLogger(__name__)
@@ -65,45 +62,30 @@ def facility_overview_facilities_list(request):
 
 
 def dataset_aggregate_info(dataset):
-    datafiles_all = DataFile.objects.filter(dataset=dataset)
-    verified_datafiles_count = \
-        DataFile.objects.filter(dataset=dataset) \
-        .values('id') \
-        .annotate(min_verified=Min(Case(When(file_objects__verified=True,
-                                             then=1),
-                                        default=0,
-                                        output_field=IntegerField()))) \
-        .filter(min_verified=1) \
-        .order_by('id').count()
-    verified_datafiles_size = \
-        DataFile.objects.filter(dataset=dataset) \
-        .values('id') \
-        .annotate(min_verified=Min(Case(When(file_objects__verified=True,
-                                             then=1),
-                                        default=0,
-                                        output_field=IntegerField()))) \
-        .filter(min_verified=1) \
-        .order_by('id') \
-        .aggregate(Sum('size'))['size__sum'] or 0
     return {
-        "dataset_size": DataFile.sum_sizes(datafiles_all),
-        "verified_datafiles_count": verified_datafiles_count,
-        "verified_datafiles_size": verified_datafiles_size,
-        "datafile_count": datafiles_all.count()
+        "dataset_size": dataset.size,
+        "verified_datafiles_count": dataset.verified_file_count,
+        "verified_datafiles_size": dataset.verified_size,
+        "datafile_count": dataset.file_count
     }
 
 
 def facility_overview_datafile_list(dataset):
-    datafile_objects = DataFile.objects.filter(dataset=dataset)
+    datafile_objects = DataFile.objects.filter(dataset=dataset) \
+        .prefetch_related(Prefetch(
+            'file_objects',
+            queryset=DataFileObject.objects.select_related(
+                'storage_box').order_by('id')))
     datafiles = []
     for datafile in datafile_objects:
-        if datafile.verified:
+        file_objects = datafile.file_objects.all()
+        if any(dfo.verified for dfo in file_objects):
             verified = "Yes"
         else:
             verified = "No"
             try:
                 file_object_size = getattr(
-                    getattr(datafile.file_objects.first(),
+                    getattr(file_objects[0] if file_objects else None,
                             'file_object', None),
                     'size', 0)
                 if file_object_size < int(datafile.size):
@@ -147,29 +129,53 @@ def facility_overview_experiments(request, facility_id, start_index,
                                   end_index):
     '''
     json facility datasets
+
+    Datasets are listed newest first.  If a "before" dataset ID is given in
+    the query string, the page starts after that dataset (keyset
+    pagination) and start_index and end_index only determine the page
+    size, so later pages are as quick to fetch as the first one.
     '''
     start_index = int(start_index)
     end_index = int(end_index)
     dataset_objects = Dataset.objects.filter(
         instrument__facility__manager_group__user=request.user,
         instrument__facility__id=facility_id
-    ).order_by('-id')[start_index:end_index]
+    ).select_related('instrument__facility').annotate(
+        parent_experiment_id=Subquery(
+            Experiment.objects.filter(datasets=OuterRef('pk'))
+            .order_by('id').values('id')[:1])
+    ).order_by('-id')
+    before = request.GET.get('before')
+    if before:
+        try:
+            dataset_objects = dataset_objects.filter(id__lt=int(before))
+        except ValueError:
+            return HttpResponse(
+                json.dumps({'error': 'Invalid dataset ID: %s' % before}),
+                content_type='application/json', status=400)
+        dataset_objects = dataset_objects[:max(end_index - start_index, 0)]
+    else:
+        dataset_objects = dataset_objects[start_index:end_index]
+    dataset_objects = list(dataset_objects)
+
+    experiment_ids = set(dataset.parent_experiment_id
+                         for dataset in dataset_objects
+                         if dataset.parent_experiment_id is not None)
+    experiments = Experiment.objects.only(
+        'id', 'title', 'institution_name').in_bulk(experiment_ids)
+    owners, groups = Experiment.safe.owners_and_groups(experiment_ids)
 
     # Select only the bits we want from the models
     facility_data = []
     for dataset in dataset_objects:
         instrument = dataset.instrument
         facility = instrument.facility
-        try:
-            parent_experiment = dataset.experiments.all()[:1].get()
-        except Experiment.DoesNotExist:
+        parent_experiment = experiments.get(dataset.parent_experiment_id)
+        if parent_experiment is None:
             logger.warning("Not listing dataset id %s in Facility Overview",
                            dataset.id)
             continue
 
-        owners = parent_experiment.get_owners()
-        groups = parent_experiment.get_groups()
-
         dataset_info = dataset_aggregate_info(dataset)
 
         obj = {
@@ -185,8 +191,11 @@ def facility_overview_experiments(request, facility_id, start_index,
             "size": dataset_info['dataset_size'],
             "verified_datafiles_count": dataset_info['verified_datafiles_count'],
             "verified_datafiles_size": dataset_info['verified_datafiles_size'],
-            "owner": ', '.join([o.username for o in owners]),
-            "group": ', '.join([g.name for g in groups]),
+            "owner": ', '.join(
+                owner.username
+                for owner in owners.get(parent_experiment.id, [])),
+            "group": ', '.join(
+                group.name for group in groups.get(parent_experiment.id, [])),
             "instrument": {
                 "id": instrument.id,
                 "name": instrument.name,
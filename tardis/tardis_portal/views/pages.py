@@ -2,6 +2,7 @@
 views that render full pages
 """
 
+import json
 import logging
 import re
 from os import path
@@ -15,10 +16,10 @@ from django.contrib.sites.shortcuts import get_current_site
 from django.core.exceptions import PermissionDenied, ImproperlyConfigured
 from django.core.paginator import Paginator, EmptyPage, InvalidPage
 from django.urls import reverse
-from django.db import connection
+from django.db.models import Count, Sum
 from django.http import (HttpResponse,
                          HttpResponseForbidden,
-                         JsonResponse)
+                         StreamingHttpResponse)
 from django.views.decorators.cache import cache_page
 from django.views.generic.base import TemplateView, View
 
@@ -29,12 +30,13 @@ from ..auth.decorators import (
 )
 from ..auth.localdb_auth import django_user
 from ..forms import ExperimentForm, DatasetForm
-from ..models import Experiment, Dataset, DataFile, ObjectACL
+from ..models import Experiment, Dataset, ObjectACL
 from ..shortcuts import render_response_index, \
     return_response_error, return_response_not_found, get_experiment_referer
 from ..views.utils import (
     _redirect_303, _add_protocols_and_organizations, HttpResponseSeeAlso)
-from ..util import get_filesystem_safe_dataset_name
+from ..util import (get_filesystem_safe_dataset_name,
+                    get_filesystem_safe_experiment_name)
 
 logger = logging.getLogger(__name__)
 
@@ -269,7 +271,7 @@ class DatasetView(TemplateView):
             carousel_slice = ":%s" % max_images_in_carousel
         else:
             carousel_slice = ":"
-        datafile_count = dataset.datafile_set.count()
+        datafile_count = dataset.file_count
 
         c.update(
             {'dataset': dataset,
@@ -605,21 +607,17 @@ class ExperimentView(TemplateView):
 @login_required
 @permission_required('is_superuser')
 def stats(request):
-    # using count() is more efficient than using len() on a query set
-    cursor = connection.cursor()
-    if cursor.db.vendor == 'postgresql':
-        cursor.execute("SELECT SUM(size::bigint) FROM tardis_portal_datafile")
-        try:
-            datafile_size = int(cursor.fetchone()[0])
-        except TypeError:
-            datafile_size = 0
-    else:
-        datafile_size = DataFile.sum_sizes(DataFile.objects.all())
+    # The file counts and sizes are summed from the datasets' aggregates
+    # rather than from all DataFiles
+    totals = Dataset.objects.aggregate(
+        dataset_count=Count('id'),
+        datafile_count=Sum('file_count'),
+        datafile_size=Sum('size'))
     c = {
         'experiment_count': Experiment.objects.all().count(),
-        'dataset_count': Dataset.objects.all().count(),
-        'datafile_count': DataFile.objects.all().count(),
-        'datafile_size': datafile_size,
+        'dataset_count': totals['dataset_count'],
+        'datafile_count': totals['datafile_count'] or 0,
+        'datafile_size': totals['datafile_size'] or 0,
     }
     return render_response_index(request, 'tardis_portal/stats.html', c)
 
@@ -803,15 +801,92 @@ def edit_dataset(request, dataset_id):
         request, 'tardis_portal/add_or_edit_dataset.html', c)
 
 
-def _get_dataset_checksums(dataset, type='md5'):
-    valid_types = ['md5', 'sha512']
-    if type not in valid_types:
+_CHECKSUM_TYPES = ('md5', 'sha512')
+
+
+def _iter_checksums(datafiles, checksum_type, with_dataset=False):
+    '''
+    Yields (checksum, path) tuples for DataFiles.  Only the columns needed
+    are fetched, a chunk at a time (with a server-side cursor where the
+    database supports one), so the DataFiles are never all in memory.
+
+    With with_dataset, paths start with the DataFile's dataset ID, as for
+    the files of an experiment.
+    '''
+    rows = datafiles.order_by('dataset_id', 'directory', 'filename', 'id') \
+        .values_list('dataset_id', 'directory', 'filename',
+                     checksum_type + 'sum') \
+        .iterator(chunk_size=2000)
+    for dataset_id, directory, filename, checksum in rows:
+        file_path = path.join(directory or '', filename)
+        if with_dataset:
+            file_path = path.join(str(dataset_id), file_path)
+        yield checksum, file_path
+
+
+def _iter_text_manifest(checksums):
+    for checksum, file_path in checksums:
+        yield "%s  %s\n" % (checksum, file_path)
+    yield '\n'
+
+
+def _iter_bagit_manifest(checksums):
+    '''
+    Yields the lines of a BagIt payload manifest (RFC 8493), omitting files
+    without a checksum of the requested type
+    '''
+    for checksum, file_path in checksums:
+        if not checksum:
+            continue
+        file_path = file_path.replace('%', '%25') \
+            .replace('\r', '%0D').replace('\n', '%0A')
+        yield "%s  data/%s\n" % (checksum, file_path)
+
+
+def _iter_json_manifest(checksums, checksum_type):
+    yield '{"checksums": ['
+    separator = ''
+    for checksum, file_path in checksums:
+        yield separator + json.dumps(
+            {'checksum': checksum, 'file': file_path, 'type': checksum_type})
+        separator = ', '
+    yield ']}'
+
+
+def _checksums_response(request, datafiles, name, with_dataset=False):
+    '''
+    Streams a checksum manifest for DataFiles in the checksum type and
+    format requested in the query string
+    '''
+    checksum_type = request.GET.get('type', 'md5')
+    manifest_format = request.GET.get('format', 'text')
+    if checksum_type not in _CHECKSUM_TYPES:
         raise ValueError('Invalid checksum type (%s). Valid values are %s' %
-                         (type, ', '.join(valid_types)))
-    hash_attr = type+'sum'
-    checksums = [(getattr(df, hash_attr), path.join(df.directory or '', df.filename))
-                 for df in dataset.get_datafiles()]
-    return checksums
+                         (checksum_type, ', '.join(_CHECKSUM_TYPES)))
+
+    checksums = _iter_checksums(datafiles, checksum_type, with_dataset)
+    if manifest_format == 'text':
+        response = StreamingHttpResponse(
+            _iter_text_manifest(checksums), content_type='text/plain')
+        response['Content-Disposition'] = \
+            'attachment; filename="%s-manifest-%s.txt"' % (
+                name, checksum_type)
+        return response
+
+    if manifest_format == 'bagit':
+        response = StreamingHttpResponse(
+            _iter_bagit_manifest(checksums), content_type='text/plain')
+        response['Content-Disposition'] = \
+            'attachment; filename="manifest-%s.txt"' % checksum_type
+        return response
+
+    if manifest_format == 'json':
+        return StreamingHttpResponse(
+            _iter_json_manifest(checksums, checksum_type),
+            content_type='application/json')
+
+    raise ValueError(
+        "Invalid format. Valid formats are 'text', 'bagit' or 'json'")
 
 
 @authz.dataset_access_required  # too complex # noqa
@@ -820,25 +895,19 @@ def checksums_download(request, dataset_id, **kwargs):
     if not dataset:
         return return_response_not_found(request)
 
-    type = request.GET.get('type', 'md5')
-    format = request.GET.get('format', 'text')
-
-    checksums = _get_dataset_checksums(dataset, type)
-    if format == 'text':
-        checksum_doc = ''.join(["%s  %s\n" % c for c in checksums])
-        checksum_doc += '\n'
-        response = HttpResponse(checksum_doc, content_type='text/plain')
-        response['Content-Disposition'] = \
-            '%s; filename="%s-manifest-md5.txt"' % (
-            'attachment',
-            get_filesystem_safe_dataset_name(dataset))
-        return response
+    return _checksums_response(
+        request, dataset.get_datafiles(),
+        get_filesystem_safe_dataset_name(dataset))
 
-    if format == 'json':
-        jdict = {'checksums': []}
-        for c in checksums:
-            jdict['checksums'].append({'checksum': c[0], 'file': c[1], 'type': type})
 
-        return JsonResponse(jdict)
+@authz.experiment_access_required
+def experiment_checksums_download(request, experiment_id, **kwargs):
+    '''
+    Streams a checksum manifest for all of the files in an experiment, with
+    their paths starting with their dataset IDs
+    '''
+    experiment = Experiment.objects.get(id=experiment_id)
 
-    raise ValueError("Invalid format. Valid formats are 'text' or 'json'")
+    return _checksums_response(
+        request, experiment.get_datafiles(),
+        get_filesystem_safe_experiment_name(experiment), with_dataset=True)
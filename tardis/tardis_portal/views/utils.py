@@ -61,14 +61,11 @@ def get_dataset_info(dataset, include_thumbnail=False, exclude=None):  # too com
     # returns a queryset rather than a list of primary keys for ManyToManyFields
     obj['experiments'] = [exp.id for exp in obj['experiments']]
 
-    if exclude is None or 'datafiles' not in exclude or 'file_count' \
-       not in exclude:
-        datafiles = list(
+    if exclude is None or 'datafiles' not in exclude:
+        obj['datafiles'] = list(
             dataset.datafile_set.values_list('id', flat=True))
-        if exclude is None or 'datafiles' not in exclude:
-            obj['datafiles'] = datafiles
-        if exclude is None or 'file_count' not in exclude:
-            obj['file_count'] = len(datafiles)
+    if exclude is None or 'file_count' not in exclude:
+        obj['file_count'] = dataset.file_count
 
     obj['url'] = dataset.get_absolute_url()
 
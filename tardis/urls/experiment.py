@@ -22,7 +22,8 @@ from tardis.tardis_portal.views import (
     retrieve_access_list_tokens,
     create_token,
     view_rifcs,
-    add_dataset
+    add_dataset,
+    experiment_checksums_download
 )
 
 user_pattern = '[\w\-][\w\-\.]+(@[\w\-][\w\-\.]+[a-zA-Z]{1,4})*'
@@ -75,4 +76,6 @@ experiment_urls = [
         name='tardis.tardis_portal.views.control_panel.view_rifcs'),
     url(r'^(?P<experiment_id>\d+)/add-dataset$', add_dataset,
         name='tardis.tardis_portal.views.add_dataset'),
+    url(r'^(?P<experiment_id>\d+)/checksums$', experiment_checksums_download,
+        name='tardis_portal.experiment_checksums'),
 ]